@@ -0,0 +1,160 @@
+"""
+Media streaming memory benchmark
+Compares peak server RSS while serving 50 concurrent downloads of a 30 MB
+GridFS file, using the legacy read-whole-file path and the chunked
+MediaStore path.
+
+Usage (requires a running MongoDB, Linux for /proc):
+    MONGO_URL=mongodb://localhost:27017 python benchmark_media_streaming.py
+"""
+
+import os
+import io
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+BENCH_DB = os.environ.get('BENCH_DB_NAME', 'pompiconni_media_benchmark')
+FILE_SIZE_MB = int(os.environ.get('BENCH_FILE_SIZE_MB', '30'))
+CONCURRENCY = int(os.environ.get('BENCH_CONCURRENCY', '50'))
+BASE_PORT = int(os.environ.get('BENCH_PORT', '8765'))
+
+
+def build_app(mode: str):
+    """Minimal app with one download route implemented the legacy or streaming way"""
+    from bson import ObjectId
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+    from media_storage import MediaStore
+
+    db = AsyncIOMotorClient(MONGO_URL)[BENCH_DB]
+    bucket = AsyncIOMotorGridFSBucket(db)
+    store = MediaStore(db)
+    app = FastAPI()
+
+    @app.get("/file/{file_id}")
+    async def download(file_id: str):
+        if mode == "legacy":
+            grid_out = await bucket.open_download_stream(ObjectId(file_id))
+            content = await grid_out.read()
+            return StreamingResponse(io.BytesIO(content), media_type="application/pdf")
+        file_doc = await store.find(file_id)
+        return StreamingResponse(
+            store.iter_chunks(file_doc),
+            media_type="application/pdf",
+            headers={"Content-Length": str(file_doc['length'])}
+        )
+
+    return app
+
+
+def read_proc_status(pid: int) -> dict:
+    """Return VmRSS / VmHWM (kB) for a process"""
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS", "VmHWM")):
+                key, value = line.split(":")
+                values[key] = int(value.split()[0])
+    return values
+
+
+async def seed_file() -> str:
+    db = AsyncIOMotorClient(MONGO_URL)[BENCH_DB]
+    bucket = AsyncIOMotorGridFSBucket(db)
+    payload = os.urandom(FILE_SIZE_MB * 1024 * 1024)
+    file_id = await bucket.upload_from_stream(
+        "benchmark.pdf", io.BytesIO(payload), metadata={"content_type": "application/pdf"}
+    )
+    return str(file_id)
+
+
+async def drop_database():
+    await AsyncIOMotorClient(MONGO_URL).drop_database(BENCH_DB)
+
+
+async def run_downloads(port: int, file_id: str) -> float:
+    import httpx
+
+    expected = FILE_SIZE_MB * 1024 * 1024
+
+    async def one(client):
+        received = 0
+        async with client.stream("GET", f"http://127.0.0.1:{port}/file/{file_id}") as response:
+            response.raise_for_status()
+            async for block in response.aiter_bytes():
+                received += len(block)
+        if received != expected:
+            raise RuntimeError(f"Ricevuti {received} byte, attesi {expected}")
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=600) as client:
+        await asyncio.gather(*[one(client) for _ in range(CONCURRENCY)])
+    return time.perf_counter() - started
+
+
+def wait_for_port(port: int, timeout: float = 20.0):
+    import socket
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError(f"Server non raggiungibile sulla porta {port}")
+
+
+def benchmark_mode(mode: str, port: int, file_id: str) -> dict:
+    server = subprocess.Popen(
+        [sys.executable, __file__, "--serve", mode, "--port", str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    try:
+        wait_for_port(port)
+        idle = read_proc_status(server.pid)
+        elapsed = asyncio.run(run_downloads(port, file_id))
+        peak = read_proc_status(server.pid)
+        return {
+            "mode": mode,
+            "idle_rss_mb": idle["VmRSS"] / 1024,
+            "peak_rss_mb": peak["VmHWM"] / 1024,
+            "seconds": elapsed,
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--serve", choices=["legacy", "streaming"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=BASE_PORT, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        import uvicorn
+        uvicorn.run(build_app(args.serve), host="127.0.0.1", port=args.port, log_level="warning")
+        return
+
+    file_id = asyncio.run(seed_file())
+    try:
+        results = [
+            benchmark_mode("legacy", BASE_PORT, file_id),
+            benchmark_mode("streaming", BASE_PORT + 1, file_id),
+        ]
+    finally:
+        asyncio.run(drop_database())
+
+    print(f"\n{CONCURRENCY} download concorrenti di un file da {FILE_SIZE_MB} MB")
+    print(f"{'mode':<12}{'idle RSS MB':>14}{'peak RSS MB':>14}{'seconds':>10}")
+    for r in results:
+        print(f"{r['mode']:<12}{r['idle_rss_mb']:>14.1f}{r['peak_rss_mb']:>14.1f}{r['seconds']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
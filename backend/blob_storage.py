@@ -0,0 +1,452 @@
+"""
+Blob storage backends for Poppiconni
+Where the bytes of stored media live: GridFS chunks, a local directory or an
+S3-compatible bucket (AWS, MinIO). The files documents (length, upload date,
+metadata, sha256) stay in the GridFS files collection whatever the backend;
+`backend` on a document names the one holding its content, GridFS when
+absent. Within a backend, files are grouped in buckets by class (`bucket` on
+the document, the default GridFS bucket "fs" when absent): a chunks
+collection, a subdirectory or a key prefix each. MEDIA_STORAGE_BACKEND picks
+where new files are written, existing files are moved with
+migrate_media_storage.py. Files nobody requested for a while are moved to the
+"cold" backend: zlib-compressed copies in a local directory or S3 prefix of
+their own (MEDIA_COLD_STORAGE), read back transparently.
+"""
+
+import os
+import zlib
+import shutil
+import asyncio
+import logging
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Tuple
+
+import aiofiles
+from bson import Binary, ObjectId
+from gridfs.errors import CorruptGridFile
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("gridfs", "local", "s3")
+
+# Compressed tier of files not requested for a while; never a write backend
+COLD_BACKEND = "cold"
+
+# Bucket of files stored before storage classes: the GridFS default bucket, the root of the others
+DEFAULT_BUCKET = "fs"
+
+# Backend of newly stored files
+MEDIA_STORAGE_BACKEND = os.environ.get('MEDIA_STORAGE_BACKEND', 'gridfs').strip().lower()
+
+MEDIA_LOCAL_ROOT = os.environ.get('MEDIA_LOCAL_ROOT', '/var/lib/poppiconni/media')
+
+MEDIA_S3_BUCKET = os.environ.get('MEDIA_S3_BUCKET', '')
+MEDIA_S3_PREFIX = os.environ.get('MEDIA_S3_PREFIX', 'media/')
+# Set for MinIO or any other S3-compatible service, empty for AWS
+MEDIA_S3_ENDPOINT_URL = os.environ.get('MEDIA_S3_ENDPOINT_URL') or None
+MEDIA_S3_REGION = os.environ.get('MEDIA_S3_REGION') or None
+
+# Where the cold tier lives ("local" or "s3") and its own root / key prefix
+MEDIA_COLD_STORAGE = os.environ.get('MEDIA_COLD_STORAGE', 'local').strip().lower()
+MEDIA_COLD_LOCAL_ROOT = os.environ.get('MEDIA_COLD_LOCAL_ROOT', '/var/lib/poppiconni/media-cold')
+MEDIA_COLD_S3_PREFIX = os.environ.get('MEDIA_COLD_S3_PREFIX', 'cold/')
+COLD_COMPRESSION_LEVEL = 6
+
+# Number of GridFS chunks fetched per cursor batch while streaming.
+# Per-request memory stays bounded by STREAM_BATCH_CHUNKS * chunkSize of the file's bucket.
+STREAM_BATCH_CHUNKS = int(os.environ.get('MEDIA_STREAM_BATCH_CHUNKS', '2'))
+
+# chunkSize of the default GridFS bucket
+GRIDFS_CHUNK_SIZE = 255 * 1024
+
+# Bytes read per step from local files and S3 objects
+READ_BLOCK_SIZE = 256 * 1024
+
+# Size of multipart upload parts (S3 requires at least 5 MB for all but the last)
+S3_PART_SIZE = 8 * 1024 * 1024
+S3_DELETE_BATCH = 1000
+
+
+def backend_name(file_doc: dict) -> str:
+    """Backend holding the content of a files document"""
+    return file_doc.get('backend') or "gridfs"
+
+
+def bucket_name(file_doc: dict) -> str:
+    """Bucket (storage class) of a files document"""
+    return file_doc.get('bucket') or DEFAULT_BUCKET
+
+
+class BlobWriter:
+    """Sequential writer of one blob: write() any number of times, then close() or abort()"""
+
+    async def write(self, data: bytes):
+        raise NotImplementedError
+
+    async def close(self) -> dict:
+        """Make the blob readable; returns the fields to store on its files document"""
+        raise NotImplementedError
+
+    async def abort(self):
+        """Remove whatever was written so far"""
+        raise NotImplementedError
+
+
+class BlobBackend:
+    """Storage of file contents, addressed by the id of their files document"""
+    name = ""
+
+    def open_writer(self, file_id: ObjectId) -> BlobWriter:
+        raise NotImplementedError
+
+    def iter_range(self, file_doc: dict, start: int, end: int) -> AsyncIterator[bytes]:
+        """Yield bytes [start, end] (inclusive, already clamped to the file length) of a file"""
+        raise NotImplementedError
+
+    async def delete_many(self, file_ids: List[ObjectId]):
+        """Remove the contents of the given files; missing ones are ignored"""
+        raise NotImplementedError
+
+    async def drop(self):
+        """Remove every content of the bucket at once"""
+        raise NotImplementedError
+
+
+class GridFSWriter(BlobWriter):
+    def __init__(self, chunks, file_id: ObjectId, chunk_size: int):
+        self.chunks = chunks
+        self.file_id = file_id
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.n = 0
+
+    async def _flush(self, data: bytes):
+        await self.chunks.insert_one({"files_id": self.file_id, "n": self.n, "data": Binary(data)})
+        self.n += 1
+
+    async def write(self, data: bytes):
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            await self._flush(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+
+    async def close(self) -> dict:
+        if self.buffer:
+            await self._flush(bytes(self.buffer))
+            self.buffer.clear()
+        return {"chunkSize": self.chunk_size}
+
+    async def abort(self):
+        await self.chunks.delete_many({"files_id": self.file_id})
+
+
+class GridFSBackend(BlobBackend):
+    """Contents in the chunks collection of a GridFS bucket, written with the bucket's chunk size"""
+    name = "gridfs"
+
+    def __init__(self, chunks, chunk_size: int = GRIDFS_CHUNK_SIZE):
+        self.chunks = chunks
+        self.chunk_size = chunk_size
+
+    def open_writer(self, file_id: ObjectId) -> BlobWriter:
+        return GridFSWriter(self.chunks, file_id, self.chunk_size)
+
+    async def iter_range(self, file_doc: dict, start: int, end: int) -> AsyncIterator[bytes]:
+        """One GridFS chunk at a time; only the chunks covering the span are fetched"""
+        chunk_size = file_doc['chunkSize']
+        first_n = start // chunk_size
+        last_n = end // chunk_size
+
+        cursor = self.chunks.find(
+            {"files_id": file_doc['_id'], "n": {"$gte": first_n, "$lte": last_n}},
+            {"_id": 0, "n": 1, "data": 1},
+            batch_size=STREAM_BATCH_CHUNKS
+        ).sort("n", 1)
+
+        expected_n = first_n
+        async for chunk in cursor:
+            if chunk['n'] != expected_n:
+                raise CorruptGridFile(f"Chunk {expected_n} mancante per il file {file_doc['_id']}")
+            data = chunk['data']
+            chunk_offset = expected_n * chunk_size
+            lo = max(start - chunk_offset, 0)
+            hi = min(end - chunk_offset + 1, len(data))
+            yield bytes(data[lo:hi])
+            expected_n += 1
+
+        if expected_n != last_n + 1:
+            raise CorruptGridFile(f"File {file_doc['_id']} troncato al chunk {expected_n}")
+
+    async def delete_many(self, file_ids: List[ObjectId]):
+        await self.chunks.delete_many({"files_id": {"$in": list(file_ids)}})
+
+    async def drop(self):
+        await self.chunks.drop()
+
+
+class LocalWriter(BlobWriter):
+    def __init__(self, path: Path):
+        self.path = path
+        self.partial = path.with_name(path.name + ".part")
+        self.handle = None
+
+    async def write(self, data: bytes):
+        if self.handle is None:
+            self.partial.parent.mkdir(parents=True, exist_ok=True)
+            self.handle = await aiofiles.open(self.partial, "wb")
+        await self.handle.write(data)
+
+    async def close(self) -> dict:
+        if self.handle is None:
+            await self.write(b"")
+        await self.handle.close()
+        # Readers only ever see complete files
+        os.replace(self.partial, self.path)
+        return {}
+
+    async def abort(self):
+        if self.handle is not None:
+            await self.handle.close()
+        self.partial.unlink(missing_ok=True)
+
+
+class LocalBackend(BlobBackend):
+    """Contents as files under a local directory (or a shared volume mounted by every worker)"""
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def path(self, file_id) -> Path:
+        # ObjectIds start with a timestamp: fan out on the last characters instead
+        key = str(file_id)
+        return self.root / key[-2:] / key
+
+    def open_writer(self, file_id: ObjectId) -> BlobWriter:
+        return LocalWriter(self.path(file_id))
+
+    async def iter_range(self, file_doc: dict, start: int, end: int) -> AsyncIterator[bytes]:
+        try:
+            handle = await aiofiles.open(self.path(file_doc['_id']), "rb")
+        except FileNotFoundError:
+            raise CorruptGridFile(f"Contenuto del file {file_doc['_id']} mancante")
+        try:
+            await handle.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = await handle.read(min(READ_BLOCK_SIZE, remaining))
+                if not data:
+                    raise CorruptGridFile(f"File {file_doc['_id']} troncato a {end - remaining + 1} byte")
+                remaining -= len(data)
+                yield data
+        finally:
+            await handle.close()
+
+    async def delete_many(self, file_ids: List[ObjectId]):
+        def unlink_all():
+            for file_id in file_ids:
+                self.path(file_id).unlink(missing_ok=True)
+        await asyncio.to_thread(unlink_all)
+
+    async def drop(self):
+        await asyncio.to_thread(shutil.rmtree, self.root, True)
+
+
+class S3Writer(BlobWriter):
+    """put_object for small files, a multipart upload once the first part is full"""
+
+    def __init__(self, backend: "S3Backend", file_id: ObjectId):
+        self.backend = backend
+        self.key = backend.key(file_id)
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+
+    async def _upload_part(self, data: bytes):
+        client, bucket = self.backend.client, self.backend.bucket
+        if self.upload_id is None:
+            response = await asyncio.to_thread(client.create_multipart_upload, Bucket=bucket, Key=self.key)
+            self.upload_id = response['UploadId']
+        number = len(self.parts) + 1
+        response = await asyncio.to_thread(
+            client.upload_part, Bucket=bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=data
+        )
+        self.parts.append({"PartNumber": number, "ETag": response['ETag']})
+
+    async def write(self, data: bytes):
+        self.buffer += data
+        while len(self.buffer) >= S3_PART_SIZE:
+            await self._upload_part(bytes(self.buffer[:S3_PART_SIZE]))
+            del self.buffer[:S3_PART_SIZE]
+
+    async def close(self) -> dict:
+        client, bucket = self.backend.client, self.backend.bucket
+        if self.upload_id is None:
+            await asyncio.to_thread(client.put_object, Bucket=bucket, Key=self.key, Body=bytes(self.buffer))
+        else:
+            if self.buffer:
+                await self._upload_part(bytes(self.buffer))
+            await asyncio.to_thread(
+                client.complete_multipart_upload, Bucket=bucket, Key=self.key,
+                UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+            )
+        self.buffer.clear()
+        return {}
+
+    async def abort(self):
+        if self.upload_id is not None:
+            await asyncio.to_thread(
+                self.backend.client.abort_multipart_upload,
+                Bucket=self.backend.bucket, Key=self.key, UploadId=self.upload_id
+            )
+
+
+class S3Backend(BlobBackend):
+    """Contents as objects of an S3-compatible bucket; boto3 calls run in the default thread pool"""
+    name = "s3"
+
+    def __init__(self, client, bucket: str, prefix: str = ""):
+        if not bucket:
+            raise ValueError("MEDIA_S3_BUCKET non configurato")
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def key(self, file_id) -> str:
+        return f"{self.prefix}{file_id}"
+
+    def open_writer(self, file_id: ObjectId) -> BlobWriter:
+        return S3Writer(self, file_id)
+
+    async def iter_range(self, file_doc: dict, start: int, end: int) -> AsyncIterator[bytes]:
+        try:
+            response = await asyncio.to_thread(
+                self.client.get_object, Bucket=self.bucket, Key=self.key(file_doc['_id']), Range=f"bytes={start}-{end}"
+            )
+        except self.client.exceptions.NoSuchKey:
+            raise CorruptGridFile(f"Contenuto del file {file_doc['_id']} mancante")
+        body = response['Body']
+        try:
+            while True:
+                data = await asyncio.to_thread(body.read, READ_BLOCK_SIZE)
+                if not data:
+                    break
+                yield data
+        finally:
+            body.close()
+
+    async def delete_many(self, file_ids: List[ObjectId]):
+        keys = [{"Key": self.key(file_id)} for file_id in file_ids]
+        for i in range(0, len(keys), S3_DELETE_BATCH):
+            await asyncio.to_thread(
+                self.client.delete_objects, Bucket=self.bucket,
+                Delete={"Objects": keys[i:i + S3_DELETE_BATCH], "Quiet": True}
+            )
+
+    async def drop(self):
+        def delete_prefix():
+            paginator = self.client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix, PaginationConfig={"PageSize": S3_DELETE_BATCH}):
+                keys = [{"Key": obj['Key']} for obj in page.get('Contents', [])]
+                if keys:
+                    self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys, "Quiet": True})
+        await asyncio.to_thread(delete_prefix)
+
+
+class CompressedWriter(BlobWriter):
+    def __init__(self, writer: BlobWriter):
+        self.writer = writer
+        self.compressor = zlib.compressobj(COLD_COMPRESSION_LEVEL)
+        self.stored = 0
+
+    async def _write(self, data: bytes):
+        if data:
+            self.stored += len(data)
+            await self.writer.write(data)
+
+    async def write(self, data: bytes):
+        await self._write(await asyncio.to_thread(self.compressor.compress, data))
+
+    async def close(self) -> dict:
+        await self._write(self.compressor.flush())
+        return {**await self.writer.close(), "coldLength": self.stored}
+
+    async def abort(self):
+        await self.writer.abort()
+
+
+class CompressedBackend(BlobBackend):
+    """
+    zlib-compressed contents in another backend (the cold tier). coldLength on the files document is
+    the stored size; a range read decompresses from the start of the file, fine for rarely read files.
+    """
+    name = COLD_BACKEND
+
+    def __init__(self, inner: BlobBackend):
+        self.inner = inner
+
+    def open_writer(self, file_id: ObjectId) -> BlobWriter:
+        return CompressedWriter(self.inner.open_writer(file_id))
+
+    async def iter_range(self, file_doc: dict, start: int, end: int) -> AsyncIterator[bytes]:
+        decompressor = zlib.decompressobj()
+        offset = 0
+        stored = self.inner.iter_range(file_doc, 0, file_doc['coldLength'] - 1)
+        try:
+            async for data in stored:
+                data = await asyncio.to_thread(decompressor.decompress, data)
+                lo, hi = max(start - offset, 0), min(end - offset + 1, len(data))
+                offset += len(data)
+                if lo < hi:
+                    yield data[lo:hi]
+                if offset > end:
+                    return
+        finally:
+            await stored.aclose()
+        if offset <= end:
+            raise CorruptGridFile(f"File {file_doc['_id']} troncato a {offset} byte")
+
+    async def delete_many(self, file_ids: List[ObjectId]):
+        await self.inner.delete_many(file_ids)
+
+    async def drop(self):
+        await self.inner.drop()
+
+
+# Local / S3 backends per bucket and the S3 client they share, created on first use
+_backends: Dict[Tuple[str, str], BlobBackend] = {}
+_s3_client = None
+
+
+def external_backend(name: str, bucket: str = DEFAULT_BUCKET) -> BlobBackend:
+    """
+    Local, S3 or cold backend configured from the environment, for one bucket: files of the default
+    bucket sit at the root / prefix, the others in a subdirectory / sub-prefix named after it.
+    """
+    if (name, bucket) not in _backends:
+        if name == COLD_BACKEND:
+            if MEDIA_COLD_STORAGE not in ("local", "s3"):
+                raise ValueError(f"Storage del livello freddo sconosciuto: {MEDIA_COLD_STORAGE}")
+            root, prefix = (MEDIA_COLD_LOCAL_ROOT, MEDIA_COLD_S3_PREFIX) if bucket == DEFAULT_BUCKET else (
+                os.path.join(MEDIA_COLD_LOCAL_ROOT, bucket), f"{MEDIA_COLD_S3_PREFIX}{bucket}/"
+            )
+            inner = LocalBackend(root) if MEDIA_COLD_STORAGE == "local" else S3Backend(_s3(), MEDIA_S3_BUCKET, prefix)
+            _backends[name, bucket] = CompressedBackend(inner)
+        elif name == "local":
+            root = MEDIA_LOCAL_ROOT if bucket == DEFAULT_BUCKET else os.path.join(MEDIA_LOCAL_ROOT, bucket)
+            _backends[name, bucket] = LocalBackend(root)
+        elif name == "s3":
+            prefix = MEDIA_S3_PREFIX if bucket == DEFAULT_BUCKET else f"{MEDIA_S3_PREFIX}{bucket}/"
+            _backends[name, bucket] = S3Backend(_s3(), MEDIA_S3_BUCKET, prefix)
+        else:
+            raise ValueError(f"Backend di storage sconosciuto: {name}")
+    return _backends[name, bucket]
+
+
+def _s3():
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+
+        _s3_client = boto3.client("s3", endpoint_url=MEDIA_S3_ENDPOINT_URL, region_name=MEDIA_S3_REGION)
+    return _s3_client
@@ -0,0 +1,214 @@
+"""
+Bulk import of illustrations for Poppiconni
+Reads an import package, a ZIP archive or a directory on the server, holding
+images, PDFs and a manifest (manifest.json or manifest.csv) with one row per
+illustration: title, themeId, description, isFree, price and the image and/or
+pdf entry of the package. Entries are read one at a time, never the whole
+package; storing them and creating the illustrations is left to the server.
+"""
+
+import os
+import csv
+import json
+import zipfile
+import posixpath
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+MANIFEST_NAMES = ("manifest.json", "manifest.csv")
+IMAGE_EXTENSIONS = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+PDF_EXTENSION = ".pdf"
+TRUE_VALUES = ("1", "true", "yes", "si", "sì", "y", "x")
+
+
+class BulkImportError(ValueError):
+    """Package or manifest that cannot be imported"""
+
+
+@dataclass
+class ImportRow:
+    """One illustration of the manifest (line: CSV line or JSON position, for the report)"""
+    line: int
+    title: str
+    theme_id: str
+    description: str = ""
+    is_free: bool = True
+    price: float = 0.99
+    image: Optional[str] = None
+    pdf: Optional[str] = None
+
+
+class ImportSource:
+    """Entries of an import package by name (POSIX paths relative to its root)"""
+
+    def names(self) -> List[str]:
+        raise NotImplementedError
+
+    def read(self, name: str, max_bytes: int) -> bytes:
+        """Content of an entry; raises BulkImportError if missing or above max_bytes. Blocking."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ZipSource(ImportSource):
+    def __init__(self, path: str):
+        try:
+            self.zip = zipfile.ZipFile(path)
+        except (zipfile.BadZipFile, OSError) as e:
+            raise BulkImportError(f"Archivio ZIP non valido: {str(e)}")
+        self.entries = {posixpath.normpath(info.filename): info for info in self.zip.infolist() if not info.is_dir()}
+
+    def names(self) -> List[str]:
+        return list(self.entries)
+
+    def read(self, name: str, max_bytes: int) -> bytes:
+        info = self.entries.get(name)
+        if info is None:
+            raise BulkImportError(f"File non presente nel pacchetto: {name}")
+        if info.file_size > max_bytes:
+            raise BulkImportError(f"File troppo grande: {name}")
+        # The declared size can lie (zip bombs): never read past the limit
+        with self.zip.open(info) as entry:
+            data = entry.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            raise BulkImportError(f"File troppo grande: {name}")
+        return data
+
+    def close(self):
+        self.zip.close()
+
+
+class DirectorySource(ImportSource):
+    def __init__(self, path: str):
+        self.root = Path(path).resolve()
+
+    def _path(self, name: str) -> Path:
+        path = (self.root / name).resolve()
+        if self.root not in path.parents:
+            raise BulkImportError(f"File non presente nel pacchetto: {name}")
+        return path
+
+    def names(self) -> List[str]:
+        return [p.relative_to(self.root).as_posix() for p in self.root.rglob("*") if p.is_file()]
+
+    def read(self, name: str, max_bytes: int) -> bytes:
+        path = self._path(name)
+        if not path.is_file():
+            raise BulkImportError(f"File non presente nel pacchetto: {name}")
+        with open(path, "rb") as handle:
+            data = handle.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            raise BulkImportError(f"File troppo grande: {name}")
+        return data
+
+
+def open_import_source(path: str) -> ImportSource:
+    """ZIP archive or directory at path"""
+    if os.path.isdir(path):
+        return DirectorySource(path)
+    if os.path.isfile(path):
+        return ZipSource(path)
+    raise BulkImportError(f"Percorso non trovato: {path}")
+
+
+def resolve_import_path(path: str, root: str) -> str:
+    """Server-side package path, which must be inside root (BULK_IMPORT_ROOT)"""
+    if not root:
+        raise BulkImportError("Import da percorso del server non abilitato (BULK_IMPORT_ROOT)")
+    base = Path(root).resolve()
+    resolved = (base / path).resolve()
+    if resolved != base and base not in resolved.parents:
+        raise BulkImportError("Percorso fuori dalla directory di import")
+    return str(resolved)
+
+
+def _manifest_name(source: ImportSource) -> str:
+    """The manifest at the package root, or in its only top-level folder (ZIP of a folder)"""
+    names = source.names()
+    for manifest in MANIFEST_NAMES:
+        candidates = [name for name in names if posixpath.basename(name) == manifest]
+        candidates.sort(key=lambda name: name.count("/"))
+        if candidates and candidates[0].count("/") <= 1:
+            return candidates[0]
+    raise BulkImportError(f"Manifest mancante ({' o '.join(MANIFEST_NAMES)})")
+
+
+def _flag(value, default: bool) -> bool:
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+def _entry(value, base: str) -> Optional[str]:
+    value = str(value or "").strip()
+    return posixpath.normpath(posixpath.join(base, value.lstrip("/"))) if value else None
+
+
+def _row(line: int, record: dict, base: str) -> ImportRow:
+    title = str(record.get("title") or "").strip()
+    theme_id = str(record.get("themeId") or "").strip()
+    if not title or not theme_id:
+        raise BulkImportError("title e themeId sono obbligatori")
+    row = ImportRow(
+        line=line,
+        title=title,
+        theme_id=theme_id,
+        description=str(record.get("description") or "").strip(),
+        is_free=_flag(record.get("isFree"), True),
+        image=_entry(record.get("image"), base),
+        pdf=_entry(record.get("pdf"), base)
+    )
+    price = record.get("price")
+    if price not in (None, ""):
+        try:
+            row.price = float(str(price).replace(",", "."))
+        except ValueError:
+            raise BulkImportError(f"Prezzo non valido: {price}")
+    if not row.image and not row.pdf:
+        raise BulkImportError("Indicare almeno image o pdf")
+    if row.image and posixpath.splitext(row.image)[1].lower() not in IMAGE_EXTENSIONS:
+        raise BulkImportError(f"Immagine non supportata: {row.image} ({', '.join(IMAGE_EXTENSIONS)})")
+    if row.pdf and posixpath.splitext(row.pdf)[1].lower() != PDF_EXTENSION:
+        raise BulkImportError(f"Solo file PDF sono permessi: {row.pdf}")
+    return row
+
+
+def read_manifest(source: ImportSource, max_bytes: int) -> Tuple[List[ImportRow], List[dict]]:
+    """
+    Rows of the package manifest, paths resolved against its folder, and the rows rejected
+    ({"line", "error"}). Raises BulkImportError when the manifest itself is unreadable.
+    """
+    name = _manifest_name(source)
+    base = posixpath.dirname(name)
+    try:
+        text = source.read(name, max_bytes).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise BulkImportError("Il manifest deve essere in UTF-8")
+    if name.endswith(".json"):
+        try:
+            records = json.loads(text)
+        except ValueError as e:
+            raise BulkImportError(f"Manifest JSON non valido: {str(e)}")
+        if isinstance(records, dict):
+            records = records.get("illustrations")
+        if not isinstance(records, list):
+            raise BulkImportError("Il manifest JSON deve essere una lista di illustrazioni")
+        numbered = enumerate(records, start=1)
+    else:
+        # Line 1 is the header
+        numbered = enumerate(csv.DictReader(text.splitlines(), delimiter=";" if text.count(";") > text.count(",") else ","), start=2)
+
+    rows, rejected = [], []
+    for line, record in numbered:
+        try:
+            if not isinstance(record, dict):
+                raise BulkImportError("Riga non valida")
+            rows.append(_row(line, record, base))
+        except BulkImportError as e:
+            rejected.append({"line": line, "error": str(e)})
+    return rows, rejected
@@ -0,0 +1,451 @@
+"""
+Image derivatives for Poppiconni
+Resized / re-encoded variants of stored images (?w=&h=&fit= on the image
+endpoints), with Accept-based WebP/AVIF negotiation, tiny inline
+placeholders shown before an image loads, sprite sheets of gallery pages,
+the normalization applied to every uploaded image (pixel limit, orientation,
+sRGB 8-bit, no metadata) and the properties recorded for it. Rendering is CPU
+bound and runs in a dedicated thread pool (Pillow releases the GIL while
+decoding, resampling and encoding).
+"""
+
+import io
+import os
+import base64
+import hashlib
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageCms, ImageOps, features
+
+# Only these sizes (px) are rendered, so the derivative store stays bounded
+DERIVATIVE_SIZES = (160, 320, 480, 640, 960, 1280, 1920)
+DERIVATIVE_FITS = ("contain", "cover")
+IMAGE_DERIVATIVE_WORKERS = int(os.environ.get('IMAGE_DERIVATIVE_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Negotiated formats in order of preference, when the client accepts them
+NEGOTIABLE_FORMATS = [
+    fmt for fmt in ("image/avif", "image/webp")
+    if features.check(fmt.split("/")[1])
+]
+
+PIL_FORMATS = {
+    "image/avif": "AVIF",
+    "image/webp": "WEBP",
+    "image/jpeg": "JPEG",
+    "image/png": "PNG",
+}
+
+SAVE_OPTIONS = {
+    "AVIF": {"quality": 60},
+    "WEBP": {"quality": 80, "method": 4},
+    "JPEG": {"quality": 82, "optimize": True, "progressive": True},
+    "PNG": {"optimize": True},
+}
+
+# Longest side (px) of the inline placeholder embedded in list payloads
+PLACEHOLDER_SIZE = 16
+
+# Sprite sheets: square tiles on a fixed number of columns, capped in size
+SPRITE_TILE_SIZE = 240
+SPRITE_COLUMNS = 8
+SPRITE_MAX_TILES = 64
+
+# Uploads above this many pixels are rejected before being decoded (decompression bombs).
+# Also Pillow's own limit for every image opened by the process (PDF generation included).
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_MEGAPIXELS', '50')) * 1_000_000
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Formats accepted for upload, with the media type they are stored as
+UPLOAD_FORMATS = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+
+# Re-encoding of normalized uploads: same format as the source, metadata dropped
+NORMALIZE_OPTIONS = {
+    "JPEG": {"quality": 92, "optimize": True},
+    "PNG": {"optimize": True},
+    "WEBP": {"quality": 90, "method": 6},
+    "GIF": {"optimize": True},
+}
+
+# Modes written as they are; anything else is converted (16-bit, CMYK, LAB...)
+NORMALIZED_MODES = ("1", "L", "LA", "P", "RGB", "RGBA")
+
+# PNG modes each ICC colour space (profile header, bytes 16-19) can be embedded in; palettes are RGB
+ICC_PNG_MODES = {b"RGB ": ("RGB", "RGBA", "P"), b"GRAY": ("L", "LA", "1")}
+
+# Image.info entries dropped by normalization (EXIF incl. GPS, XMP, ICC, Photoshop blocks, comments)
+METADATA_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "icc_profile", "photoshop", "comment", "adobe", "adobe_transform")
+
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_DERIVATIVE_WORKERS, thread_name_prefix="image-derivative")
+# Background recompression of the stored corpus: one thread, so it never takes the derivative workers
+recompress_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-recompress")
+
+
+class InvalidImage(ValueError):
+    """Upload that is not a readable image in an accepted format"""
+
+
+class ImageTooLarge(InvalidImage):
+    """Upload above MAX_IMAGE_PIXELS"""
+
+    def __init__(self):
+        super().__init__(f"Immagine troppo grande: massimo {MAX_IMAGE_PIXELS // 1_000_000} megapixel")
+
+
+@dataclass(frozen=True)
+class DerivativeRequest:
+    """Size and fit asked by the client, plus its Accept header"""
+    width: Optional[int]
+    height: Optional[int]
+    fit: str = "contain"
+    accept: str = ""
+
+
+# Stored thumbnail of catalog images, same box as the pipeline's phase 4 thumbnail
+THUMBNAIL_REQUEST = DerivativeRequest(width=400, height=400)
+
+
+def parse_derivative_request(width: Optional[int], height: Optional[int], fit: Optional[str], accept: Optional[str]) -> Optional[DerivativeRequest]:
+    """
+    Validate ?w= / ?h= / ?fit= against the whitelist.
+    Returns None when no resize was asked, raises ValueError for unsupported values.
+    """
+    if width is None and height is None:
+        return None
+    for value in (width, height):
+        if value is not None and value not in DERIVATIVE_SIZES:
+            raise ValueError(f"Dimensione non supportata: usare una tra {', '.join(map(str, DERIVATIVE_SIZES))}")
+    fit = (fit or "contain").lower()
+    if fit not in DERIVATIVE_FITS:
+        raise ValueError(f"Parametro fit non valido: usare uno tra {', '.join(DERIVATIVE_FITS)}")
+    if fit == "cover" and (width is None or height is None):
+        fit = "contain"
+    return DerivativeRequest(width=width, height=height, fit=fit, accept=accept or "")
+
+
+def _accepted_types(accept: str) -> dict:
+    """Media type -> q value from an Accept header"""
+    accepted = {}
+    for item in accept.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[media_type.lower()] = q
+    return accepted
+
+
+def negotiate_format(accept: str, source_content_type: str) -> str:
+    """
+    Output media type for a derivative: AVIF, then WebP when the client accepts them,
+    otherwise PNG for PNG sources (transparency) and JPEG for everything else.
+    """
+    accepted = _accepted_types(accept)
+    for media_type in NEGOTIABLE_FORMATS:
+        if accepted.get(media_type, 0) > 0:
+            return media_type
+    return "image/png" if source_content_type == "image/png" else "image/jpeg"
+
+
+def derivative_key(source_id, request: DerivativeRequest, media_type: str) -> str:
+    """Identity of a derivative in the store: source file, box, fit and format"""
+    return f"{source_id}:{request.width or 0}x{request.height or 0}:{request.fit}:{media_type}"
+
+
+def render_derivative(content: bytes, request: DerivativeRequest, media_type: str) -> Tuple[bytes, int, int]:
+    """
+    Resize and encode an image. Blocking: run it in image_executor.
+    contain fits the image inside the box, cover crops it to the exact box; never upscales.
+    Returns (bytes, width, height).
+    """
+    pil_format = PIL_FORMATS[media_type]
+    box = (request.width or max(DERIVATIVE_SIZES) * 4, request.height or max(DERIVATIVE_SIZES) * 4)
+
+    with Image.open(io.BytesIO(content)) as img:
+        # JPEG sources can be decoded directly at a reduced scale
+        img.draft("RGB", box)
+        img = ImageOps.exif_transpose(img)
+
+        if request.fit == "cover" and img.width >= box[0] and img.height >= box[1]:
+            img = ImageOps.fit(img, box, Image.LANCZOS)
+        else:
+            img.thumbnail(box, Image.LANCZOS)
+
+        if pil_format == "JPEG":
+            img = _flatten(img)
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if _has_alpha(img) else "RGB")
+
+        out = io.BytesIO()
+        img.save(out, format=pil_format, **SAVE_OPTIONS[pil_format])
+        return out.getvalue(), img.width, img.height
+
+
+def render_placeholder(content: bytes) -> Tuple[str, str]:
+    """
+    Low-quality placeholder of an image and its dominant colour. Blocking: run it in image_executor.
+    Returns (data URI of a PLACEHOLDER_SIZE px WebP, or JPEG without WebP support, "#rrggbb").
+    """
+    with Image.open(io.BytesIO(content)) as img:
+        img = _reduced_rgb(img)
+        dominant_color = _dominant_color(img)
+        img.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.LANCZOS)
+        out = io.BytesIO()
+        if features.check("webp"):
+            img.save(out, format="WEBP", quality=30)
+            media_type = "image/webp"
+        else:
+            img.save(out, format="JPEG", quality=40)
+            media_type = "image/jpeg"
+        data_uri = f"data:{media_type};base64,{base64.b64encode(out.getvalue()).decode('ascii')}"
+        return data_uri, dominant_color
+
+
+def describe_image(content: bytes) -> dict:
+    """
+    Properties of an uploaded image, stored in its GridFS metadata: width, height (pixels as stored,
+    like PIL and reportlab read them), mode, format, dpi, byte_size, sha256 and dominant_color.
+    Blocking (decodes a reduced copy for the colour): run it in image_executor.
+    Raises if the content is not a readable image.
+    """
+    with Image.open(io.BytesIO(content)) as img:
+        return _image_info(img, img.format, content)
+
+
+def _image_info(img: Image.Image, image_format: str, content: bytes) -> dict:
+    dpi = img.info.get("dpi")
+    return {
+        "width": img.width,
+        "height": img.height,
+        "mode": img.mode,
+        "format": image_format,
+        "dpi": [round(float(v), 2) for v in dpi[:2]] if dpi else None,
+        "dominant_color": _dominant_color(_reduced_rgb(img)),
+        "byte_size": len(content),
+        "sha256": hashlib.sha256(content).hexdigest(),
+    }
+
+
+def check_image(content: bytes) -> str:
+    """
+    Validate an upload from its header only (nothing decoded): accepted format, pixels (all frames)
+    within MAX_IMAGE_PIXELS. Returns the Pillow format, raises InvalidImage / ImageTooLarge.
+    """
+    try:
+        with Image.open(io.BytesIO(content), formats=list(UPLOAD_FORMATS)) as img:
+            if img.width * img.height * getattr(img, "n_frames", 1) > MAX_IMAGE_PIXELS:
+                raise ImageTooLarge()
+            return img.format
+    except Image.DecompressionBombError:
+        raise ImageTooLarge()
+    except (OSError, SyntaxError, ValueError) as e:
+        if isinstance(e, InvalidImage):
+            raise
+        raise InvalidImage(f"File immagine non valido ({', '.join(UPLOAD_FORMATS)} ammessi)")
+
+
+def normalize_image(content: bytes) -> Tuple[bytes, str, dict]:
+    """
+    Upload normalization. Blocking: run it in image_executor.
+    Validates with check_image(), decodes, applies the EXIF orientation, converts to 8-bit sRGB
+    (grey, palette and alpha kept), drops EXIF/XMP/ICC/comments and re-encodes in the source format
+    (JPEG with its own quantization when the pixels are untouched). The original is kept when it had
+    nothing to change and is smaller; animated images are only validated.
+    Returns (bytes, media type, describe_image() fields of the result plus original_byte_size).
+    """
+    image_format = check_image(content)
+    try:
+        with Image.open(io.BytesIO(content), formats=[image_format]) as img:
+            if getattr(img, "is_animated", False):
+                img.seek(0)
+                info = _image_info(img, image_format, content)
+                return content, UPLOAD_FORMATS[image_format], {**info, "original_byte_size": len(content)}
+
+            img.load()
+            orientation = img.getexif().get(0x0112, 1)
+            has_metadata = any(img.info.get(key) for key in METADATA_KEYS)
+            dpi = img.info.get("dpi")
+            normalized = _to_srgb_8bit(ImageOps.exif_transpose(img) if orientation != 1 else img)
+
+            # Encoders fall back to Image.info for ICC/EXIF/XMP: drop them there too
+            normalized.info = {key: value for key, value in normalized.info.items() if key not in METADATA_KEYS}
+            options = dict(NORMALIZE_OPTIONS[image_format])
+            if normalized is img and image_format == "JPEG":
+                # Pixels untouched: reuse the source quantization tables instead of compressing again
+                options.update(quality="keep", subsampling="keep")
+            if dpi and image_format in ("JPEG", "PNG"):
+                options["dpi"] = dpi
+            out = io.BytesIO()
+            normalized.save(out, format=image_format, **options)
+            output = out.getvalue()
+
+            if normalized is img and not has_metadata and len(output) >= len(content):
+                output = content
+            info = _image_info(normalized, image_format, output)
+    except (OSError, SyntaxError, ValueError) as e:
+        if isinstance(e, InvalidImage):
+            raise
+        raise InvalidImage(f"File immagine non valido: {str(e)}")
+    return output, UPLOAD_FORMATS[image_format], {**info, "original_byte_size": len(content)}
+
+
+def recompress_png(content: bytes) -> Optional[Tuple[bytes, dict]]:
+    """
+    Lossless re-encoding of a stored PNG in the smallest mode holding exactly the same pixels
+    (opaque RGBA -> RGB, grey -> L/LA, black and white -> 1, up to 256 colours -> P) at the best
+    compression. Every candidate is checked pixel by pixel against the source. Blocking: run it
+    in recompress_executor. Returns (bytes, describe_image() fields of the result), or None when
+    nothing smaller than the source was found.
+    """
+    with Image.open(io.BytesIO(content), formats=["PNG"]) as img:
+        if getattr(img, "is_animated", False):
+            return None
+        img.load()
+        options = {"optimize": True}
+        for key in ("dpi", "icc_profile"):
+            if img.info.get(key):
+                options[key] = img.info[key]
+        candidates = _lossless_modes(img)
+        if options.get("icc_profile"):
+            # A profile describes one colour space: written into a mode of another it is an invalid iCCP
+            # chunk, and dropping it would change the colours, so only modes it applies to are tried
+            modes = ICC_PNG_MODES.get(bytes(options["icc_profile"][16:20]), ())
+            candidates = [candidate for candidate in candidates if candidate.mode in modes]
+        best = None
+        for candidate in [img] + candidates:
+            out = io.BytesIO()
+            candidate.save(out, format="PNG", **options)
+            if best is None or out.tell() < len(best[0]):
+                best = (out.getvalue(), candidate)
+        output, candidate = best
+        if len(output) >= len(content):
+            return None
+        return output, _image_info(candidate, "PNG", output)
+
+
+def _lossless_modes(img: Image.Image) -> List[Image.Image]:
+    """Copies of an image in smaller modes, only those with pixels identical to the source"""
+    if img.mode not in ("RGB", "RGBA", "L", "LA"):
+        return []
+    candidates = []
+    if img.mode in ("RGBA", "LA") and img.getextrema()[-1] == (255, 255):
+        candidates.append(img.convert(img.mode[:-1]))
+    base = candidates[-1] if candidates else img
+    colors = base.getcolors(256) if base.mode in ("RGB", "RGBA") else None
+    if colors is not None and all(color[0] == color[1] == color[2] for _, color in colors):
+        base = base.convert("LA" if base.mode == "RGBA" else "L")
+        candidates.append(base)
+    elif colors is not None and base.mode == "RGB":
+        palette = Image.new("P", (1, 1))
+        palette.putpalette([value for _, color in colors for value in color])
+        candidates.append(base.quantize(palette=palette, dither=Image.Dither.NONE))
+    if base.mode == "L" and set(v for _, v in base.getcolors(256)) <= {0, 255}:
+        candidates.append(base.convert("1", dither=Image.Dither.NONE))
+    reference = img.convert("RGBA")
+    return [c for c in candidates if ImageChops.difference(c.convert("RGBA"), reference).getbbox() is None]
+
+
+def _to_srgb_8bit(img: Image.Image) -> Image.Image:
+    """8-bit copy of an image in sRGB (the image itself when already so); ICC profiles are applied"""
+    icc = img.info.get("icc_profile")
+    if icc and img.mode in ("RGB", "RGBA", "CMYK"):
+        try:
+            mode = "RGBA" if img.mode == "RGBA" else "RGB"
+            return ImageCms.profileToProfile(
+                img, ImageCms.ImageCmsProfile(io.BytesIO(icc)), ImageCms.createProfile("sRGB"), outputMode=mode
+            )
+        except (ImageCms.PyCMSError, OSError):
+            pass
+    if img.mode in NORMALIZED_MODES:
+        return img
+    if img.mode in ("I;16", "I;16B", "I;16L", "I"):
+        # 16-bit grey: scale to 0-255
+        return img.point(lambda v: v / 256).convert("L")
+    if img.mode == "F":
+        return img.convert("L")
+    return img.convert("RGBA" if _has_alpha(img) or img.mode in ("PA", "La") else "RGB")
+
+
+def image_meta_fields(info: dict) -> dict:
+    """describe_image() / normalize_image() result in the camelCase form stored on the owning document"""
+    names = {"byte_size": "byteSize", "original_byte_size": "originalByteSize", "dominant_color": "dominantColor"}
+    return {names.get(key, key): value for key, value in info.items()}
+
+
+def _reduced_rgb(img: Image.Image) -> Image.Image:
+    """Small RGB copy (longest side PLACEHOLDER_SIZE * 8) for colour analysis"""
+    img.draft("RGB", (PLACEHOLDER_SIZE * 8, PLACEHOLDER_SIZE * 8))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((PLACEHOLDER_SIZE * 8, PLACEHOLDER_SIZE * 8), Image.BILINEAR)
+    return _flatten(img)
+
+
+def _dominant_color(img: Image.Image) -> str:
+    """Most frequent colour of a small palette, so line art stays white rather than averaging to grey"""
+    palette = img.quantize(colors=5)
+    _, index = max(palette.getcolors())
+    r, g, b = palette.getpalette()[index * 3:index * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def render_sprite(images: List[Optional[bytes]], tile_size: int = SPRITE_TILE_SIZE, columns: int = SPRITE_COLUMNS) -> Tuple[bytes, str, int, int, List[Optional[Tuple[int, int]]]]:
+    """
+    Contact sheet of images on a grid of square tiles, each fitted (contain) and centered in its tile.
+    Blocking: run it in image_executor.
+    Returns (bytes, media type, width, height, [(x, y) of each tile, None when the image was missing or unreadable]).
+    """
+    columns = max(1, min(columns, len(images)))
+    rows = max(1, -(-len(images) // columns))
+    sheet = Image.new("RGB", (columns * tile_size, rows * tile_size), (255, 255, 255))
+
+    positions = []
+    for index, content in enumerate(images):
+        x, y = (index % columns) * tile_size, (index // columns) * tile_size
+        if content is None:
+            positions.append(None)
+            continue
+        try:
+            with Image.open(io.BytesIO(content)) as img:
+                img.draft("RGB", (tile_size, tile_size))
+                img = _flatten(ImageOps.exif_transpose(img))
+                img.thumbnail((tile_size, tile_size), Image.LANCZOS)
+                sheet.paste(img, (x + (tile_size - img.width) // 2, y + (tile_size - img.height) // 2))
+            positions.append((x, y))
+        except Exception:
+            positions.append(None)
+
+    out = io.BytesIO()
+    if features.check("webp"):
+        sheet.save(out, format="WEBP", **SAVE_OPTIONS["WEBP"])
+        media_type = "image/webp"
+    else:
+        sheet.save(out, format="JPEG", **SAVE_OPTIONS["JPEG"])
+        media_type = "image/jpeg"
+    return out.getvalue(), media_type, sheet.width, sheet.height, positions
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """RGB copy of an image, transparent areas on white (the page colour of the catalog)"""
+    if not _has_alpha(img):
+        return img.convert("RGB")
+    rgba = img.convert("RGBA")
+    background = Image.new("RGB", img.size, (255, 255, 255))
+    background.paste(rgba, mask=rgba.split()[-1])
+    return background
@@ -0,0 +1,81 @@
+"""
+Access tracking for stored media
+Every served file is counted in memory, exactly, together with the time of
+its last request; the counts are flushed periodically to the files documents
+(accessCount, accessedAt), so the tiering job can tell the hot catalog from
+files nobody requests. Memory grows with the distinct files requested between
+two flushes: past MEDIA_ACCESS_MAX_FILES the flush runs early.
+"""
+
+import os
+import time
+import asyncio
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Seconds between two flushes, and distinct files pending that trigger one early
+MEDIA_ACCESS_FLUSH_SECONDS = int(os.environ.get('MEDIA_ACCESS_FLUSH_SECONDS', '60'))
+MEDIA_ACCESS_MAX_FILES = int(os.environ.get('MEDIA_ACCESS_MAX_FILES', '50000'))
+FLUSH_BATCH = 500
+
+
+class AccessTracker:
+    """Per-process access counts of stored files, written to their files documents by flush()"""
+
+    def __init__(self, max_files: int = MEDIA_ACCESS_MAX_FILES):
+        self.max_files = max_files
+        self.counts: Counter = Counter()
+        # file id -> time of its last access since the previous flush
+        self.last_access: Dict[str, float] = {}
+        # Set when max_files files are pending: the flush loop does not wait for its interval
+        self.full = asyncio.Event()
+
+    def record(self, file_id):
+        key = str(file_id)
+        self.counts[key] += 1
+        self.last_access[key] = time.time()
+        if len(self.counts) >= self.max_files:
+            self.full.set()
+
+    def _merge(self, keys: Iterable[str], counts: Counter, last_access: Dict[str, float]):
+        """Put counts that could not be written back with the pending ones"""
+        for key in keys:
+            self.counts[key] += counts[key]
+            self.last_access[key] = max(self.last_access.get(key, 0), last_access[key])
+
+    async def flush(self, files) -> int:
+        """
+        Add the counts gathered since the last flush to the files documents; returns the files updated.
+        Counts of a batch that fails are kept for the next flush, then the error is raised.
+        """
+        counts, last_access = self.counts, self.last_access
+        self.counts, self.last_access = Counter(), {}
+        self.full.clear()
+        keys = [key for key in counts if ObjectId.is_valid(key)]
+        for i in range(0, len(keys), FLUSH_BATCH):
+            batch = keys[i:i + FLUSH_BATCH]
+            try:
+                await files.bulk_write([
+                    UpdateOne(
+                        {"_id": ObjectId(key)},
+                        {
+                            "$inc": {"accessCount": counts[key]},
+                            "$max": {"accessedAt": datetime.fromtimestamp(last_access[key], timezone.utc)}
+                        }
+                    )
+                    for key in batch
+                ], ordered=False)
+            except BaseException as e:
+                # Unordered: with a BulkWriteError only the operations it lists were not applied
+                if isinstance(e, BulkWriteError):
+                    unwritten = [batch[error['index']] for error in e.details.get('writeErrors', [])] + keys[i + FLUSH_BATCH:]
+                else:
+                    unwritten = keys[i:]
+                self._merge(unwritten, counts, last_access)
+                raise
+        return len(keys)
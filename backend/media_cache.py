@@ -0,0 +1,547 @@
+"""
+Media caches for Poppiconni
+- In-process LRU of small, frequently requested GridFS files (hero image,
+  brand logo, character images, backgrounds), bounded by a byte budget.
+- Alternative shared-memory arena (MEDIA_CACHE_BACKEND=shm) so that all
+  uvicorn workers on a node share a single copy of those files.
+- Optional local-disk tier: a content-addressed mirror of GridFS files,
+  filled on first read and evicted by access time.
+"""
+
+import os
+import mmap
+import time
+import fcntl
+import struct
+import asyncio
+import hashlib
+import logging
+import tempfile
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Callable, Optional
+
+import aiofiles
+import bson
+
+logger = logging.getLogger(__name__)
+
+# Byte budget for the whole cache and ceiling for a single entry
+MEDIA_CACHE_MAX_MB = int(os.environ.get('MEDIA_CACHE_MAX_MB', '64'))
+MEDIA_CACHE_MAX_ENTRY_KB = int(os.environ.get('MEDIA_CACHE_MAX_ENTRY_KB', '4096'))
+
+# "memory" (per-process LRU) or "shm" (arena shared by all workers on the node)
+MEDIA_CACHE_BACKEND = os.environ.get('MEDIA_CACHE_BACKEND', 'memory').strip().lower()
+MEDIA_SHM_PATH = os.environ.get('MEDIA_SHM_PATH', '/dev/shm/poppiconni-media-cache')
+MEDIA_SHM_SLOTS = int(os.environ.get('MEDIA_SHM_SLOTS', '4096'))
+
+# Disk tier (disabled when MEDIA_DISK_CACHE_DIR is empty)
+MEDIA_DISK_CACHE_DIR = os.environ.get('MEDIA_DISK_CACHE_DIR', '')
+MEDIA_DISK_CACHE_MAX_MB = int(os.environ.get('MEDIA_DISK_CACHE_MAX_MB', '2048'))
+MEDIA_DISK_CACHE_MAX_FILE_MB = int(os.environ.get('MEDIA_DISK_CACHE_MAX_FILE_MB', '64'))
+MEDIA_DISK_CACHE_PRELOAD = int(os.environ.get('MEDIA_DISK_CACHE_PRELOAD', '50'))
+
+DISK_READ_BLOCK = 64 * 1024
+TEMP_PREFIX = ".tmp-"
+# Files used this recently are never evicted: the web server may not have opened an offloaded file yet
+DISK_EVICT_MIN_AGE_SECONDS = 60
+
+
+@dataclass
+class CachedMedia:
+    """A GridFS file held in memory, with the files document used for headers"""
+    file_doc: dict
+    content: bytes
+    content_type: Optional[str] = None
+
+
+async def iter_content(content: bytes, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Yield bytes [start, end] (inclusive) of an in-memory file, same contract as MediaStore.iter_chunks"""
+    end = len(content) - 1 if end is None else min(end, len(content) - 1)
+    if start <= end:
+        yield content[start:end + 1]
+
+
+class MediaMemoryCache:
+    """
+    Byte-budgeted LRU keyed by GridFS file id.
+    GridFS files are never modified in place (a replacement gets a new id), so
+    entries cannot go stale; invalidate() only frees memory when a file is deleted.
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self._entries: "OrderedDict[str, CachedMedia]" = OrderedDict()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, file_id) -> Optional[CachedMedia]:
+        entry = self._entries.get(str(file_id))
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(str(file_id))
+        self.hits += 1
+        return entry
+
+    def put(self, file_id, file_doc: dict, content: bytes) -> Optional[CachedMedia]:
+        """Store a file if it fits the per-entry ceiling, evicting least recently used entries"""
+        size = len(content)
+        if size > self.max_entry_bytes:
+            return None
+        key = str(file_id)
+        self.invalidate(key)
+
+        while self._entries and self.resident_bytes + size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.resident_bytes -= len(evicted.content)
+            self.evictions += 1
+
+        entry = CachedMedia(
+            file_doc=file_doc,
+            content=content,
+            content_type=(file_doc.get('metadata') or {}).get('content_type')
+        )
+        self._entries[key] = entry
+        self.resident_bytes += size
+        return entry
+
+    def invalidate(self, file_id):
+        entry = self._entries.pop(str(file_id), None)
+        if entry is not None:
+            self.resident_bytes -= len(entry.content)
+
+    def clear(self):
+        self._entries.clear()
+        self.resident_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "entries": len(self._entries),
+            "residentBytes": self.resident_bytes,
+            "maxBytes": self.max_bytes,
+            "maxEntryBytes": self.max_entry_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+
+async def iter_file(path: Path, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Yield bytes [start, end] (inclusive) of a file on disk, same contract as MediaStore.iter_chunks"""
+    async with aiofiles.open(path, 'rb') as f:
+        if end is None:
+            end = os.fstat(f.fileno()).st_size - 1
+        await f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = await f.read(min(DISK_READ_BLOCK, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+# Files document fields needed to rebuild response headers from a cached entry
+CACHED_FILE_FIELDS = ("_id", "length", "chunkSize", "uploadDate", "md5", "filename", "metadata", "backend", "bucket", "coldLength")
+
+
+class SharedMediaCache:
+    """
+    Media cache in a memory-mapped arena shared by every worker process on the node.
+
+    Layout: header | slot table | eviction log | data ring.
+    - Each slot maps a key digest to (offset, doc length, content length) in the data ring and
+      carries a sequence counter (seqlock): odd while the slot is being changed.
+    - Readers never lock: they read the slot, copy the data and accept it only if the
+      sequence counter did not change meanwhile.
+    - Writers are serialized with flock. Entries are appended to the ring and to the eviction
+      log, a circular list of the entries in the order written, i.e. by offset; before a region
+      is overwritten, the oldest log records overlapping it are popped and their slots invalidated
+      (FIFO eviction), so a write only touches the entries it evicts.
+    - The file name carries the layout: workers started with another size or slot count use a
+      file of their own instead of resizing one that others have mapped.
+    Same interface as MediaMemoryCache.
+    """
+
+    MAGIC = b"PPCMEDIA"
+    VERSION = 2
+    HEADER = struct.Struct("<8sIIQQII")   # magic, version, slot count, data size, write head, log start, log count
+    SLOT = struct.Struct("<Q24sQII")      # seq, key digest, offset, doc length, content length
+    LOG = struct.Struct("<QII8s")         # offset, size, slot index, key digest prefix
+    HEADER_SIZE = 64
+    PROBE = 4
+    READ_RETRIES = 3
+
+    def __init__(self, path: str, max_bytes: int, max_entry_bytes: int, slot_count: int = MEDIA_SHM_SLOTS):
+        self.path = f"{path}-v{self.VERSION}-{slot_count}-{max_bytes}"
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.slot_count = slot_count
+        self.log_start = self.HEADER_SIZE + slot_count * self.SLOT.size
+        self.data_start = self.log_start + slot_count * self.LOG.size
+        self.hits = 0
+        self.misses = 0
+
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        total_size = self.data_start + max_bytes
+        with self._write_lock():
+            size = os.fstat(self._fd).st_size
+            if size == 0:
+                os.ftruncate(self._fd, total_size)
+                size = total_size
+            if size == total_size:
+                self._mm = mmap.mmap(self._fd, total_size)
+                magic, version, slots, data_size = self.HEADER.unpack_from(self._mm, 0)[:4]
+                if (magic, version, slots, data_size) != (self.MAGIC, self.VERSION, slot_count, max_bytes):
+                    self._reset()
+        if size != total_size:
+            # Never resized in place: workers mapping it would get SIGBUS reading past the new end
+            os.close(self._fd)
+            raise ValueError(f"Cache condivisa {self.path}: dimensione inattesa ({size} byte)")
+        self._remove_other_layouts(path)
+
+    def _remove_other_layouts(self, path: str):
+        """
+        Unlink arenas of other layouts (and of the unversioned name used before). Workers still
+        mapping one keep their mapping until they exit; only the name goes away.
+        """
+        directory, prefix = os.path.split(path)
+        try:
+            names = os.listdir(directory or ".")
+        except OSError:
+            return
+        for name in names:
+            other = os.path.join(directory, name)
+            if other != self.path and (name == prefix or name.startswith(f"{prefix}-v")):
+                try:
+                    os.unlink(other)
+                except OSError:
+                    pass
+
+    # ---- locking / layout helpers ----
+
+    def _write_lock(self):
+        fd = self._fd
+
+        class _Lock:
+            def __enter__(self_):
+                fcntl.flock(fd, fcntl.LOCK_EX)
+
+            def __exit__(self_, *exc):
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+        return _Lock()
+
+    def _reset(self):
+        self._mm[:self.data_start] = bytes(self.data_start)
+        self.HEADER.pack_into(self._mm, 0, self.MAGIC, self.VERSION, self.slot_count, self.max_bytes, 0, 0, 0)
+
+    @staticmethod
+    def _digest(file_id) -> bytes:
+        return hashlib.blake2b(str(file_id).encode(), digest_size=24).digest()
+
+    def _slot_offset(self, index: int) -> int:
+        return self.HEADER_SIZE + index * self.SLOT.size
+
+    def _log_offset(self, position: int) -> int:
+        return self.log_start + (position % self.slot_count) * self.LOG.size
+
+    def _probe(self, digest: bytes):
+        base = int.from_bytes(digest[:8], "little") % self.slot_count
+        return [(base + i) % self.slot_count for i in range(self.PROBE)]
+
+    def _write_slot(self, index: int, digest: bytes, offset: int, doc_len: int, content_len: int):
+        pos = self._slot_offset(index)
+        seq = self.SLOT.unpack_from(self._mm, pos)[0]
+        struct.pack_into("<Q", self._mm, pos, seq + 1)  # odd: readers back off
+        self.SLOT.pack_into(self._mm, pos, seq + 1, digest, offset, doc_len, content_len)
+        struct.pack_into("<Q", self._mm, pos, seq + 2)
+
+    def _clear_slot(self, index: int):
+        self._write_slot(index, bytes(24), 0, 0, 0)
+
+    def _evict_record(self, position: int):
+        """Invalidate the slot of a log record, unless it was reused for another entry since"""
+        offset, _, index, tag = self.LOG.unpack_from(self._mm, self._log_offset(position))
+        _, key, slot_offset, _, _ = self.SLOT.unpack_from(self._mm, self._slot_offset(index))
+        if key[:8] == tag and slot_offset == offset:
+            self._clear_slot(index)
+
+    def _evict(self, offset: int, end: int, write_head: int, log_start: int, log_count: int):
+        """
+        Pop the oldest log records whose data lies in [offset, end). Records are in ring order: the
+        oldest ones follow the write head, so popping stops at the first record outside the region.
+        On a wrap to 0 the records past the old write head (the tail the entry did not fit in) go too.
+        """
+        wrapped = offset == 0 and write_head != 0
+        while log_count:
+            record_offset, record_size = self.LOG.unpack_from(self._mm, self._log_offset(log_start))[:2]
+            overlaps = record_offset < end and offset < record_offset + record_size
+            if not overlaps and not (wrapped and record_offset >= write_head):
+                break
+            self._evict_record(log_start)
+            log_start, log_count = (log_start + 1) % self.slot_count, log_count - 1
+        return log_start, log_count
+
+    # ---- cache interface ----
+
+    def get(self, file_id) -> Optional[CachedMedia]:
+        digest = self._digest(file_id)
+        for index in self._probe(digest):
+            pos = self._slot_offset(index)
+            for _ in range(self.READ_RETRIES):
+                seq, key, offset, doc_len, content_len = self.SLOT.unpack_from(self._mm, pos)
+                if seq % 2:
+                    continue
+                if key != digest:
+                    break
+                start = self.data_start + offset
+                raw_doc = self._mm[start:start + doc_len]
+                content = self._mm[start + doc_len:start + doc_len + content_len]
+                if struct.unpack_from("<Q", self._mm, pos)[0] != seq:
+                    continue
+                self.hits += 1
+                file_doc = bson.decode(raw_doc)
+                return CachedMedia(
+                    file_doc=file_doc,
+                    content=content,
+                    content_type=(file_doc.get('metadata') or {}).get('content_type')
+                )
+        self.misses += 1
+        return None
+
+    def put(self, file_id, file_doc: dict, content: bytes) -> Optional[CachedMedia]:
+        raw_doc = bson.encode({k: file_doc[k] for k in CACHED_FILE_FIELDS if k in file_doc})
+        size = len(raw_doc) + len(content)
+        if len(content) > self.max_entry_bytes or size > self.max_bytes:
+            return None
+        digest = self._digest(file_id)
+
+        with self._write_lock():
+            write_head, log_start, log_count = self.HEADER.unpack_from(self._mm, 0)[4:]
+            offset = write_head if write_head + size <= self.max_bytes else 0
+            end = offset + size
+
+            # Invalidate the entries living in the region about to be overwritten, plus any older
+            # copy of this key; with a full log the oldest record goes to make room
+            log_start, log_count = self._evict(offset, end, write_head, log_start, log_count)
+            if log_count == self.slot_count:
+                self._evict_record(log_start)
+                log_start, log_count = (log_start + 1) % self.slot_count, log_count - 1
+            probe = self._probe(digest)
+            for index in probe:
+                if self.SLOT.unpack_from(self._mm, self._slot_offset(index))[1] == digest:
+                    self._clear_slot(index)
+
+            start = self.data_start + offset
+            self._mm[start:start + len(raw_doc)] = raw_doc
+            self._mm[start + len(raw_doc):start + size] = content
+
+            free = [i for i in probe if self.SLOT.unpack_from(self._mm, self._slot_offset(i))[1] == bytes(24)]
+            index = free[0] if free else probe[0]
+            self._write_slot(index, digest, offset, len(raw_doc), len(content))
+            self.LOG.pack_into(self._mm, self._log_offset(log_start + log_count), offset, size, index, digest[:8])
+            self.HEADER.pack_into(
+                self._mm, 0, self.MAGIC, self.VERSION, self.slot_count, self.max_bytes, end, log_start, log_count + 1
+            )
+
+        return CachedMedia(
+            file_doc=file_doc,
+            content=content,
+            content_type=(file_doc.get('metadata') or {}).get('content_type')
+        )
+
+    def invalidate(self, file_id):
+        digest = self._digest(file_id)
+        with self._write_lock():
+            for index in self._probe(digest):
+                if self.SLOT.unpack_from(self._mm, self._slot_offset(index))[1] == digest:
+                    self._clear_slot(index)
+
+    def clear(self):
+        with self._write_lock():
+            self._reset()
+
+    def stats(self) -> dict:
+        entries = 0
+        resident = 0
+        for index in range(self.slot_count):
+            _, key, _, doc_len, content_len = self.SLOT.unpack_from(self._mm, self._slot_offset(index))
+            if key != bytes(24):
+                entries += 1
+                resident += doc_len + content_len
+        lookups = self.hits + self.misses
+        return {
+            "backend": "shm",
+            "path": self.path,
+            "entries": entries,
+            "residentBytes": resident,
+            "maxBytes": self.max_bytes,
+            "maxEntryBytes": self.max_entry_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class MediaDiskCache:
+    """
+    Content-addressed mirror of GridFS files on local disk, keyed by sha256.
+    Files are written to a temp file and renamed into place, so readers never
+    see partial content. When the directory grows past max_bytes the least
+    recently accessed files (by atime, refreshed explicitly on every hit) are removed.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_file_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.evictions = 0
+        self._fills = {}
+        self._evicting = False
+
+    def path_for(self, sha256: str) -> Path:
+        return self.directory / sha256[:2] / sha256
+
+    def lookup(self, sha256: str) -> Optional[Path]:
+        """Return the cached path for a hash and mark it as recently used, or None"""
+        path = self.path_for(sha256)
+        try:
+            st = path.stat()
+            # atime is refreshed by hand: most filesystems are mounted relatime/noatime
+            os.utime(path, (time.time(), st.st_mtime))
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    async def start(self):
+        """Create the directory and measure its content (removing stale temp files)"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.total_bytes = await asyncio.to_thread(self._scan_size)
+        logger.info(f"Media disk cache at {self.directory}: {self.total_bytes // (1024 * 1024)} MB")
+
+    def _scan_size(self) -> int:
+        total = 0
+        for path in self.directory.glob("*/*"):
+            if path.name.startswith(TEMP_PREFIX):
+                path.unlink(missing_ok=True)
+                continue
+            total += path.stat().st_size
+        return total
+
+    async def fill(self, sha256: str, chunks: AsyncIterator[bytes]) -> Optional[Path]:
+        """Write a file from its chunks; content not matching the hash is discarded"""
+        path = self.path_for(sha256)
+        if path.exists():
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=TEMP_PREFIX)
+        os.close(fd)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with aiofiles.open(tmp_name, 'wb') as f:
+                async for data in chunks:
+                    digest.update(data)
+                    size += len(data)
+                    await f.write(data)
+            if digest.hexdigest() != sha256:
+                raise ValueError(f"Hash mismatch for {sha256}")
+            os.replace(tmp_name, path)
+        except Exception:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+        self.fills += 1
+        self.total_bytes += size
+        if self.total_bytes > self.max_bytes and not self._evicting:
+            self._evicting = True
+            try:
+                await asyncio.to_thread(self._evict)
+            finally:
+                self._evicting = False
+        return path
+
+    def _fill_task(self, sha256: str, chunks_factory: Callable[[], AsyncIterator[bytes]]) -> asyncio.Task:
+        """Single in-flight fill per hash, shared by every caller that needs it"""
+        task = self._fills.get(sha256)
+        if task is None:
+            task = asyncio.create_task(self.fill(sha256, chunks_factory()))
+            self._fills[sha256] = task
+            task.add_done_callback(lambda t: self._fills.pop(sha256, None))
+        return task
+
+    def schedule_fill(self, sha256: str, length: int, chunks_factory: Callable[[], AsyncIterator[bytes]]):
+        """Fill the cache in background after a miss; concurrent misses for one hash write once"""
+        if length > self.max_file_bytes:
+            return
+
+        def log_failure(task: asyncio.Task):
+            if not task.cancelled() and task.exception():
+                logger.warning(f"Media disk cache fill failed for {sha256}: {str(task.exception())}")
+
+        self._fill_task(sha256, chunks_factory).add_done_callback(log_failure)
+
+    async def materialize(self, sha256: str, chunks_factory: Callable[[], AsyncIterator[bytes]]) -> Path:
+        """
+        Return the local path of a file, writing it first if needed (waits for an in-flight fill).
+        Used for offloaded downloads: unlike schedule_fill, files above max_file_bytes are written too.
+        """
+        path = self.lookup(sha256)
+        if path is not None:
+            return path
+        return await asyncio.shield(self._fill_task(sha256, chunks_factory))
+
+    def _evict(self):
+        """
+        Remove least recently accessed files until the cache is back under 90% of its cap,
+        sparing those used in the last DISK_EVICT_MIN_AGE_SECONDS
+        """
+        entries = []
+        for path in self.directory.glob("*/*"):
+            if path.name.startswith(TEMP_PREFIX):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_atime, st.st_size, path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        recent = time.time() - DISK_EVICT_MIN_AGE_SECONDS
+        for atime, size, path in entries:
+            if total <= target or atime >= recent:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            self.evictions += 1
+        self.total_bytes = total
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "directory": str(self.directory),
+            "residentBytes": self.total_bytes,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "fills": self.fills,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,252 @@
+"""
+HTTP helpers for media responses
+Parsing of Range headers (RFC 9110 section 14), multipart/byteranges
+framing for partial-content responses and validators (ETag / Last-Modified)
+for conditional requests (RFC 9110 section 13).
+"""
+
+import os
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# More ranges than this in one request are ignored and the full body is sent
+MAX_RANGES_PER_REQUEST = 16
+
+# Download offload to the fronting web server: "" (off), "x-accel" (nginx) or "x-sendfile" (Apache/lighttpd)
+MEDIA_OFFLOAD_MODE = os.environ.get('MEDIA_OFFLOAD_MODE', '').strip().lower()
+# nginx internal location mapped (alias) to the disk cache directory
+MEDIA_OFFLOAD_PREFIX = os.environ.get('MEDIA_OFFLOAD_PREFIX', '/_media_offload/')
+# Largest file handed to the web server (0 = no limit); independent of MEDIA_DISK_CACHE_MAX_FILE_MB,
+# which only limits what the cache keeps on its own after a miss
+MEDIA_OFFLOAD_MAX_FILE_MB = int(os.environ.get('MEDIA_OFFLOAD_MAX_FILE_MB', '0'))
+OFFLOAD_MODES = ("x-accel", "x-sendfile")
+
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested ranges overlaps the representation (416)"""
+    pass
+
+
+def _parse_range_specs(range_header: Optional[str]) -> Optional[List[Tuple[Optional[int], Optional[int]]]]:
+    """
+    Split a Range header into raw (first, last) specs.
+    A suffix range "-N" is returned as (None, N).
+    Returns None when the header is absent or malformed, in which case it must be ignored.
+    """
+    if not range_header:
+        return None
+    unit, _, spec_set = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec_set.strip():
+        return None
+
+    specs = []
+    for spec in spec_set.split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, sep, last = spec.partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first and not last:
+            return None
+        if first and last and int(last) < int(first):
+            return None
+        specs.append((int(first) if first else None, int(last) if last else None))
+
+    if not specs or len(specs) > MAX_RANGES_PER_REQUEST:
+        return None
+    return specs
+
+
+def parse_range_header(range_header: Optional[str], length: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Resolve a Range header against a representation of `length` bytes.
+    Returns a sorted list of coalesced inclusive (start, end) ranges, or None to send the full body.
+    Raises RangeNotSatisfiable when no range overlaps the content.
+    """
+    specs = _parse_range_specs(range_header)
+    if specs is None:
+        return None
+
+    ranges = []
+    for first, last in specs:
+        if first is None:
+            # Suffix range: the last `last` bytes
+            if last == 0 or length == 0:
+                continue
+            ranges.append((max(length - last, 0), length - 1))
+        elif first < length:
+            ranges.append((first, min(last if last is not None else length - 1, length - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    # Coalesce overlapping or adjacent ranges
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        prev_start, prev_end = merged[-1]
+        if start <= prev_end + 1:
+            merged[-1] = (prev_start, max(prev_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def is_initial_range_request(range_header: Optional[str]) -> bool:
+    """
+    True when a request may start a logical download: no (usable) Range header,
+    or a range that begins at byte 0. Only a guess made before the file is known:
+    whether a download is counted is decided on the response by starts_download().
+    """
+    specs = _parse_range_specs(range_header)
+    if specs is None:
+        return True
+    return any(first == 0 for first, _ in specs)
+
+
+def starts_download(ranges: Optional[List[Tuple[int, int]]]) -> bool:
+    """
+    True when a response sending the resolved `ranges` (None: the full body, 200)
+    delivers the start of the file, i.e. begins a logical download rather than
+    resuming one. Used to count each download only once.
+    """
+    return not ranges or ranges[0][0] == 0
+
+
+def content_range(start: int, end: int, length: int) -> str:
+    return f"bytes {start}-{end}/{length}"
+
+
+def multipart_boundary() -> str:
+    return uuid.uuid4().hex
+
+
+def multipart_part_header(boundary: str, content_type: str, start: int, end: int, length: int) -> bytes:
+    return (
+        f"--{boundary}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Range: {content_range(start, end, length)}\r\n\r\n"
+    ).encode("latin-1")
+
+
+def multipart_closing(boundary: str) -> bytes:
+    return f"--{boundary}--\r\n".encode("latin-1")
+
+
+def multipart_length(boundary: str, content_type: str, ranges: List[Tuple[int, int]], length: int) -> int:
+    """Exact byte size of a multipart/byteranges body, so Content-Length can be sent up front"""
+    total = len(multipart_closing(boundary))
+    for start, end in ranges:
+        total += len(multipart_part_header(boundary, content_type, start, end, length))
+        total += end - start + 1 + 2  # data + trailing CRLF
+    return total
+
+
+# ============== VALIDATORS ==============
+
+def file_etag(file_doc: dict) -> str:
+    """Strong ETag for a GridFS file: its md5 when stored, otherwise _id plus uploadDate"""
+    if file_doc.get('md5'):
+        return f'"{file_doc["md5"]}"'
+    upload_date = file_last_modified(file_doc)
+    stamp = int(upload_date.timestamp() * 1000) if upload_date else 0
+    return f'"{file_doc["_id"]}-{stamp:x}"'
+
+
+def file_last_modified(file_doc: dict) -> Optional[datetime]:
+    """uploadDate as an aware UTC datetime truncated to seconds (HTTP date precision)"""
+    upload_date = file_doc.get('uploadDate')
+    if not upload_date:
+        return None
+    if upload_date.tzinfo is None:
+        upload_date = upload_date.replace(tzinfo=timezone.utc)
+    return upload_date.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value, usegmt=True)
+
+
+def parse_http_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime]) -> dict:
+    headers = {"ETag": etag}
+    if last_modified:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def _etag_list(header_value: str) -> List[str]:
+    return [tag.strip() for tag in header_value.split(",") if tag.strip()]
+
+
+def _opaque_tag(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request_headers, etag: str, last_modified: Optional[datetime]) -> bool:
+    """
+    Evaluate If-None-Match / If-Modified-Since for a GET or HEAD request.
+    If-None-Match (weak comparison) takes precedence over If-Modified-Since.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = _etag_list(if_none_match)
+        return "*" in tags or _opaque_tag(etag) in {_opaque_tag(tag) for tag in tags}
+
+    if_modified_since = parse_http_date(request_headers.get("if-modified-since"))
+    if if_modified_since and last_modified:
+        return last_modified <= if_modified_since
+    return False
+
+
+def if_range_matches(request_headers, etag: str, last_modified: Optional[datetime]) -> bool:
+    """
+    If-Range: the Range header is honoured only when the validator still matches,
+    otherwise the full representation is sent. Strong comparison only.
+    """
+    if_range = request_headers.get("if-range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    since = parse_http_date(if_range)
+    return bool(since and last_modified and since == last_modified)
+
+
+def not_modified_headers(response_headers: dict) -> dict:
+    """Subset of response headers a 304 must repeat"""
+    keep = {"etag", "last-modified", "cache-control", "vary", "expires"}
+    return {k: v for k, v in response_headers.items() if k.lower() in keep}
+
+
+# ============== OFFLOAD ==============
+
+def offload_headers(mode: str, path: Path, cache_root: Path) -> dict:
+    """
+    Internal redirect header handing the transfer of a local file to the web server.
+    x-accel: URI under MEDIA_OFFLOAD_PREFIX (nginx internal location aliasing cache_root);
+    x-sendfile: absolute path of the file.
+    """
+    if mode == "x-accel":
+        relative = path.relative_to(cache_root).as_posix()
+        return {"X-Accel-Redirect": MEDIA_OFFLOAD_PREFIX.rstrip("/") + "/" + relative}
+    if mode == "x-sendfile":
+        return {"X-Sendfile": str(path.resolve())}
+    raise ValueError(f"Modalità offload non valida: {mode}")
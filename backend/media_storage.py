@@ -0,0 +1,717 @@
+"""
+Media storage helpers for Poppiconni
+Chunk-level access to GridFS files, used to stream media responses without
+loading whole files in memory, content hashing (sha256 in the file
+metadata) for content-addressed media URLs, streamed uploads with
+per-type size limits, and deduplication: identical uploads share one GridFS
+file, reference counted in media_blobs and removed with its last reference.
+Files documents always live in GridFS; their bytes go through the blob
+backend (GridFS, local directory or S3) recorded on each document, in the
+bucket of their class (images, thumbnails, PDFs, generated caches, AI output).
+Files nobody requested for a while sit compressed in the cold tier and move
+back to the write backend on their first read.
+"""
+
+import os
+import asyncio
+import hashlib
+import logging
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from bson import Binary, ObjectId
+from bson.errors import InvalidId
+from gridfs.errors import NoFile, CorruptGridFile
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from blob_storage import (
+    BACKENDS, COLD_BACKEND, DEFAULT_BUCKET, GRIDFS_CHUNK_SIZE, MEDIA_STORAGE_BACKEND, BlobBackend, BlobWriter,
+    GridFSBackend, backend_name, bucket_name, external_backend
+)
+from media_access import AccessTracker
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from an upload (spooled to disk by Starlette) per step while copying it to storage
+UPLOAD_READ_SIZE = 1024 * 1024
+
+# Maximum upload size per kind of file (MB)
+MAX_UPLOAD_MB = {
+    "pdf": int(os.environ.get('MAX_PDF_UPLOAD_MB', '200')),
+    "image": int(os.environ.get('MAX_IMAGE_UPLOAD_MB', '25')),
+}
+
+# Resumable uploads: size of each chunk sent by the client (also the GridFS chunkSize of the file)
+# and hours an unfinished session is kept before its chunks are removed
+UPLOAD_SESSION_CHUNK_SIZE = int(os.environ.get('UPLOAD_SESSION_CHUNK_KB', '1024')) * 1024
+UPLOAD_SESSION_TTL_HOURS = int(os.environ.get('UPLOAD_SESSION_TTL_HOURS', '24'))
+
+# Seconds the previous copy of a file moved between tiers is kept for readers already streaming it
+MEDIA_TIER_GRACE_SECONDS = int(os.environ.get('MEDIA_TIER_GRACE_SECONDS', '300'))
+
+# Storage classes. Each one is a bucket (GridFS chunks collection "<name>.chunks", a subdirectory or a
+# key prefix in the other backends) with its own chunk size: small hot files fit in one chunk and keep
+# their own index and working set, large cold ones are split in fewer, bigger chunks.
+IMAGES_BUCKET = "images"
+THUMBNAILS_BUCKET = "thumbnails"
+PDFS_BUCKET = "pdfs"
+# Files rebuilt on demand (bundle PDFs, sprite sheets): the whole bucket can be dropped at once
+GENERATED_CACHE_BUCKET = "generated-cache"
+AI_ARTIFACTS_BUCKET = "ai-artifacts"
+
+BUCKET_CHUNK_SIZES = {
+    IMAGES_BUCKET: int(os.environ.get('IMAGES_CHUNK_KB', '512')) * 1024,
+    THUMBNAILS_BUCKET: int(os.environ.get('THUMBNAILS_CHUNK_KB', '255')) * 1024,
+    PDFS_BUCKET: int(os.environ.get('PDFS_CHUNK_KB', '1024')) * 1024,
+    GENERATED_CACHE_BUCKET: int(os.environ.get('GENERATED_CACHE_CHUNK_KB', '1024')) * 1024,
+    AI_ARTIFACTS_BUCKET: int(os.environ.get('AI_ARTIFACTS_CHUNK_KB', '1024')) * 1024,
+}
+
+# Every bucket, including the default one of files stored before storage classes
+MEDIA_BUCKETS = (DEFAULT_BUCKET, *BUCKET_CHUNK_SIZES)
+
+# metadata.type of regenerable files
+GENERATED_TYPES = ("sprite", "bundle_generated_pdf")
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeds the size limit of its kind of file"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        super().__init__(f"File troppo grande: massimo {max_bytes // (1024 * 1024)} MB")
+
+
+@dataclass(frozen=True)
+class StoredUpload:
+    """Result of a streamed upload: file id, content sha256 and size in bytes"""
+    file_id: ObjectId
+    sha256: str
+    length: int
+
+
+def upload_limit(kind: str) -> int:
+    """Size limit in bytes for a kind of upload ("pdf" or "image")"""
+    return MAX_UPLOAD_MB[kind] * 1024 * 1024
+
+
+async def read_upload(source, max_bytes: int) -> bytes:
+    """
+    Read a whole upload into memory, for content that must be decoded (images).
+    Raises UploadTooLarge as soon as more than max_bytes have been read.
+    """
+    if getattr(source, "size", None) and source.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+    buffer = bytearray()
+    while True:
+        data = await source.read(UPLOAD_READ_SIZE)
+        if not data:
+            return bytes(buffer)
+        buffer += data
+        if len(buffer) > max_bytes:
+            raise UploadTooLarge(max_bytes)
+
+
+def to_object_id(file_id) -> Optional[ObjectId]:
+    """Convert a stored file id (str or ObjectId) to ObjectId, None if invalid"""
+    if isinstance(file_id, ObjectId):
+        return file_id
+    try:
+        return ObjectId(file_id)
+    except (InvalidId, TypeError):
+        return None
+
+
+def media_url(sha256: str) -> str:
+    """Immutable URL of a file served by content hash"""
+    return f"/api/media/{sha256}"
+
+
+def media_class(metadata: Optional[dict]) -> str:
+    """Bucket of a new file, from its metadata"""
+    metadata = metadata or {}
+    if metadata.get('derivative_key'):
+        return THUMBNAILS_BUCKET
+    if metadata.get('type') in GENERATED_TYPES:
+        return GENERATED_CACHE_BUCKET
+    if metadata.get('generated_by'):
+        return AI_ARTIFACTS_BUCKET
+    if metadata.get('content_type') == "application/pdf" or metadata.get('file_type') == "pdf":
+        return PDFS_BUCKET
+    return IMAGES_BUCKET
+
+
+class MediaStore:
+    """
+    Stored media at chunk granularity, with content hashes. Every upload, read and delete goes
+    through here: files documents in the GridFS bucket, contents in the configured blob backend.
+    """
+
+    def __init__(self, db, bucket_name: str = "fs", backend: Optional[str] = None):
+        self.db = db
+        self.files = db[f"{bucket_name}.files"]
+        # Chunks of files stored before storage classes
+        self.chunks = db[f"{bucket_name}.chunks"]
+        # sha256 (_id) -> shared GridFS file and number of references to it
+        self.blobs = db["media_blobs"]
+        self._gridfs: Dict[str, GridFSBackend] = {}
+        # Backend new files are written to
+        self.write_backend = backend or MEDIA_STORAGE_BACKEND
+        if self.write_backend not in BACKENDS:
+            raise ValueError(f"Backend di storage sconosciuto: {self.write_backend}")
+        # Requests per file, flushed to accessCount / accessedAt
+        self.access = AccessTracker()
+        # Cold files being moved back, by id
+        self._promotions: Dict[ObjectId, asyncio.Task] = {}
+
+    def chunks_of(self, bucket: str):
+        """GridFS chunks collection of a bucket"""
+        return self.chunks if bucket == DEFAULT_BUCKET else self.db[f"{bucket}.chunks"]
+
+    def backend(self, name: str, bucket: str = DEFAULT_BUCKET) -> BlobBackend:
+        """Blob backend by name ("gridfs", "local" or "s3") for one bucket"""
+        if name != "gridfs":
+            return external_backend(name, bucket)
+        if bucket not in self._gridfs:
+            self._gridfs[bucket] = GridFSBackend(self.chunks_of(bucket), BUCKET_CHUNK_SIZES.get(bucket, GRIDFS_CHUNK_SIZE))
+        return self._gridfs[bucket]
+
+    def _open_writer(self, bucket: str) -> Tuple[ObjectId, BlobWriter]:
+        """Id and content writer of a new file in the write backend"""
+        file_id = ObjectId()
+        return file_id, self.backend(self.write_backend, bucket).open_writer(file_id)
+
+    async def _commit(self, file_id: ObjectId, writer: BlobWriter, bucket: str, filename: str, length: int, metadata: dict):
+        """Close a writer and insert the files document that makes its content visible"""
+        file_doc = {
+            "_id": file_id,
+            "length": length,
+            "uploadDate": datetime.now(timezone.utc),
+            "filename": filename,
+            "metadata": metadata,
+            "bucket": bucket,
+            **await writer.close()
+        }
+        if self.write_backend != "gridfs":
+            file_doc["backend"] = self.write_backend
+        try:
+            await self.files.insert_one(file_doc)
+        except BaseException:
+            await self.backend(self.write_backend, bucket).delete_many([file_id])
+            raise
+
+    async def _abort(self, file_id: ObjectId, writer: BlobWriter):
+        """Drop a partly written file, logging rather than masking the original error"""
+        try:
+            await writer.abort()
+        except Exception as e:
+            logger.warning(f"Could not remove partial upload {file_id}: {str(e)}")
+
+    async def ensure_indexes(self):
+        await self.files.create_index("metadata.sha256")
+        await self.files.create_index("metadata.derivative_key")
+        await self.files.create_index("metadata.source_file_id")
+        await self.files.create_index("metadata.recompressed_from.sha256")
+        await self.files.create_index("bucket")
+        await self.files.create_index("accessedAt")
+        # Same index GridFS creates on its first upload; resumable chunks may be written before that
+        for bucket in MEDIA_BUCKETS:
+            await self.chunks_of(bucket).create_index([("files_id", 1), ("n", 1)], unique=True)
+        await self.blobs.create_index("fileId", unique=True)
+
+    async def upload(self, filename: str, content: bytes, metadata: Optional[dict] = None, dedup: bool = True) -> ObjectId:
+        """
+        Store bytes in the bucket of their class, recording the content sha256 in the file metadata.
+        With dedup, content already stored returns the existing file (one more reference to it);
+        derived files owned by a key rather than a document (derivatives, sprites) pass dedup=False.
+        """
+        metadata = dict(metadata or {})
+        metadata['sha256'] = hashlib.sha256(content).hexdigest()
+        if dedup:
+            existing = await self._claim_blob(metadata['sha256'])
+            if existing:
+                return existing
+        bucket = media_class(metadata)
+        file_id, writer = self._open_writer(bucket)
+        try:
+            await writer.write(content)
+            await self._commit(file_id, writer, bucket, filename, len(content), metadata)
+        except BaseException:
+            await self._abort(file_id, writer)
+            raise
+        if dedup:
+            file_id = await self._adopt_blob(metadata['sha256'], file_id, len(content))
+        return file_id
+
+    async def _claim_blob(self, sha256: str) -> Optional[ObjectId]:
+        """Take one more reference to the stored file with this hash, None if there is none"""
+        blob = await self.blobs.find_one_and_update(
+            {"_id": sha256, "refs": {"$gt": 0}, "fencedAt": {"$exists": False}},
+            {"$inc": {"refs": 1}, "$set": {"claimedAt": datetime.now(timezone.utc)}}
+        )
+        return blob['fileId'] if blob else None
+
+    async def fence_blob(self, file_id: ObjectId, claimed_before: datetime) -> Optional[dict]:
+        """
+        Stop uploads from claiming a file about to be collected or replaced (fencedAt on its blob; releases
+        still count down its references). Returns the blob as it was ({} when the file has none), or None when
+        it was claimed since claimed_before: the claiming upload may not have linked it yet, so the file must be kept.
+        """
+        blob = await self.blobs.find_one_and_update(
+            {"fileId": file_id, "$or": [{"claimedAt": {"$exists": False}}, {"claimedAt": {"$lt": claimed_before}}]},
+            {"$set": {"fencedAt": datetime.now(timezone.utc)}}
+        )
+        if blob:
+            return blob
+        return None if await self.blobs.find_one({"fileId": file_id}, {"_id": 1}) else {}
+
+    async def unfence_blob(self, blob: dict):
+        """Let uploads claim a fenced blob again (the file turned out to be in use)"""
+        await self.blobs.update_one({"_id": blob['_id']}, {"$unset": {"fencedAt": ""}})
+
+    async def _adopt_blob(self, sha256: str, file_id: ObjectId, length: int) -> ObjectId:
+        """
+        Register a file just stored as the blob of its hash. If an identical upload registered
+        first, the new file is deleted and a reference to the other one is returned instead.
+        """
+        for _ in range(3):
+            try:
+                await self.blobs.insert_one({
+                    "_id": sha256,
+                    "fileId": file_id,
+                    "refs": 1,
+                    "length": length,
+                    "createdAt": datetime.now(timezone.utc)
+                })
+                return file_id
+            except DuplicateKeyError:
+                existing = await self._claim_blob(sha256)
+                if existing == file_id:
+                    # Registered by an earlier run for this very file: drop the reference just taken
+                    await self.blobs.update_one({"_id": sha256}, {"$inc": {"refs": -1}})
+                    return file_id
+                if existing:
+                    await self._remove([file_id])
+                    return existing
+                # The other blob is being deleted (refs reached 0): try again
+        logger.warning(f"Could not register blob {sha256}, keeping {file_id} unshared")
+        return file_id
+
+    async def upload_stream(self, filename: str, source, max_bytes: int, metadata: Optional[dict] = None) -> StoredUpload:
+        """
+        Copy an upload (anything with an async read(size), e.g. UploadFile) into storage piece by piece,
+        hashing it on the way, so memory stays bounded by UPLOAD_READ_SIZE.
+        Raises UploadTooLarge past max_bytes; the chunks already written are removed.
+        """
+        if getattr(source, "size", None) and source.size > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        metadata = dict(metadata or {})
+        digest = hashlib.sha256()
+        length = 0
+        bucket = media_class(metadata)
+        file_id, writer = self._open_writer(bucket)
+        try:
+            while True:
+                data = await source.read(UPLOAD_READ_SIZE)
+                if not data:
+                    break
+                length += len(data)
+                if length > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                digest.update(data)
+                await writer.write(data)
+            existing = await self._claim_blob(digest.hexdigest())
+            if existing:
+                # Same content already stored: drop the copy instead of closing it
+                await writer.abort()
+                return StoredUpload(file_id=existing, sha256=digest.hexdigest(), length=length)
+            await self._commit(file_id, writer, bucket, filename, length, {**metadata, "sha256": digest.hexdigest()})
+        except BaseException:
+            # Also on cancellation (client gone): drop the content written so far
+            await self._abort(file_id, writer)
+            raise
+        file_id = await self._adopt_blob(digest.hexdigest(), file_id, length)
+        return StoredUpload(file_id=file_id, sha256=digest.hexdigest(), length=length)
+
+    async def write_chunk(self, file_id: ObjectId, n: int, data: bytes, bucket: str = DEFAULT_BUCKET):
+        """
+        Store chunk n of a file whose files document is written later by assemble() (resumable uploads).
+        Idempotent: a chunk sent again replaces the previous copy.
+        """
+        chunks = self.chunks_of(bucket)
+        query = {"files_id": file_id, "n": n}
+        chunk = {"files_id": file_id, "n": n, "data": Binary(data)}
+        try:
+            await chunks.replace_one(query, chunk, upsert=True)
+        except DuplicateKeyError:
+            # Same chunk uploaded twice in parallel: the other upsert created it
+            await chunks.replace_one(query, chunk)
+
+    async def delete_chunks(self, file_id: ObjectId, bucket: str = DEFAULT_BUCKET):
+        """Remove the chunks of a file that was never assembled"""
+        await self.chunks_of(bucket).delete_many({"files_id": file_id})
+
+    async def assemble(self, file_id: ObjectId, filename: str, length: int, chunk_size: int, metadata: Optional[dict] = None,
+                       bucket: str = DEFAULT_BUCKET) -> StoredUpload:
+        """
+        Write the files document over chunks stored with write_chunk, so they become a regular GridFS file
+        without copying them. The chunks are read once, in order, to compute the sha256; with another
+        write backend they are copied there on the same pass, then removed.
+        Idempotent: run again once the files document exists, it returns that file unchanged.
+        Raises CorruptGridFile when chunks are missing or do not add up to length.
+        """
+        assembled = await self.files.find_one({"_id": file_id}, {"length": 1, "metadata.sha256": 1})
+        if assembled:
+            return StoredUpload(file_id=file_id, sha256=assembled['metadata']['sha256'], length=assembled['length'])
+        file_doc = {
+            "_id": file_id,
+            "length": length,
+            "chunkSize": chunk_size,
+            "uploadDate": datetime.now(timezone.utc),
+            "filename": filename,
+            "metadata": dict(metadata or {})
+        }
+        if bucket != DEFAULT_BUCKET:
+            file_doc["bucket"] = bucket
+        target = self.backend(self.write_backend, bucket)
+        writer = None if self.write_backend == "gridfs" else target.open_writer(file_id)
+        digest = hashlib.sha256()
+        total = 0
+        try:
+            async for data in self.iter_chunks(file_doc):
+                digest.update(data)
+                total += len(data)
+                if writer:
+                    await writer.write(data)
+            if total != length:
+                raise CorruptGridFile(f"File {file_id}: {total} byte ricevuti su {length}")
+            if writer:
+                file_doc.update(await writer.close(), backend=self.write_backend)
+                del file_doc["chunkSize"]
+        except BaseException:
+            if writer:
+                await self._abort(file_id, writer)
+            raise
+        sha256 = digest.hexdigest()
+        existing = await self._claim_blob(sha256)
+        if existing == file_id:
+            # Assembled concurrently by another finalize of the same upload: nothing to drop
+            await self.blobs.update_one({"_id": sha256}, {"$inc": {"refs": -1}})
+            return StoredUpload(file_id=file_id, sha256=sha256, length=length)
+        if existing:
+            if writer:
+                await target.delete_many([file_id])
+            await self.delete_chunks(file_id, bucket)
+            return StoredUpload(file_id=existing, sha256=sha256, length=length)
+        file_doc["metadata"]["sha256"] = sha256
+        # Upsert: a finalize interrupted after this point can be run again
+        await self.files.replace_one({"_id": file_id}, file_doc, upsert=True)
+        if writer:
+            await self.delete_chunks(file_id, bucket)
+        file_id = await self._adopt_blob(sha256, file_id, length)
+        return StoredUpload(file_id=file_id, sha256=sha256, length=length)
+
+    async def read(self, file_doc: dict) -> bytes:
+        """Read a whole file; only for small files or code that needs the full content"""
+        return b"".join([data async for data in self.iter_chunks(file_doc)])
+
+    async def delete(self, file_id) -> bool:
+        """
+        Release a reference to a file. A shared file is deleted (with its chunks and derivatives, as in
+        delete_many) only when its last reference goes; returns True when the file was deleted.
+        Raises NoFile if it does not exist.
+        """
+        oid = to_object_id(file_id)
+        if oid is None:
+            raise NoFile(f"File {file_id} non trovato in GridFS")
+        blob = await self.blobs.find_one_and_update(
+            {"fileId": oid, "refs": {"$gt": 0}},
+            {"$inc": {"refs": -1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if blob and blob['refs'] > 0:
+            return False
+        if blob:
+            await self.blobs.delete_one({"_id": blob['_id'], "refs": {"$lte": 0}})
+        derivatives = await self.derivative_ids(oid)
+        if not await self._remove([oid]):
+            raise NoFile(f"File {file_id} non trovato in GridFS")
+        if derivatives:
+            await self._remove(derivatives)
+        return True
+
+    async def delete_many(self, file_ids: Iterable) -> List[ObjectId]:
+        """
+        Bulk delete(): release one reference per listed id (an id may be listed more than once), then
+        remove the files whose last reference went, and their derivatives, with a single delete_many
+        on files and one per backend. Returns the ids removed; missing files are ignored.
+        """
+        counts = Counter(oid for oid in (to_object_id(fid) for fid in file_ids if fid) if oid)
+        if not counts:
+            return []
+        removed = set(counts)
+        released_blobs = []
+        async for blob in self.blobs.find({"fileId": {"$in": list(counts)}}, {"fileId": 1}):
+            updated = await self.blobs.find_one_and_update(
+                {"_id": blob['_id'], "refs": {"$gt": 0}},
+                {"$inc": {"refs": -counts[blob['fileId']]}},
+                return_document=ReturnDocument.AFTER
+            )
+            if updated and updated['refs'] > 0:
+                removed.discard(blob['fileId'])
+            else:
+                released_blobs.append(blob['_id'])
+        if released_blobs:
+            await self.blobs.delete_many({"_id": {"$in": released_blobs}, "refs": {"$lte": 0}})
+        if not removed:
+            return []
+
+        derivatives = self.files.find({"metadata.source_file_id": {"$in": [str(oid) for oid in removed]}}, {"_id": 1})
+        removed = list(removed) + [doc['_id'] async for doc in derivatives]
+        await self._remove(removed)
+        return removed
+
+    async def _remove(self, file_ids: List[ObjectId]) -> int:
+        """
+        Delete files documents, then their contents from the backend and bucket of each one.
+        Returns the number of files documents deleted.
+        """
+        stored = defaultdict(list)
+        async for doc in self.files.find({"_id": {"$in": file_ids}}, {"backend": 1, "bucket": 1}):
+            stored[backend_name(doc), bucket_name(doc)].append(doc['_id'])
+        # Files first, like GridFS: a reader never finds a files document without its content
+        result = await self.files.delete_many({"_id": {"$in": file_ids}})
+        for (name, bucket), ids in stored.items():
+            await self.backend(name, bucket).delete_many(ids)
+        # Ids without a files document may still have chunks (unfinished uploads)
+        found = {oid for ids in stored.values() for oid in ids}
+        missing = [oid for oid in file_ids if oid not in found]
+        if missing:
+            await self.backend("gridfs").delete_many(missing)
+        return result.deleted_count
+
+    async def migrate(self, file_doc: dict, target: str, bucket: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """
+        Copy the content of a file to another backend and/or bucket (same bucket when None) and switch
+        its files document over to it. The old copy is left in place for readers that fetched the document
+        before the switch: returns its (backend, bucket), to be removed later with delete_content(), or
+        None when nothing moved (already there, or the file was deleted or moved meanwhile).
+        """
+        source = (backend_name(file_doc), bucket_name(file_doc))
+        destination = (target, bucket or source[1])
+        if source == destination:
+            return None
+        writer = self.backend(*destination).open_writer(file_doc['_id'])
+        try:
+            async for data in self.iter_chunks(file_doc):
+                await writer.write(data)
+            fields = await writer.close()
+        except BaseException:
+            await self._abort(file_doc['_id'], writer)
+            raise
+        update = {"$set": dict(fields), "$unset": {}}
+        for field, value, default in (("backend", destination[0], "gridfs"), ("bucket", destination[1], DEFAULT_BUCKET)):
+            if value == default:
+                update["$unset"][field] = ""
+            else:
+                update["$set"][field] = value
+        for field in ("chunkSize", "coldLength"):
+            if field not in fields:
+                update["$unset"][field] = ""
+        result = await self.files.update_one(
+            {"_id": file_doc['_id'], "backend": file_doc.get('backend'), "bucket": file_doc.get('bucket')},
+            {op: values for op, values in update.items() if values}
+        )
+        if not result.modified_count:
+            await self.backend(*destination).delete_many([file_doc['_id']])
+            return None
+        return source
+
+    async def delete_content(self, backend: str, bucket: str, file_ids: List[ObjectId]):
+        """Remove contents left in a backend by migrate()"""
+        await self.backend(backend, bucket).delete_many(file_ids)
+
+    def promote(self, file_doc: dict):
+        """
+        Move a cold file back to the write backend in background (once at a time per file); no-op for
+        other files. Called for client requests only: iter_chunks leaves cold files where they are.
+        """
+        if backend_name(file_doc) != COLD_BACKEND or file_doc['_id'] in self._promotions:
+            return
+        task = asyncio.get_running_loop().create_task(self._promote(file_doc))
+        self._promotions[file_doc['_id']] = task
+        task.add_done_callback(lambda _: self._promotions.pop(file_doc['_id'], None))
+
+    def promoting(self, file_id) -> bool:
+        return file_id in self._promotions
+
+    async def _promote(self, file_doc: dict):
+        try:
+            moved_from = await self.migrate(file_doc, self.write_backend)
+            if not moved_from:
+                return
+            # Read again: not a candidate for the cold tier until it goes unrequested again
+            await self.files.update_one({"_id": file_doc['_id']}, {"$max": {"accessedAt": datetime.now(timezone.utc)}})
+            await asyncio.sleep(MEDIA_TIER_GRACE_SECONDS)
+            await self.delete_content(*moved_from, [file_doc['_id']])
+        except Exception as e:
+            logger.warning(f"Could not promote cold file {file_doc['_id']}: {str(e)}")
+
+    async def drop_bucket(self, bucket: str) -> int:
+        """
+        Delete every file of a bucket at once: the files documents with one delete_many, the contents by
+        dropping the bucket in each backend (chunks collection, directory or key prefix) instead of file by file.
+        Only for buckets of files nothing shares (stored with dedup=False). Returns the number of files deleted.
+        """
+        if bucket == DEFAULT_BUCKET or bucket not in BUCKET_CHUNK_SIZES:
+            raise ValueError(f"Bucket non eliminabile: {bucket}")
+        backends = {name or "gridfs" for name in await self.files.distinct("backend", {"bucket": bucket})}
+        file_ids = await self.files.distinct("_id", {"bucket": bucket})
+        result = await self.files.delete_many({"bucket": bucket})
+        await self.blobs.delete_many({"fileId": {"$in": file_ids}})
+        for name in backends | {self.write_backend}:
+            await self.backend(name, bucket).drop()
+        await self.chunks_of(bucket).create_index([("files_id", 1), ("n", 1)], unique=True)
+        return result.deleted_count
+
+    async def find_by_hash(self, sha256: str) -> Optional[dict]:
+        """Return a files document with the given content hash (or recompressed from it), or None"""
+        return (
+            await self.files.find_one({"metadata.sha256": sha256})
+            or await self.files.find_one({"metadata.recompressed_from.sha256": sha256})
+        )
+
+    async def find_derivative(self, key: str) -> Optional[dict]:
+        """Return the files document of a stored image derivative, or None"""
+        return await self.files.find_one({"metadata.derivative_key": key})
+
+    async def derivative_ids(self, source_id) -> List[ObjectId]:
+        """Ids of the derivatives rendered from a source file"""
+        cursor = self.files.find({"metadata.source_file_id": str(source_id)}, {"_id": 1})
+        return [doc['_id'] async for doc in cursor]
+
+    async def move_derivatives(self, source_id, target_id) -> Dict[str, str]:
+        """
+        Re-parent the derivatives of source_id onto target_id, a file with the same content.
+        Where the target already has the same derivative, the source's copy is deleted.
+        Returns {old derivative id: id of the derivative now serving it} for the deleted copies.
+        """
+        source_id, target_id = str(source_id), str(target_id)
+        replaced = {}
+        async for doc in self.files.find({"metadata.source_file_id": source_id}, {"metadata.derivative_key": 1}):
+            key = (doc.get('metadata') or {}).get('derivative_key') or ""
+            new_key = target_id + key[len(source_id):] if key.startswith(source_id) else key
+            existing = await self.find_derivative(new_key) if new_key else None
+            if existing:
+                await self._remove([doc['_id']])
+                replaced[str(doc['_id'])] = str(existing['_id'])
+            else:
+                await self.files.update_one(
+                    {"_id": doc['_id']},
+                    {"$set": {"metadata.source_file_id": target_id, "metadata.derivative_key": new_key}}
+                )
+        return replaced
+
+    def duplicate_groups(self):
+        """
+        Cursor over uploaded files sharing the same content (derivatives and sprites excluded):
+        {_id: sha256, length, files: [ids, oldest first]}, only for hashes stored more than once.
+        """
+        return self.files.aggregate([
+            {"$match": {
+                "metadata.sha256": {"$exists": True},
+                "metadata.derivative_key": {"$exists": False},
+                "metadata.type": {"$ne": "sprite"}
+            }},
+            {"$sort": {"uploadDate": 1}},
+            {"$group": {"_id": "$metadata.sha256", "length": {"$first": "$length"}, "files": {"$push": "$_id"}}},
+            {"$match": {"files.1": {"$exists": True}}}
+        ])
+
+    async def register_blob(self, sha256: str, file_id: ObjectId, length: int, refs: int):
+        """Record an existing file as the shared blob of its hash with the given reference count"""
+        await self.blobs.replace_one(
+            {"_id": sha256},
+            {"_id": sha256, "fileId": file_id, "refs": refs, "length": length, "createdAt": datetime.now(timezone.utc)},
+            upsert=True
+        )
+
+    async def dedup_report(self) -> dict:
+        """
+        Storage saved by shared blobs so far, and still reclaimable by merging files stored
+        more than once before deduplication (or outside it).
+        """
+        report = {"blobs": 0, "sharedReferences": 0, "savedBytes": 0, "duplicateGroups": 0, "duplicateFiles": 0, "reclaimableBytes": 0}
+        async for blob in self.blobs.find({}, {"refs": 1, "length": 1}):
+            report["blobs"] += 1
+            report["sharedReferences"] += max(blob['refs'] - 1, 0)
+            report["savedBytes"] += max(blob['refs'] - 1, 0) * blob.get('length', 0)
+        async for group in self.duplicate_groups():
+            report["duplicateGroups"] += 1
+            report["duplicateFiles"] += len(group['files']) - 1
+            report["reclaimableBytes"] += (len(group['files']) - 1) * group['length']
+        return report
+
+    async def hashes_for(self, file_ids: Iterable) -> Dict[str, str]:
+        """Map file id (as str) -> sha256 for the given image ids, with a single query"""
+        oids = {oid for oid in (to_object_id(fid) for fid in file_ids if fid) if oid}
+        if not oids:
+            return {}
+        cursor = self.files.find(
+            {
+                "_id": {"$in": list(oids)},
+                "metadata.sha256": {"$exists": True},
+                "metadata.content_type": {"$regex": "^image/"}
+            },
+            {"metadata.sha256": 1}
+        )
+        return {str(doc['_id']): doc['metadata']['sha256'] async for doc in cursor}
+
+    async def backfill_hashes(self) -> int:
+        """Compute sha256 for files stored before content hashing existed"""
+        updated = 0
+        cursor = self.files.find({"metadata.sha256": {"$exists": False}}, {"length": 1, "chunkSize": 1, "backend": 1, "bucket": 1, "metadata": 1})
+        async for file_doc in cursor:
+            digest = hashlib.sha256()
+            try:
+                async for data in self.iter_chunks(file_doc):
+                    digest.update(data)
+            except CorruptGridFile as e:
+                logger.warning(f"Skipping hash backfill for {file_doc['_id']}: {str(e)}")
+                continue
+            if isinstance(file_doc.get('metadata'), dict):
+                update = {"metadata.sha256": digest.hexdigest()}
+            else:
+                update = {"metadata": {"sha256": digest.hexdigest()}}
+            await self.files.update_one({"_id": file_doc['_id']}, {"$set": update})
+            updated += 1
+        return updated
+
+    async def find(self, file_id) -> dict:
+        """
+        Return the files document for file_id.
+        Raises NoFile if the id is invalid or the file does not exist.
+        """
+        oid = to_object_id(file_id)
+        file_doc = await self.files.find_one({"_id": oid}) if oid else None
+        if not file_doc:
+            raise NoFile(f"File {file_id} non trovato in GridFS")
+        return file_doc
+
+    async def iter_chunks(self, file_doc: dict, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        Yield bytes [start, end] (inclusive) of a file, a chunk at a time, from its backend.
+        Only the span requested is fetched (GridFS chunks covering it, a ranged read elsewhere).
+        A pure read: cold files are read where they are, promotion is up to the caller (promote).
+        """
+        length = file_doc.get('length', 0)
+        if end is None or end >= length:
+            end = length - 1
+        if length == 0 or start > end:
+            return
+
+        async for data in self.backend(backend_name(file_doc), bucket_name(file_doc)).iter_range(file_doc, start, end):
+            yield data
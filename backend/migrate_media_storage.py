@@ -0,0 +1,134 @@
+"""
+Media storage migration
+Moves the contents of stored files between blob backends (gridfs, local,
+s3) and/or from the default "fs" bucket into the bucket of their storage
+class (--buckets), while the application keeps running. Each file is copied
+and its files document switched over to the new copy; the old copy is removed
+only after a grace period, so downloads that already read the document keep
+working. Interrupted runs can be started again: files already moved are
+skipped.
+
+Set MEDIA_STORAGE_BACKEND to the target on the servers as well, so new
+uploads stop going to the old backend.
+
+Usage (same MONGO_URL / DB_NAME and MEDIA_* variables as the server):
+    python migrate_media_storage.py --to s3 [--from gridfs] [--dry-run]
+    python migrate_media_storage.py --buckets [--dry-run]
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import logging
+from collections import deque
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from blob_storage import BACKENDS, COLD_BACKEND, DEFAULT_BUCKET, backend_name, bucket_name
+from media_storage import GENERATED_CACHE_BUCKET, MediaStore, media_class
+
+logger = logging.getLogger("migrate_media_storage")
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+DB_NAME = os.environ.get('DB_NAME', 'pompiconni_db')
+
+
+def backend_filter(backend: str) -> dict:
+    return {"backend": None if backend == "gridfs" else backend}
+
+
+def migration_query(target: str, source: str, buckets: bool) -> dict:
+    """
+    Files documents to move: in the source backend (any when None), not yet in target or not yet
+    classified. Cold files stay where they are: they go to the write backend when read again.
+    """
+    pending = []
+    if target:
+        pending.append({"backend": {"$ne": None if target == "gridfs" else target}})
+    if buckets:
+        pending.append({"bucket": None})
+    return {"$and": [backend_filter(source) if source else {"backend": {"$ne": COLD_BACKEND}}, {"$or": pending}]}
+
+
+async def migrate(target: str, source: str, buckets: bool, dry_run: bool, grace_seconds: float, files_per_second: float):
+    db = AsyncIOMotorClient(MONGO_URL)[DB_NAME]
+    store = MediaStore(db)
+    query = migration_query(target, source, buckets)
+    # Bundle PDFs generated before storage classes carry no type: recognised by their reference
+    generated = {str(doc['generatedPdfFileId']) async for doc in db.bundles.find(
+        {"generatedPdfFileId": {"$nin": [None, ""]}}, {"generatedPdfFileId": 1}
+    )} if buckets else set()
+    stats = {"files": 0, "bytes": 0, "moved": 0, "skipped": 0, "failed": 0}
+    # (time of the switch, (backend, bucket), file id) of old copies waiting for the grace period
+    pending = deque()
+
+    async def release(until: float):
+        while pending and pending[0][0] <= until:
+            _, (backend, bucket), file_id = pending.popleft()
+            try:
+                await store.delete_content(backend, bucket, [file_id])
+            except Exception as e:
+                logger.warning(f"Could not remove old copy of {file_id} from {backend}/{bucket}: {str(e)}")
+
+    def destination_bucket(file_doc: dict):
+        if not buckets or bucket_name(file_doc) != DEFAULT_BUCKET:
+            return None
+        if str(file_doc['_id']) in generated:
+            return GENERATED_CACHE_BUCKET
+        return media_class(file_doc.get('metadata'))
+
+    interval = 1 / files_per_second if files_per_second > 0 else 0
+    projection = {"length": 1, "chunkSize": 1, "backend": 1, "bucket": 1, "metadata": 1}
+    cursor = store.files.find(query, projection, no_cursor_timeout=True)
+    async for file_doc in cursor:
+        stats["files"] += 1
+        stats["bytes"] += file_doc.get('length', 0)
+        if dry_run:
+            continue
+        try:
+            moved_from = await store.migrate(file_doc, target or backend_name(file_doc), destination_bucket(file_doc))
+        except Exception as e:
+            stats["failed"] += 1
+            logger.warning(f"Could not migrate {file_doc['_id']}: {str(e)}")
+            continue
+        if moved_from:
+            stats["moved"] += 1
+            pending.append((time.monotonic(), moved_from, file_doc['_id']))
+        else:
+            stats["skipped"] += 1
+        await release(time.monotonic() - grace_seconds)
+        if interval:
+            await asyncio.sleep(interval)
+
+    if pending:
+        logger.info(f"Waiting {grace_seconds:.0f}s before removing the last {len(pending)} old copies")
+        await asyncio.sleep(max(pending[-1][0] + grace_seconds - time.monotonic(), 0))
+        await release(time.monotonic())
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--to", choices=BACKENDS, help="backend the files are moved to")
+    parser.add_argument("--buckets", action="store_true", help="move files of the default bucket to the bucket of their class")
+    parser.add_argument("--from", dest="source", choices=BACKENDS, help="only move files from this backend")
+    parser.add_argument("--dry-run", action="store_true", help="only count the files to move")
+    parser.add_argument("--grace-seconds", type=float, default=300, help="delay before an old copy is removed")
+    parser.add_argument("--files-per-second", type=float, default=20, help="rate limit (0 = none)")
+    args = parser.parse_args()
+    if not args.to and not args.buckets:
+        parser.error("indicare --to e/o --buckets")
+    if args.source and args.source == args.to:
+        parser.error("--from e --to devono essere diversi")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    stats = asyncio.run(migrate(args.to, args.source, args.buckets, args.dry_run, args.grace_seconds, args.files_per_second))
+    action = "da spostare" if args.dry_run else "spostati"
+    print(f"{stats['files']} file ({stats['bytes'] / (1024 * 1024):.1f} MB) {action}")
+    if not args.dry_run:
+        print(f"spostati: {stats['moved']}, saltati: {stats['skipped']}, errori: {stats['failed']}")
+
+
+if __name__ == "__main__":
+    main()
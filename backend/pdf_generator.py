@@ -5,6 +5,7 @@ Generates high-quality A4 PDFs with text + images per scene
 
 import io
 import re
+from typing import Optional
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm, cm
 from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
@@ -196,14 +197,25 @@ def create_faded_image(image_data: bytes, opacity: float = 0.15) -> io.BytesIO:
         return None
 
 
-def fit_image_to_area(image_data: bytes, max_width: float, max_height: float) -> tuple:
+def known_image_size(image_meta: Optional[dict]) -> Optional[tuple]:
+    """(width, height) recorded at upload time on the owning document (<field>Meta), if any"""
+    if image_meta and image_meta.get('width') and image_meta.get('height'):
+        return (image_meta['width'], image_meta['height'])
+    return None
+
+
+def fit_image_to_area(image_data: bytes, max_width: float, max_height: float, size: Optional[tuple] = None) -> tuple:
     """
     Calculate dimensions to fit image in area while maintaining aspect ratio.
+    `size` is the pixel size when already known (see known_image_size), otherwise it is
+    read from the image header.
     Returns (width, height) in points.
     """
     try:
-        img = PILImage.open(io.BytesIO(image_data))
-        img_width, img_height = img.size
+        if size:
+            img_width, img_height = size
+        else:
+            img_width, img_height = PILImage.open(io.BytesIO(image_data)).size
         
         # Calculate scaling factors
         width_ratio = max_width / img_width
@@ -218,6 +230,25 @@ def fit_image_to_area(image_data: bytes, max_width: float, max_height: float) ->
         return (max_width * 0.8, max_height * 0.8)
 
 
+def image_page_pdf(image_data: bytes, size: Optional[tuple] = None) -> bytes:
+    """
+    Single A4 page with the image centered and scaled to fit (page PDF of an illustration
+    without one). reportlab reads the stored PNG/JPEG directly, no re-encoding.
+    Blocking: run it in a worker thread.
+    """
+    scaled_width, scaled_height = fit_image_to_area(image_data, PAGE_WIDTH, PAGE_HEIGHT, size)
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    c.drawImage(
+        ImageReader(io.BytesIO(image_data)),
+        (PAGE_WIDTH - scaled_width) / 2, (PAGE_HEIGHT - scaled_height) / 2,
+        scaled_width, scaled_height
+    )
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
 def draw_page_footer(canvas_obj, doc):
     """Draw copyright footer on every page"""
     canvas_obj.saveState()
@@ -429,7 +460,8 @@ class BookPDFGenerator:
             if faded:
                 # Calculate size to cover the content area
                 img_width, img_height = fit_image_to_area(
-                    bg_image_data, CONTENT_WIDTH, CONTENT_HEIGHT * 0.5
+                    bg_image_data, CONTENT_WIDTH, CONTENT_HEIGHT * 0.5,
+                    size=known_image_size(scene.get('coloredImageMeta'))
                 )
                 
                 try:
@@ -467,7 +499,8 @@ class BookPDFGenerator:
                 
                 # Fit image to page content area
                 img_width, img_height = fit_image_to_area(
-                    img_data, CONTENT_WIDTH, CONTENT_HEIGHT
+                    img_data, CONTENT_WIDTH, CONTENT_HEIGHT,
+                    size=known_image_size(scene.get('lineArtImageMeta'))
                 )
                 
                 img = RLImage(io.BytesIO(img_data), width=img_width, height=img_height)
@@ -1,27 +1,60 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, BackgroundTasks, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse, Response
+from fastapi.responses import StreamingResponse, Response, FileResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from gridfs.errors import CorruptGridFile, NoFile
+from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 import re
+import time
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from collections import defaultdict, deque
 from enum import Enum
 import uuid
+import socket
 import hashlib
 from datetime import datetime, timezone, timedelta
 import jwt
 import base64
-import aiofiles
 import io
-from pdf_generator import generate_book_pdf
+import tempfile
+import posixpath
+from pdf_generator import generate_book_pdf, image_page_pdf, known_image_size
+from media_storage import (
+    COLD_BACKEND, DEFAULT_BUCKET, GENERATED_CACHE_BUCKET, MEDIA_BUCKETS, MEDIA_TIER_GRACE_SECONDS, PDFS_BUCKET,
+    MediaStore, StoredUpload, UploadTooLarge, UPLOAD_READ_SIZE,
+    UPLOAD_SESSION_CHUNK_SIZE, UPLOAD_SESSION_TTL_HOURS, media_url, read_upload, to_object_id, upload_limit
+)
+from media_access import MEDIA_ACCESS_FLUSH_SECONDS
+from bulk_import import (
+    IMAGE_EXTENSIONS, BulkImportError, ImportRow, ImportSource, open_import_source, read_manifest, resolve_import_path
+)
+from media_cache import (
+    MediaMemoryCache, SharedMediaCache, MediaDiskCache, iter_content, iter_file,
+    MEDIA_CACHE_MAX_MB, MEDIA_CACHE_MAX_ENTRY_KB, MEDIA_CACHE_BACKEND, MEDIA_SHM_PATH,
+    MEDIA_DISK_CACHE_DIR, MEDIA_DISK_CACHE_MAX_MB, MEDIA_DISK_CACHE_MAX_FILE_MB, MEDIA_DISK_CACHE_PRELOAD
+)
+from media_http import (
+    RangeNotSatisfiable, parse_range_header, is_initial_range_request, starts_download, content_range,
+    multipart_boundary, multipart_part_header, multipart_closing, multipart_length,
+    file_etag, file_last_modified, validator_headers, is_not_modified, if_range_matches,
+    not_modified_headers, offload_headers, MEDIA_OFFLOAD_MODE, MEDIA_OFFLOAD_MAX_FILE_MB, OFFLOAD_MODES
+)
+from image_processing import (
+    DerivativeRequest, parse_derivative_request, negotiate_format, derivative_key,
+    render_derivative, render_placeholder, render_sprite, image_meta_fields,
+    check_image, normalize_image, InvalidImage, ImageTooLarge, recompress_png, recompress_executor,
+    image_executor, THUMBNAIL_REQUEST,
+    SPRITE_TILE_SIZE, SPRITE_COLUMNS, SPRITE_MAX_TILES
+)
 from PyPDF2 import PdfMerger, PdfReader
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
 from PIL import Image as PILImage
 
 ROOT_DIR = Path(__file__).parent
@@ -32,8 +65,22 @@ mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ.get('DB_NAME', 'pompiconni_db')]
 
-# GridFS bucket for file storage
-gridfs_bucket = AsyncIOMotorGridFSBucket(db)
+# Stored media: files documents in GridFS, contents in the MEDIA_STORAGE_BACKEND blob backend
+media_store = MediaStore(db)
+
+# Cache for small media requested on every page view: per-process LRU, or an
+# arena in /dev/shm shared by all uvicorn workers (MEDIA_CACHE_BACKEND=shm)
+if MEDIA_CACHE_BACKEND == 'shm':
+    media_memory_cache = SharedMediaCache(MEDIA_SHM_PATH, MEDIA_CACHE_MAX_MB * 1024 * 1024, MEDIA_CACHE_MAX_ENTRY_KB * 1024)
+else:
+    media_memory_cache = MediaMemoryCache(MEDIA_CACHE_MAX_MB * 1024 * 1024, MEDIA_CACHE_MAX_ENTRY_KB * 1024)
+
+# Optional local-disk mirror of GridFS files (MEDIA_DISK_CACHE_DIR)
+media_disk_cache = MediaDiskCache(
+    MEDIA_DISK_CACHE_DIR,
+    MEDIA_DISK_CACHE_MAX_MB * 1024 * 1024,
+    MEDIA_DISK_CACHE_MAX_FILE_MB * 1024 * 1024
+) if MEDIA_DISK_CACHE_DIR else None
 
 # Stripe configuration
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY', '')
@@ -51,6 +98,8 @@ ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
 
 # Create the main app
 app = FastAPI(title="Poppiconni API", version="1.0.0")
+# Background job tasks, referenced until they finish (the event loop only keeps weak references)
+app.state.job_tasks = set()
 
 # Create routers
 api_router = APIRouter(prefix="/api")
@@ -66,6 +115,1217 @@ logger = logging.getLogger(__name__)
 UPLOAD_DIR = ROOT_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# ============== MEDIA STREAMING ==============
+
+# Downloads handed to nginx/Apache need a local copy of the file, i.e. the disk cache
+if MEDIA_OFFLOAD_MODE and (MEDIA_OFFLOAD_MODE not in OFFLOAD_MODES or media_disk_cache is None):
+    logger.warning(f"MEDIA_OFFLOAD_MODE={MEDIA_OFFLOAD_MODE} ignored: must be one of {OFFLOAD_MODES} and needs MEDIA_DISK_CACHE_DIR")
+    MEDIA_OFFLOAD_MODE = ''
+
+def get_range_header(request: Optional[Request]) -> Optional[str]:
+    """Range header of a request; only GET requests can be partial (RFC 9110)"""
+    if request is None or request.method != "GET":
+        return None
+    return request.headers.get("range")
+
+async def stream_gridfs_file(
+    file_id,
+    default_content_type: str = "application/octet-stream",
+    content_type: Optional[str] = None,
+    headers: Optional[dict] = None,
+    file_doc: Optional[dict] = None,
+    request: Optional[Request] = None,
+    cacheable: bool = False,
+    offload: bool = False,
+    derivative: Optional[DerivativeRequest] = None,
+    on_download: Optional[Callable[[bool], Awaitable[None]]] = None
+) -> Response:
+    """
+    Stream a GridFS file to the client one chunk at a time.
+    Content-Length is taken from the files document, so the body is never buffered.
+    Every response carries an ETag / Last-Modified pair derived from the files document.
+    When the request is passed, conditional requests are answered with 304 before any
+    chunk is read, and Range requests with 206 (single or multipart/byteranges),
+    reading only the chunks that cover the requested bytes.
+    With cacheable=True small files are served from (and added to) the in-process LRU.
+    When the disk cache is enabled, files are served from their local copy (FileResponse)
+    and copied there in background on the first miss.
+    With offload=True and MEDIA_OFFLOAD_MODE set, the file is materialized on disk and the
+    transfer (Range included) is handed to the web server via X-Accel-Redirect / X-Sendfile.
+    With a derivative request (?w=&h=&fit=) an image is replaced by its resized variant in the
+    negotiated format, rendered and stored on first use; the response then varies on Accept.
+    on_download is awaited only when the file body is actually sent (200 or 206; not HEAD, 304 or 416),
+    with True when the response starts the download (full body or a first range at byte 0)
+    and False when it resumes one: endpoints count downloads there.
+    """
+    if derivative is not None:
+        source_doc = file_doc or await media_store.find(file_id)
+        source_type = content_type or (source_doc.get('metadata') or {}).get('content_type', default_content_type)
+        file_doc = source_doc
+        if source_type.startswith('image/'):
+            try:
+                file_doc = await get_image_derivative(source_doc, source_type, derivative)
+                file_id, content_type, cacheable = file_doc['_id'], None, True
+                headers = {**(headers or {}), "Vary": "Accept"}
+            except Exception as e:
+                # Serve the original rather than failing the page
+                logger.warning(f"Image derivative failed for {source_doc['_id']}: {str(e)}")
+    
+    cached = media_memory_cache.get(file_id) if cacheable else None
+    if cached is not None:
+        file_doc = cached.file_doc
+    elif file_doc is None:
+        file_doc = await media_store.find(file_id)
+    media_store.access.record(file_doc['_id'])
+    metadata = file_doc.get('metadata') or {}
+    media_type = content_type or metadata.get('content_type', default_content_type)
+    length = file_doc['length']
+    etag = file_etag(file_doc)
+    last_modified = file_last_modified(file_doc)
+    
+    response_headers = dict(headers or {})
+    response_headers.update(validator_headers(etag, last_modified))
+    if request is not None:
+        response_headers["Accept-Ranges"] = "bytes"
+        if request.method in ("GET", "HEAD") and is_not_modified(request.headers, etag, last_modified):
+            return Response(status_code=304, headers=not_modified_headers(response_headers))
+    # Requested by a client: a cold file goes back to the write backend (other reads leave it cold)
+    media_store.promote(file_doc)
+    
+    range_header = get_range_header(request)
+    if range_header and not if_range_matches(request.headers, etag, last_modified):
+        range_header = None
+    
+    try:
+        ranges = parse_range_header(range_header, length)
+    except RangeNotSatisfiable:
+        response_headers["Content-Range"] = f"bytes */{length}"
+        return Response(status_code=416, headers=response_headers)
+    
+    if on_download is not None and (request is None or request.method != "HEAD"):
+        await on_download(starts_download(ranges))
+    
+    if offload and MEDIA_OFFLOAD_MODE and metadata.get('sha256') and (
+        not MEDIA_OFFLOAD_MAX_FILE_MB or length <= MEDIA_OFFLOAD_MAX_FILE_MB * 1024 * 1024
+    ):
+        try:
+            local_path = await media_disk_cache.materialize(metadata['sha256'], lambda: media_store.iter_chunks(file_doc))
+            response_headers.update(offload_headers(MEDIA_OFFLOAD_MODE, local_path, media_disk_cache.directory))
+            return Response(media_type=media_type, headers=response_headers)
+        except Exception as e:
+            # Fall back to streaming from GridFS
+            logger.warning(f"Download offload failed for {file_doc['_id']}: {str(e)}")
+    
+    if cacheable and cached is None and length <= media_memory_cache.max_entry_bytes:
+        cached = media_memory_cache.put(file_id, file_doc, await media_store.read(file_doc))
+    
+    disk_path = None
+    sha256 = metadata.get('sha256')
+    if cached is None and media_disk_cache is not None and sha256:
+        disk_path = media_disk_cache.lookup(sha256)
+        if disk_path is None:
+            media_disk_cache.schedule_fill(sha256, length, lambda: media_store.iter_chunks(file_doc))
+    
+    def read_span(start: int = 0, end: Optional[int] = None):
+        if cached is not None:
+            return iter_content(cached.content, start, end)
+        if disk_path is not None:
+            return iter_file(disk_path, start, end)
+        return media_store.iter_chunks(file_doc, start, end)
+    
+    if not ranges and disk_path is not None:
+        # Served by the ASGI server from disk (pathsend when supported), bytes skip Motor
+        return FileResponse(disk_path, media_type=media_type, headers=response_headers)
+    
+    if not ranges:
+        response_headers["Content-Length"] = str(length)
+        return StreamingResponse(
+            read_span(),
+            media_type=media_type,
+            headers=response_headers
+        )
+    
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response_headers["Content-Range"] = content_range(start, end, length)
+        response_headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            read_span(start, end),
+            status_code=206,
+            media_type=media_type,
+            headers=response_headers
+        )
+    
+    boundary = multipart_boundary()
+    
+    async def multipart_body():
+        for start, end in ranges:
+            yield multipart_part_header(boundary, media_type, start, end, length)
+            async for data in read_span(start, end):
+                yield data
+            yield b"\r\n"
+        yield multipart_closing(boundary)
+    
+    response_headers["Content-Length"] = str(multipart_length(boundary, media_type, ranges, length))
+    return StreamingResponse(
+        multipart_body(),
+        status_code=206,
+        media_type=f"multipart/byteranges; boundary={boundary}",
+        headers=response_headers
+    )
+
+def image_derivative_params(
+    request: Request,
+    w: Optional[int] = None,
+    h: Optional[int] = None,
+    fit: Optional[str] = None
+) -> Optional[DerivativeRequest]:
+    """Dependency for image endpoints: ?w= / ?h= / ?fit= (whitelisted sizes) plus the Accept header"""
+    try:
+        return parse_derivative_request(w, h, fit, request.headers.get("accept"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Renders in progress, so concurrent requests for the same derivative render it once
+_derivative_renders: Dict[str, asyncio.Task] = {}
+
+async def get_image_derivative(source_doc: dict, source_type: str, derivative: DerivativeRequest) -> dict:
+    """
+    Files document of the derivative of an image for the requested box and negotiated format.
+    Looked up by (source id, size, fit, format); rendered in the image pool and stored in GridFS on a miss.
+    """
+    media_type = negotiate_format(derivative.accept, source_type)
+    key = derivative_key(source_doc['_id'], derivative, media_type)
+    existing = await media_store.find_derivative(key)
+    if existing:
+        return existing
+    
+    task = _derivative_renders.get(key)
+    if task is None:
+        task = asyncio.create_task(render_and_store_derivative(source_doc, derivative, media_type, key))
+        _derivative_renders[key] = task
+        task.add_done_callback(lambda _: _derivative_renders.pop(key, None))
+    # Shielded: a client disconnect must not cancel a render other requests wait on
+    return await asyncio.shield(task)
+
+async def render_and_store_derivative(source_doc: dict, derivative: DerivativeRequest, media_type: str, key: str) -> dict:
+    content = await media_store.read(source_doc)
+    loop = asyncio.get_running_loop()
+    data, width, height = await loop.run_in_executor(image_executor, render_derivative, content, derivative, media_type)
+    del content
+    return await save_derivative(source_doc, media_type, key, data, width, height)
+
+async def save_derivative(source_doc: dict, media_type: str, key: str, data: bytes, width: int, height: int) -> dict:
+    """Store rendered derivative bytes, linked to their source so they are deleted with it"""
+    file_id = await media_store.upload(
+        f"{source_doc['_id']}_{width}x{height}.{media_type.split('/')[1]}",
+        data,
+        metadata={
+            "content_type": media_type,
+            "derivative_key": key,
+            "source_file_id": str(source_doc['_id']),
+            "width": width,
+            "height": height
+        },
+        dedup=False
+    )
+    logger.info(f"Stored image derivative {key} ({len(data)} bytes)")
+    return await media_store.find(file_id)
+
+async def create_thumbnail(file_id, source_type: Optional[str] = None, thumbnail_bytes: Optional[bytes] = None) -> Optional[str]:
+    """
+    Store the thumbnail of an image as a derivative of it (deleted together with the source).
+    Pass thumbnail_bytes when already rendered (PNG, e.g. by the pipeline), otherwise it is
+    rendered in the image pool. Returns the thumbnail file id, None if it could not be created.
+    """
+    try:
+        source_doc = await media_store.find(file_id)
+        source_type = source_type or (source_doc.get('metadata') or {}).get('content_type') or 'image/png'
+        if thumbnail_bytes:
+            width, height = PILImage.open(io.BytesIO(thumbnail_bytes)).size
+            key = derivative_key(source_doc['_id'], THUMBNAIL_REQUEST, 'image/png')
+            thumb_doc = await save_derivative(source_doc, 'image/png', key, thumbnail_bytes, width, height)
+        else:
+            thumb_doc = await get_image_derivative(source_doc, source_type, THUMBNAIL_REQUEST)
+        return str(thumb_doc['_id'])
+    except Exception as e:
+        logger.warning(f"Could not create thumbnail for {file_id}: {str(e)}")
+        return None
+
+def invalid_image_error(e: InvalidImage) -> HTTPException:
+    return HTTPException(status_code=413 if isinstance(e, ImageTooLarge) else 400, detail=str(e))
+
+async def upload_image(filename: str, content: bytes, metadata: dict) -> Tuple[ObjectId, dict]:
+    """
+    Normalize an uploaded image off the event loop (pixel limit, EXIF orientation, sRGB 8-bit,
+    metadata stripped) and store it with its properties (size, mode, DPI, original and stored
+    byte size, hash, dominant colour) in the GridFS metadata. Returns the file id and the same
+    properties for the owning document (`<field>Meta`), so later readers need not decode the
+    image again. 400 if the content is not an accepted image, 413 past the pixel limit.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+        content, content_type, info = await loop.run_in_executor(image_executor, normalize_image, content)
+    except InvalidImage as e:
+        raise invalid_image_error(e)
+    file_id = await media_store.upload(filename, content, metadata={**metadata, **info, "content_type": content_type})
+    return file_id, image_meta_fields(info)
+
+async def store_upload(file: UploadFile, filename: str, kind: str, metadata: dict) -> StoredUpload:
+    """
+    Store an upload within the size limit of its kind ("pdf" or "image"), 413 past it.
+    PDFs are streamed into GridFS without being held in memory; images are read and
+    normalized (upload_image) first.
+    """
+    if kind == "image":
+        file_id, info = await upload_image(filename, await read_image_upload(file), metadata)
+        return StoredUpload(file_id, info["sha256"], info["byteSize"])
+    try:
+        return await media_store.upload_stream(filename, file, upload_limit(kind), metadata=metadata)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+async def read_image_upload(file: UploadFile) -> bytes:
+    """
+    Read an uploaded image that must be decoded, within the image size limit (413 past it).
+    The header is checked right away (format, pixel limit), so handlers fail before touching
+    the image being replaced.
+    """
+    try:
+        content = await read_upload(file, upload_limit("image"))
+        check_image(content)
+        return content
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImage as e:
+        raise invalid_image_error(e)
+
+async def create_placeholder(content: bytes) -> dict:
+    """
+    Placeholder fields of an image for its owner document: a tiny inline WebP (placeholder)
+    and the dominant colour, so lists can paint something before the image arrives.
+    Returns {} if the image cannot be decoded.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+        placeholder, dominant_color = await loop.run_in_executor(image_executor, render_placeholder, content)
+        return {"placeholder": placeholder, "dominantColor": dominant_color}
+    except Exception as e:
+        logger.warning(f"Could not create image placeholder: {str(e)}")
+        return {}
+
+async def thumbnail_fields(file_id) -> dict:
+    thumbnail_id = await create_thumbnail(file_id)
+    return {"thumbnailFileId": thumbnail_id} if thumbnail_id else {}
+
+async def placeholder_fields(file_id) -> dict:
+    try:
+        content = await media_store.read(await media_store.find(file_id))
+    except Exception as e:
+        logger.warning(f"Could not read {file_id} for its placeholder: {str(e)}")
+        return {}
+    return await create_placeholder(content)
+
+# Catalog images with a stored thumbnail: (collection, source file id fields in order of preference)
+THUMBNAIL_SOURCES = [
+    ("illustrations", ["imageFileId"]),
+    ("posters", ["imageFileId"]),
+    ("books", ["coverImageFileId"]),
+    ("book_scenes", ["coloredImageFileId", "lineArtImageFileId"])
+]
+# Placeholders also cover game cards (card image, else thumbnail)
+PLACEHOLDER_SOURCES = THUMBNAIL_SOURCES + [("games", ["cardImageFileId", "thumbnailFileId"])]
+
+# Backfill jobs: type -> (sources, field marking docs already done, builder of the fields to set)
+MEDIA_BACKFILLS = {
+    "thumbnail_backfill": (THUMBNAIL_SOURCES, "thumbnailFileId", thumbnail_fields),
+    "placeholder_backfill": (PLACEHOLDER_SOURCES, "placeholder", placeholder_fields)
+}
+
+async def run_media_backfill(job_id: str, job_type: str):
+    """Fill in derived media fields missing on the existing catalog, recording progress in media_jobs"""
+    sources, done_field, build_fields = MEDIA_BACKFILLS[job_type]
+    processed = failed = 0
+    try:
+        for collection_name, source_fields in sources:
+            collection = db[collection_name]
+            query = {
+                "$and": [
+                    {"$or": [{done_field: None}, {done_field: {"$exists": False}}]},
+                    {"$or": [{field: {"$nin": [None, ""]}} for field in source_fields]}
+                ]
+            }
+            async for doc in collection.find(query, {"_id": 1, **{field: 1 for field in source_fields}}):
+                source_id = next(doc[field] for field in source_fields if doc.get(field))
+                fields = await build_fields(source_id)
+                if fields:
+                    await collection.update_one({"_id": doc['_id']}, {"$set": {**fields, "updatedAt": datetime.now(timezone.utc)}})
+                    processed += 1
+                else:
+                    failed += 1
+                await db.media_jobs.update_one({"id": job_id}, {"$set": {"processed": processed, "failed": failed}})
+        status = "completed"
+    except Exception as e:
+        logger.error(f"Media backfill {job_type} failed: {str(e)}")
+        status = "failed"
+    await db.media_jobs.update_one(
+        {"id": job_id},
+        {"$set": {"status": status, "processed": processed, "failed": failed, "finishedAt": datetime.now(timezone.utc)}}
+    )
+    logger.info(f"Media backfill {job_type} {status}: {processed} updated, {failed} failed")
+
+# Work that outlives a request (media jobs, upload finalizes) records the worker doing it and a heartbeat it refreshes;
+# other workers take it over only once the heartbeat is stale, i.e. its worker stopped
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+WORKER_HEARTBEAT_SECONDS = int(os.environ.get('WORKER_HEARTBEAT_SECONDS', '30'))
+WORKER_STALE_SECONDS = WORKER_HEARTBEAT_SECONDS * 4
+
+def worker_fields() -> dict:
+    """Owner fields set when this worker takes a job or session"""
+    return {"worker": WORKER_ID, "heartbeatAt": datetime.now(timezone.utc)}
+
+def stale_worker_query() -> dict:
+    """Jobs or sessions whose worker stopped refreshing them (or recorded before owners were)"""
+    stale = datetime.now(timezone.utc) - timedelta(seconds=WORKER_STALE_SECONDS)
+    return {"$or": [{"heartbeatAt": {"$lt": stale}}, {"heartbeatAt": {"$exists": False}}]}
+
+async def reclaim_stale_work():
+    """
+    Mark the jobs of a worker that stopped as interrupted (they can be started again) and reopen the
+    upload sessions it left finalizing (the finalize can be run again)
+    """
+    result = await db.media_jobs.update_many(
+        {"status": "running", **stale_worker_query()},
+        {"$set": {"status": "interrupted", "finishedAt": datetime.now(timezone.utc)}}
+    )
+    if result.modified_count:
+        logger.info(f"Marked {result.modified_count} media jobs of a stopped worker as interrupted")
+    result = await db.upload_sessions.update_many(
+        {"status": "finalizing", **stale_worker_query()},
+        {"$set": {"status": "open"}, "$unset": {"worker": "", "heartbeatAt": ""}}
+    )
+    if result.modified_count:
+        logger.info(f"Reopened {result.modified_count} upload sessions left finalizing by a stopped worker")
+
+async def worker_heartbeat_loop():
+    """Refresh the heartbeat of the work owned by this worker and reclaim the work of stopped ones"""
+    while True:
+        await asyncio.sleep(WORKER_HEARTBEAT_SECONDS)
+        try:
+            now = datetime.now(timezone.utc)
+            await db.media_jobs.update_many({"status": "running", "worker": WORKER_ID}, {"$set": {"heartbeatAt": now}})
+            await db.upload_sessions.update_many({"status": "finalizing", "worker": WORKER_ID}, {"$set": {"heartbeatAt": now}})
+            await reclaim_stale_work()
+        except Exception as e:
+            logger.warning(f"Worker heartbeat failed: {str(e)}")
+
+async def start_media_job(job_type: str, email: str, runner=run_media_backfill, exclusive: bool = True, **fields) -> dict:
+    """
+    Start a media job (runner(job_id, job_type)), or return the one of the same type already running
+    when exclusive. Extra fields are stored on the job document for the runner.
+    """
+    if exclusive:
+        running = await db.media_jobs.find_one({"type": job_type, "status": "running"}, {"_id": 0})
+        if running:
+            return running
+    
+    job = {
+        "id": str(uuid.uuid4()),
+        "type": job_type,
+        "status": "running",
+        "processed": 0,
+        "failed": 0,
+        "startedBy": email,
+        "startedAt": datetime.now(timezone.utc),
+        "finishedAt": None,
+        **worker_fields(),
+        **fields
+    }
+    await db.media_jobs.insert_one(job)
+    task = asyncio.create_task(runner(job['id'], job_type))
+    app.state.job_tasks.add(task)
+    task.add_done_callback(app.state.job_tasks.discard)
+    job.pop('_id', None)
+    return job
+
+async def run_media_release(job_id: str, job_type: str):
+    """Delete the files of a removed document graph in bulk (see release_media_files)"""
+    job = await db.media_jobs.find_one({"id": job_id}, {"fileIds": 1, "entity": 1})
+    try:
+        removed = await media_store.delete_many(job['fileIds'])
+        for file_id in removed:
+            media_memory_cache.invalidate(file_id)
+        update = {"status": "completed", "processed": len(removed)}
+    except Exception as e:
+        # Whatever was left behind is collected by the orphan sweep
+        logger.error(f"Media release for {job.get('entity')} failed: {str(e)}")
+        update = {"status": "failed"}
+    await db.media_jobs.update_one({"id": job_id}, {"$set": {**update, "finishedAt": datetime.now(timezone.utc)}})
+
+async def release_media_files(file_ids: list, entity: str, email: str) -> Optional[str]:
+    """
+    Release the files of a deleted entity (and everything below it) in a background job, so the
+    delete request returns at once. Returns the job id, None when there was nothing to release.
+    """
+    file_ids = [str(file_id) for file_id in file_ids if file_id]
+    if not file_ids:
+        return None
+    job = await start_media_job("media_release", email, run_media_release, exclusive=False, entity=entity, fileIds=file_ids)
+    return job['id']
+
+# Documents holding uploaded files: (collection, file id fields). A shared blob has one reference per field.
+FILE_REFERENCE_FIELDS = [
+    ("illustrations", ["imageFileId", "pdfFileId"]),
+    ("themes", ["backgroundImageFileId"]),
+    ("bundles", ["backgroundImageFileId", "pdfFileId", "generatedPdfFileId"]),
+    ("site_settings", ["heroImageFileId", "brandLogoFileId"]),
+    ("books", ["coverImageFileId"]),
+    ("book_scenes", ["coloredImageFileId", "lineArtImageFileId"]),
+    ("generation_styles", ["referenceImageFileId"]),
+    ("games", ["thumbnailFileId", "cardImageFileId", "pageImageFileId"]),
+    ("game_level_backgrounds", ["backgroundImageFileId"]),
+    ("posters", ["imageFileId", "pdfFileId"]),
+    ("character_images", ["imageFileId"])
+]
+# Fields pointing at derivatives (stored thumbnails) rather than uploaded files
+DERIVATIVE_REFERENCE_FIELDS = [(collection, ["thumbnailFileId"]) for collection, _ in THUMBNAIL_SOURCES]
+
+async def run_media_dedup(job_id: str, job_type: str):
+    """
+    Merge files uploaded more than once before deduplication: references move to one copy
+    (the registered blob, else the oldest), which becomes a blob counting them, and the
+    other copies are deleted. Progress and reclaimed bytes are recorded in media_jobs.
+    """
+    processed = failed = reclaimed = 0
+    try:
+        async for group in media_store.duplicate_groups():
+            try:
+                blob = await media_store.blobs.find_one({"_id": group['_id']})
+                canonical = blob['fileId'] if blob and blob['fileId'] in group['files'] else group['files'][0]
+                duplicates = [file_id for file_id in group['files'] if file_id != canonical]
+                
+                # Old id -> id now serving the same content, for files and their derivatives
+                id_map = {str(dup): str(canonical) for dup in duplicates}
+                for dup in duplicates:
+                    id_map.update(await media_store.move_derivatives(dup, canonical))
+                for collection_name, fields in FILE_REFERENCE_FIELDS + DERIVATIVE_REFERENCE_FIELDS:
+                    for field in fields:
+                        for old_id, new_id in id_map.items():
+                            await db[collection_name].update_many({field: old_id}, {"$set": {field: new_id}})
+                
+                refs = 0
+                for collection_name, fields in FILE_REFERENCE_FIELDS:
+                    for field in fields:
+                        refs += await db[collection_name].count_documents({field: str(canonical)})
+                # Unreferenced files keep one reference until they are cleaned up
+                await media_store.register_blob(group['_id'], canonical, group['length'], max(refs, 1))
+                
+                for dup in duplicates:
+                    media_memory_cache.invalidate(dup)
+                    await media_store.delete(dup)
+                for old_id in id_map:
+                    media_memory_cache.invalidate(old_id)
+                reclaimed += group['length'] * len(duplicates)
+                processed += 1
+            except Exception as e:
+                logger.warning(f"Could not merge duplicates of {group['_id']}: {str(e)}")
+                failed += 1
+            await db.media_jobs.update_one(
+                {"id": job_id},
+                {"$set": {"processed": processed, "failed": failed, "reclaimedBytes": reclaimed}}
+            )
+        status = "completed"
+    except Exception as e:
+        logger.error(f"Media dedup failed: {str(e)}")
+        status = "failed"
+    await db.media_jobs.update_one(
+        {"id": job_id},
+        {"$set": {
+            "status": status,
+            "processed": processed,
+            "failed": failed,
+            "reclaimedBytes": reclaimed,
+            "finishedAt": datetime.now(timezone.utc)
+        }}
+    )
+    logger.info(f"Media dedup {status}: {processed} files merged, {reclaimed} bytes reclaimed, {failed} failed")
+
+# Orphan sweep: stored files no document points at are deleted once older than the grace period
+# (uploads are attached to their document right after being stored). 0 disables the periodic sweep.
+MEDIA_GC_GRACE_HOURS = int(os.environ.get('MEDIA_GC_GRACE_HOURS', '24'))
+MEDIA_GC_INTERVAL_HOURS = int(os.environ.get('MEDIA_GC_INTERVAL_HOURS', '24'))
+MEDIA_GC_DELETES_PER_SECOND = float(os.environ.get('MEDIA_GC_DELETES_PER_SECOND', '10'))
+# Orphans listed in the job document, for review before a real sweep
+MEDIA_GC_SAMPLE_SIZE = 50
+MEDIA_GC_BATCH = 500
+
+async def referenced_file_ids() -> set:
+    """Ids (str) of every stored file something points at: uploads, thumbnails, sprites, open upload sessions"""
+    ids = set()
+    for collection_name, fields in FILE_REFERENCE_FIELDS + DERIVATIVE_REFERENCE_FIELDS:
+        query = {"$or": [{field: {"$nin": [None, ""]}} for field in fields]}
+        async for doc in db[collection_name].find(query, {field: 1 for field in fields}):
+            ids.update(str(doc[field]) for field in fields if doc.get(field))
+    async for sprite in db.media_sprites.find({}, {"fileId": 1}):
+        ids.add(str(sprite['fileId']))
+    async for session in db.upload_sessions.find({"status": {"$ne": "completed"}}, {"fileId": 1, "storedFile": 1}):
+        ids.add(str(session['fileId']))
+        if session.get('storedFile'):
+            ids.add(str(session['storedFile']['fileId']))
+    return ids
+
+async def file_is_referenced(file_id: ObjectId) -> bool:
+    """Whether something points at this file right now (referenced_file_ids for a single file)"""
+    values = [file_id, str(file_id)]
+    for collection_name, fields in FILE_REFERENCE_FIELDS + DERIVATIVE_REFERENCE_FIELDS:
+        if await db[collection_name].find_one({"$or": [{field: {"$in": values}} for field in fields]}, {"_id": 1}):
+            return True
+    if await db.media_sprites.find_one({"fileId": {"$in": values}}, {"_id": 1}):
+        return True
+    return bool(await db.upload_sessions.find_one(
+        {"status": {"$ne": "completed"}, "$or": [{"fileId": {"$in": values}}, {"storedFile.fileId": {"$in": values}}]},
+        {"_id": 1}
+    ))
+
+async def run_media_gc(job_id: str, job_type: str):
+    """
+    Find stored files nothing points at (uploads never attached, deletes that failed, derivatives
+    of removed sources, chunks of aborted uploads) and delete them, at most MEDIA_GC_DELETES_PER_SECOND.
+    The media_gc_dry_run job only reports them. Progress and totals are recorded in media_jobs.
+    """
+    dry_run = job_type == "media_gc_dry_run"
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=MEDIA_GC_GRACE_HOURS)
+    delete_interval = 1 / MEDIA_GC_DELETES_PER_SECOND if MEDIA_GC_DELETES_PER_SECOND > 0 else 0
+    stats = {"processed": 0, "failed": 0, "orphanFiles": 0, "orphanBytes": 0, "orphanChunkFiles": 0, "deleted": 0}
+    sample = []
+    
+    async def save_progress(**fields):
+        await db.media_jobs.update_one({"id": job_id}, {"$set": {**stats, "sample": sample, **fields}})
+    
+    async def remove(file_id, remover):
+        if dry_run:
+            return
+        try:
+            if await remover(file_id) is not False:
+                stats["deleted"] += 1
+        except Exception as e:
+            logger.warning(f"Could not delete orphan {file_id}: {str(e)}")
+            stats["failed"] += 1
+        await asyncio.sleep(delete_interval)
+    
+    async def remove_file(file_id):
+        # The reference snapshot can be hours old by now: fence the blob so no upload claims the file
+        # from here on, then check again that nothing points at it. False: the file is kept.
+        blob = await media_store.fence_blob(file_id, datetime.now(timezone.utc) - timedelta(hours=MEDIA_GC_GRACE_HOURS))
+        if blob is None:
+            return False
+        if await file_is_referenced(file_id):
+            if blob:
+                await media_store.unfence_blob(blob)
+            return False
+        # No document holds it, so the reference count left on the blob was stale
+        if blob:
+            await media_store.blobs.delete_one({"_id": blob['_id'], "fencedAt": {"$exists": True}})
+        return await delete_media_file(file_id)
+    
+    async def remove_derivative(file_id):
+        if await file_is_referenced(file_id):
+            return False
+        return await media_store.delete(file_id)
+    
+    async def found(file_doc, kind):
+        stats["orphanFiles"] += 1
+        stats["orphanBytes"] += file_doc.get('length', 0)
+        if len(sample) < MEDIA_GC_SAMPLE_SIZE:
+            sample.append({
+                "fileId": str(file_doc['_id']),
+                "kind": kind,
+                "filename": file_doc.get('filename'),
+                "length": file_doc.get('length', 0),
+                "uploadDate": file_doc.get('uploadDate')
+            })
+    
+    try:
+        referenced = await referenced_file_ids()
+        projection = {"length": 1, "filename": 1, "uploadDate": 1, "metadata.source_file_id": 1}
+        
+        # Uploaded files and sprites
+        cursor = media_store.files.find(
+            {"uploadDate": {"$lt": cutoff}, "metadata.source_file_id": {"$exists": False}},
+            projection, batch_size=MEDIA_GC_BATCH
+        )
+        async for file_doc in cursor:
+            stats["processed"] += 1
+            if str(file_doc['_id']) not in referenced:
+                await found(file_doc, "file")
+                await remove(file_doc['_id'], remove_file)
+            if stats["processed"] % MEDIA_GC_BATCH == 0:
+                await save_progress()
+        
+        # Derivatives whose source file is gone
+        async def sweep_derivatives(batch):
+            source_ids = [oid for oid in (to_object_id(d['metadata']['source_file_id']) for d in batch) if oid]
+            alive = {str(doc['_id']) async for doc in media_store.files.find({"_id": {"$in": source_ids}}, {"_id": 1})}
+            for file_doc in batch:
+                if file_doc['metadata']['source_file_id'] not in alive and str(file_doc['_id']) not in referenced:
+                    await found(file_doc, "derivative")
+                    await remove(file_doc['_id'], remove_derivative)
+        
+        batch = []
+        cursor = media_store.files.find(
+            {"uploadDate": {"$lt": cutoff}, "metadata.source_file_id": {"$exists": True}},
+            projection, batch_size=MEDIA_GC_BATCH
+        )
+        async for file_doc in cursor:
+            stats["processed"] += 1
+            batch.append(file_doc)
+            if len(batch) == MEDIA_GC_BATCH:
+                await sweep_derivatives(batch)
+                batch = []
+                await save_progress()
+        if batch:
+            await sweep_derivatives(batch)
+        
+        # Chunks left without a files document (aborted or crashed uploads)
+        async def sweep_chunks(files_ids, bucket):
+            existing = {doc['_id'] async for doc in media_store.files.find({"_id": {"$in": files_ids}}, {"_id": 1})}
+            for files_id in files_ids:
+                if files_id in existing or str(files_id) in referenced:
+                    continue
+                if not isinstance(files_id, ObjectId) or files_id.generation_time >= cutoff:
+                    continue
+                stats["orphanChunkFiles"] += 1
+                await remove(files_id, lambda oid: media_store.delete_chunks(oid, bucket))
+        
+        for bucket in MEDIA_BUCKETS:
+            files_ids = []
+            async for group in media_store.chunks_of(bucket).aggregate([{"$group": {"_id": "$files_id"}}]):
+                files_ids.append(group['_id'])
+                if len(files_ids) == MEDIA_GC_BATCH:
+                    await sweep_chunks(files_ids, bucket)
+                    files_ids = []
+            if files_ids:
+                await sweep_chunks(files_ids, bucket)
+        status = "completed"
+    except Exception as e:
+        logger.error(f"Media GC failed: {str(e)}")
+        status = "failed"
+    await save_progress(status=status, dryRun=dry_run, finishedAt=datetime.now(timezone.utc))
+    logger.info(
+        f"Media GC {status}{' (dry run)' if dry_run else ''}: {stats['orphanFiles']} orphan files "
+        f"({stats['orphanBytes']} bytes), {stats['orphanChunkFiles']} orphan chunk sets, {stats['deleted']} deleted"
+    )
+
+# Lossless recompression of stored PNGs: files per second and minimum saving worth swapping a file
+MEDIA_RECOMPRESS_FILES_PER_SECOND = float(os.environ.get('MEDIA_RECOMPRESS_FILES_PER_SECOND', '1'))
+MEDIA_RECOMPRESS_MIN_SAVING_PERCENT = float(os.environ.get('MEDIA_RECOMPRESS_MIN_SAVING_PERCENT', '10'))
+# Uploaded PNGs not checked yet (derivatives and sprites are rebuilt rather than recompressed)
+MEDIA_RECOMPRESS_QUERY = {
+    "metadata.content_type": "image/png",
+    "metadata.recompressed": {"$exists": False},
+    "metadata.source_file_id": {"$exists": False},
+    "metadata.type": {"$ne": "sprite"}
+}
+
+def meta_field(field: str) -> str:
+    """Owner document field holding the image properties of a file field (imageFileId -> imageMeta)"""
+    return field[:-len("FileId")] + "Meta"
+
+async def file_references() -> Dict[str, List[Tuple[str, str]]]:
+    """Map file id (str) -> (collection, field) of every document field pointing at it"""
+    references = defaultdict(list)
+    for collection_name, fields in FILE_REFERENCE_FIELDS:
+        query = {"$or": [{field: {"$nin": [None, ""]}} for field in fields]}
+        async for doc in db[collection_name].find(query, {field: 1 for field in fields}):
+            for field in fields:
+                if doc.get(field):
+                    references[str(doc[field])].append((collection_name, field))
+    return references
+
+async def recompress_media_file(file_doc: dict, entity: str) -> Optional[int]:
+    """
+    Replace a stored PNG with its lossless recompression when it saves enough. The old blob is fenced
+    first, as the orphan sweep does, so no upload claims the file while it is replaced; the new file is
+    then recorded on the old one (metadata.recompressed_to) before anything moves, so a run interrupted
+    midway finishes the swap when started again (see swap_recompressed_file).
+    Returns the bytes saved, None when the file was kept (and marked as checked, unless to be retried).
+    """
+    old_id = file_doc['_id']
+    pending = file_doc['metadata'].get('recompressed_to')
+    if pending:
+        new_doc = await media_store.files.find_one({"_id": ObjectId(pending['fileId'])})
+        if new_doc:
+            return await swap_recompressed_file(file_doc, new_doc, pending['imageMeta'])
+        await media_store.files.update_one({"_id": old_id}, {"$unset": {"metadata.recompressed_to": ""}})
+    
+    content = await media_store.read(file_doc)
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(recompress_executor, recompress_png, content)
+    if not result or len(result[0]) > len(content) * (1 - MEDIA_RECOMPRESS_MIN_SAVING_PERCENT / 100):
+        await media_store.files.update_one({"_id": old_id}, {"$set": {"metadata.recompressed": False}})
+        return None
+    output, info = result
+    existing = await media_store.find_by_hash(info['sha256'])
+    if existing and (existing['metadata'].get('recompressed_from') or {}).get('fileId') != str(old_id):
+        # Same pixels already stored under this encoding: left to the duplicate merge
+        await media_store.files.update_one({"_id": old_id}, {"$set": {"metadata.recompressed": False}})
+        return None
+    
+    # From here on uploads of the old content store a file of their own instead of claiming this one.
+    # One that claimed it recently may not have linked it yet: the file is tried again on the next run.
+    if await media_store.fence_blob(old_id, datetime.now(timezone.utc) - timedelta(hours=MEDIA_GC_GRACE_HOURS)) is None:
+        logger.info(f"Recompression of {old_id} postponed: claimed by a recent upload")
+        return None
+    if existing:
+        # Stored by a run interrupted before recording it
+        new_id = existing['_id']
+    else:
+        metadata = {
+            **file_doc['metadata'],
+            **info,
+            "recompressed": True,
+            "recompressed_from": {
+                "sha256": file_doc['metadata'].get('sha256'),
+                "length": len(content),
+                "entity": entity,
+                "fileId": str(old_id)
+            }
+        }
+        new_id = await media_store.upload(file_doc['filename'], output, metadata=metadata, dedup=False)
+    pending = {"fileId": str(new_id), "imageMeta": image_meta_fields(info)}
+    await media_store.files.update_one({"_id": old_id}, {"$set": {"metadata.recompressed_to": pending}})
+    return await swap_recompressed_file(file_doc, await media_store.find(new_id), pending['imageMeta'])
+
+async def swap_recompressed_file(old_doc: dict, new_doc: dict, image_meta: dict) -> Optional[int]:
+    """
+    Move a PNG fenced by recompress_media_file over to its recompressed file: derivatives, then every
+    reference (each owner document switched with a single update, together with its `<field>Meta`),
+    then the blob, whose reference count is taken from the references. Every step can run again.
+    The old file is deleted only once nothing points at it, otherwise it is left for the next run;
+    the old hash keeps resolving to the new file. Returns the bytes saved, None when not finished.
+    """
+    old_id, new_id = old_doc['_id'], new_doc['_id']
+    id_map = await media_store.move_derivatives(old_id, new_id)
+    for collection_name, fields in DERIVATIVE_REFERENCE_FIELDS:
+        for field in fields:
+            for old_derivative, new_derivative in id_map.items():
+                await db[collection_name].update_many({field: old_derivative}, {"$set": {field: new_derivative}})
+    now = datetime.now(timezone.utc)
+    refs = 0
+    for collection_name, fields in FILE_REFERENCE_FIELDS:
+        for field in fields:
+            await db[collection_name].update_many(
+                {field: str(old_id), meta_field(field): {"$exists": True}},
+                {"$set": {field: str(new_id), meta_field(field): image_meta, "updatedAt": now}}
+            )
+            await db[collection_name].update_many({field: str(old_id)}, {"$set": {field: str(new_id), "updatedAt": now}})
+            refs += await db[collection_name].count_documents({field: str(new_id)})
+    for file_id in [str(old_id), *id_map]:
+        media_memory_cache.invalidate(file_id)
+    
+    if await file_is_referenced(old_id):
+        logger.warning(f"Recompressed file {old_id} still referenced, swap left for the next run")
+        return None
+    old_blob = await media_store.blobs.find_one({"fileId": old_id})
+    if old_blob:
+        # Unreferenced files keep one reference until they are cleaned up
+        await media_store.register_blob(new_doc['metadata']['sha256'], new_id, new_doc['length'], max(refs, 1))
+        await media_store.blobs.delete_one({"_id": old_blob['_id'], "fileId": old_id})
+    await media_store.delete(old_id)
+    return old_doc['length'] - new_doc['length']
+
+async def run_media_recompress(job_id: str, job_type: str):
+    """
+    Recompress the stored PNGs losslessly (see recompress_media_file), at most
+    MEDIA_RECOMPRESS_FILES_PER_SECOND, one image at a time off the derivative workers. Files already
+    checked are skipped, so an interrupted job can simply be started again. Progress and the savings
+    by entity (owning collection) are recorded in media_jobs.
+    """
+    interval = 1 / MEDIA_RECOMPRESS_FILES_PER_SECOND if MEDIA_RECOMPRESS_FILES_PER_SECOND > 0 else 0
+    stats = {"processed": 0, "failed": 0, "recompressed": 0, "savedBytes": 0}
+    savings = {}
+    
+    async def save_progress(**fields):
+        await db.media_jobs.update_one({"id": job_id}, {"$set": {**stats, "savings": savings, **fields}})
+    
+    try:
+        references = await file_references()
+        cursor = media_store.files.find(
+            MEDIA_RECOMPRESS_QUERY,
+            {"length": 1, "chunkSize": 1, "backend": 1, "bucket": 1, "filename": 1, "metadata": 1},
+            no_cursor_timeout=True
+        )
+        async for file_doc in cursor:
+            stats["processed"] += 1
+            owners = references.get(str(file_doc['_id']))
+            entity = owners[0][0] if owners else "unreferenced"
+            try:
+                saved = await recompress_media_file(file_doc, entity)
+            except Exception as e:
+                logger.warning(f"Could not recompress {file_doc['_id']}: {str(e)}")
+                stats["failed"] += 1
+                saved = None
+            if saved is not None:
+                totals = savings.setdefault(entity, {"files": 0, "bytesBefore": 0, "savedBytes": 0})
+                totals["files"] += 1
+                totals["bytesBefore"] += file_doc.get('length', 0)
+                totals["savedBytes"] += saved
+                stats["recompressed"] += 1
+                stats["savedBytes"] += saved
+            await save_progress()
+            await asyncio.sleep(interval)
+        status = "completed"
+    except Exception as e:
+        logger.error(f"Media recompression failed: {str(e)}")
+        status = "failed"
+    await save_progress(status=status, finishedAt=datetime.now(timezone.utc))
+    logger.info(
+        f"Media recompression {status}: {stats['recompressed']} of {stats['processed']} files recompressed, "
+        f"{stats['savedBytes']} bytes saved, {stats['failed']} failed"
+    )
+
+# Cold tier: files not requested for this many days move to compressed storage (0 = never),
+# checked every MEDIA_TIER_INTERVAL_HOURS, at most MEDIA_TIER_FILES_PER_SECOND
+MEDIA_COLD_AFTER_DAYS = int(os.environ.get('MEDIA_COLD_AFTER_DAYS', '0'))
+MEDIA_TIER_INTERVAL_HOURS = int(os.environ.get('MEDIA_TIER_INTERVAL_HOURS', '24'))
+MEDIA_TIER_FILES_PER_SECOND = float(os.environ.get('MEDIA_TIER_FILES_PER_SECOND', '5'))
+
+def cold_candidates_query(cold_after_days: int) -> dict:
+    """Files not in the cold tier whose last request (or upload, if never requested) is older than the limit"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=cold_after_days)
+    return {
+        "backend": {"$ne": COLD_BACKEND},
+        "$or": [
+            {"accessedAt": {"$lt": cutoff}},
+            {"accessedAt": None, "uploadDate": {"$lt": cutoff}}
+        ]
+    }
+
+async def run_media_tiering(job_id: str, job_type: str):
+    """
+    Move the files nobody requested for coldAfterDays (job field) to the cold tier, at most
+    MEDIA_TIER_FILES_PER_SECOND. The hot copy is removed MEDIA_TIER_GRACE_SECONDS after the switch,
+    for readers already streaming it. Progress and moved bytes are recorded in media_jobs.
+    """
+    job = await db.media_jobs.find_one({"id": job_id}, {"coldAfterDays": 1})
+    interval = 1 / MEDIA_TIER_FILES_PER_SECOND if MEDIA_TIER_FILES_PER_SECOND > 0 else 0
+    stats = {"processed": 0, "failed": 0, "movedFiles": 0, "movedBytes": 0, "coldBytes": 0}
+    # (time of the switch, (backend, bucket), file id) of hot copies waiting for the grace period
+    pending = deque()
+    
+    async def release(until: float):
+        while pending and pending[0][0] <= until:
+            _, (backend, bucket), file_id = pending.popleft()
+            try:
+                await media_store.delete_content(backend, bucket, [file_id])
+            except Exception as e:
+                logger.warning(f"Could not remove hot copy of {file_id} from {backend}/{bucket}: {str(e)}")
+    
+    try:
+        # Requests not flushed yet count as well
+        await media_store.access.flush(media_store.files)
+        cursor = media_store.files.find(
+            cold_candidates_query(job['coldAfterDays']),
+            {"length": 1, "chunkSize": 1, "backend": 1, "bucket": 1, "coldLength": 1},
+            no_cursor_timeout=True
+        )
+        async for file_doc in cursor:
+            stats["processed"] += 1
+            if media_store.promoting(file_doc['_id']):
+                continue
+            try:
+                moved_from = await media_store.migrate(file_doc, COLD_BACKEND)
+            except Exception as e:
+                logger.warning(f"Could not move {file_doc['_id']} to the cold tier: {str(e)}")
+                stats["failed"] += 1
+                moved_from = None
+            if moved_from:
+                stats["movedFiles"] += 1
+                stats["movedBytes"] += file_doc.get('length', 0)
+                cold_doc = await media_store.files.find_one({"_id": file_doc['_id']}, {"coldLength": 1})
+                stats["coldBytes"] += (cold_doc or {}).get('coldLength', 0)
+                pending.append((time.monotonic(), moved_from, file_doc['_id']))
+            await release(time.monotonic() - MEDIA_TIER_GRACE_SECONDS)
+            if stats["processed"] % 100 == 0:
+                await db.media_jobs.update_one({"id": job_id}, {"$set": stats})
+            await asyncio.sleep(interval)
+        if pending:
+            await asyncio.sleep(max(pending[-1][0] + MEDIA_TIER_GRACE_SECONDS - time.monotonic(), 0))
+            await release(time.monotonic())
+        status = "completed"
+    except Exception as e:
+        logger.error(f"Media tiering failed: {str(e)}")
+        status = "failed"
+    await db.media_jobs.update_one({"id": job_id}, {"$set": {**stats, "status": status, "finishedAt": datetime.now(timezone.utc)}})
+    logger.info(
+        f"Media tiering {status}: {stats['movedFiles']} files moved to the cold tier "
+        f"({stats['movedBytes']} bytes, {stats['coldBytes']} compressed), {stats['failed']} failed"
+    )
+
+async def media_tiering_loop():
+    """Move unrequested files to the cold tier every MEDIA_TIER_INTERVAL_HOURS"""
+    while True:
+        await asyncio.sleep(MEDIA_TIER_INTERVAL_HOURS * 3600)
+        try:
+            await start_media_job("media_tiering", "scheduler", run_media_tiering, coldAfterDays=MEDIA_COLD_AFTER_DAYS)
+        except Exception as e:
+            logger.warning(f"Could not start media tiering: {str(e)}")
+
+async def media_access_flush_loop():
+    """Write the request counts of served files every MEDIA_ACCESS_FLUSH_SECONDS, or as soon as too many are pending"""
+    while True:
+        try:
+            await asyncio.wait_for(media_store.access.full.wait(), MEDIA_ACCESS_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await media_store.access.flush(media_store.files)
+        except Exception as e:
+            logger.warning(f"Could not flush media access counts: {str(e)}")
+            # Counts were kept: try again after a full interval rather than on the next request
+            await asyncio.sleep(MEDIA_ACCESS_FLUSH_SECONDS)
+
+async def media_gc_loop():
+    """Run the orphan sweep every MEDIA_GC_INTERVAL_HOURS"""
+    while True:
+        await asyncio.sleep(MEDIA_GC_INTERVAL_HOURS * 3600)
+        try:
+            await start_media_job("media_gc", "scheduler", run_media_gc)
+        except Exception as e:
+            logger.warning(f"Could not start media GC: {str(e)}")
+
+# Search sprites are keyed by query, so only the most recently built ones are kept
+SPRITE_SEARCH_KEEP = 200
+
+# Sprite builds in progress, by sprite key
+_sprite_builds: Dict[str, asyncio.Task] = {}
+
+def sprite_key(members: List[dict]) -> str:
+    """Hash of the member ids and the file each tile is drawn from, plus the grid layout"""
+    parts = [f"{SPRITE_TILE_SIZE}:{SPRITE_COLUMNS}"]
+    parts += [f"{m['id']}={m.get('thumbnailFileId') or m['imageFileId']}" for m in members]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+async def get_sprite_manifest(scope: str, members: List[dict]) -> dict:
+    """
+    Sprite sheet of a gallery page: URL of one image plus the tile of each illustration.
+    When membership changed since the last build, a rebuild starts in background and the previous
+    sheet is returned with only the tiles that are still valid (stale=True).
+    Illustrations without a tile are loaded individually by the client.
+    """
+    members = [m for m in members if m.get('imageFileId')][:SPRITE_MAX_TILES]
+    manifest = {"ready": False, "stale": False, "tileSize": SPRITE_TILE_SIZE, "tiles": {}}
+    if not members:
+        return manifest
+    
+    key = sprite_key(members)
+    sprite = await db.media_sprites.find_one({"key": key}, {"_id": 0})
+    if sprite:
+        await db.media_sprites.update_one({"key": key}, {"$set": {"lastUsedAt": datetime.now(timezone.utc)}})
+    else:
+        schedule_sprite_build(scope, key, members)
+        sprite = await db.media_sprites.find_one({"scope": scope}, {"_id": 0}, sort=[("createdAt", -1)])
+        if not sprite:
+            return manifest
+        manifest["stale"] = True
+    
+    sources = {m['id']: str(m.get('thumbnailFileId') or m['imageFileId']) for m in members}
+    manifest.update({
+        "ready": True,
+        "spriteUrl": media_url(sprite['sha256']),
+        "width": sprite['width'],
+        "height": sprite['height'],
+        "tiles": {
+            illustration_id: {"x": tile['x'], "y": tile['y']}
+            for illustration_id, tile in sprite['tiles'].items()
+            if sources.get(illustration_id) == tile['source']
+        }
+    })
+    return manifest
+
+def schedule_sprite_build(scope: str, key: str, members: List[dict]):
+    if key in _sprite_builds:
+        return
+    task = asyncio.create_task(build_sprite(scope, key, members))
+    _sprite_builds[key] = task
+    task.add_done_callback(lambda _: _sprite_builds.pop(key, None))
+
+async def build_sprite(scope: str, key: str, members: List[dict]):
+    """Render and store the sprite sheet of a gallery page, then drop the previous sheet of the same page"""
+    try:
+        # Another worker may have built it meanwhile
+        if await db.media_sprites.find_one({"key": key}, {"_id": 1}):
+            return
+        
+        images = []
+        for m in members:
+            try:
+                # Tiles are drawn from the stored thumbnail when there is one
+                images.append(await media_store.read(await media_store.find(m.get('thumbnailFileId') or m['imageFileId'])))
+            except Exception:
+                images.append(None)
+        loop = asyncio.get_running_loop()
+        data, media_type, width, height, positions = await loop.run_in_executor(image_executor, render_sprite, images)
+        del images
+        
+        file_id = await media_store.upload(
+            f"sprite_{key[:16]}.{media_type.split('/')[1]}",
+            data,
+            metadata={"content_type": media_type, "type": "sprite", "sprite_key": key},
+            dedup=False
+        )
+        file_doc = await media_store.find(file_id)
+        now = datetime.now(timezone.utc)
+        sprite = {
+            "key": key,
+            "scope": scope,
+            "fileId": str(file_id),
+            "sha256": file_doc['metadata']['sha256'],
+            "width": width,
+            "height": height,
+            "tiles": {
+                m['id']: {"x": pos[0], "y": pos[1], "source": str(m.get('thumbnailFileId') or m['imageFileId'])}
+                for m, pos in zip(members, positions) if pos
+            },
+            "createdAt": now,
+            "lastUsedAt": now
+        }
+        try:
+            await db.media_sprites.insert_one(sprite)
+        except DuplicateKeyError:
+            # Built concurrently by another worker: keep theirs
+            await delete_media_file(file_id)
+            return
+        logger.info(f"Built sprite sheet for {scope}: {len(members)} tiles, {len(data)} bytes")
+        
+        stale = await db.media_sprites.find({"scope": scope, "key": {"$ne": key}}, {"key": 1, "fileId": 1}).to_list(100)
+        if scope.startswith("search:"):
+            stale += await db.media_sprites.find(
+                {"scope": {"$regex": "^search:"}}, {"key": 1, "fileId": 1}
+            ).sort("lastUsedAt", -1).skip(SPRITE_SEARCH_KEEP).to_list(1000)
+        for old in stale:
+            await delete_media_file(old['fileId'])
+            await db.media_sprites.delete_one({"key": old['key']})
+    except Exception as e:
+        logger.error(f"Error building sprite sheet for {scope}: {str(e)}")
+
+async def delete_media_file(file_id) -> bool:
+    """
+    Release a reference to a GridFS file. When the last one goes (the content may be shared by
+    identical uploads), the file and its derivatives are deleted and dropped from the media caches.
+    Returns True when the file was deleted. Missing files are ignored; any other failure is logged
+    and leaves everything in place (the orphan sweep collects what a failed release leaves behind).
+    """
+    try:
+        derivative_ids = await media_store.derivative_ids(file_id)
+        if not await media_store.delete(file_id):
+            return False
+    except NoFile:
+        return False
+    except Exception as e:
+        logger.warning(f"Could not release media file {file_id}: {str(e)}")
+        return False
+    for removed_id in [file_id, *derivative_ids]:
+        media_memory_cache.invalidate(removed_id)
+    return True
+
+# Cache policy for content-addressed URLs: the URL changes whenever the content does
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+async def apply_media_urls(docs: list, fields: list):
+    """
+    Point URL fields at immutable /api/media/{sha256} URLs, with one fs.files query for all docs.
+    `fields` is a list of (file_id_field, url_field, legacy_url) tuples; legacy_url builds the
+    fallback URL for files without a content hash, or is None to keep the current value.
+    """
+    file_ids = [doc.get(file_field) for doc in docs for file_field, _, _ in fields if doc.get(file_field)]
+    hashes = await media_store.hashes_for(file_ids)
+    for doc in docs:
+        for file_field, url_field, legacy_url in fields:
+            file_id = doc.get(file_field)
+            if not file_id:
+                continue
+            if str(file_id) in hashes:
+                doc[url_field] = media_url(hashes[str(file_id)])
+            elif legacy_url:
+                doc[url_field] = legacy_url(doc)
+
+# (file_id_field, url_field, legacy_url) specs for apply_media_urls
+ILLUSTRATION_MEDIA_FIELDS = [
+    ("imageFileId", "imageUrl", lambda i: f"/api/illustrations/{i['id']}/image"),
+    ("thumbnailFileId", "thumbnailUrl", None)
+]
+BACKGROUND_MEDIA_FIELDS = [("backgroundImageFileId", "backgroundImageUrl", None)]
+GAME_MEDIA_FIELDS = [
+    ("thumbnailFileId", "thumbnailUrl", None),
+    ("cardImageFileId", "cardImageUrl", None),
+    ("pageImageFileId", "pageImageUrl", None)
+]
+POSTER_MEDIA_FIELDS = [
+    ("imageFileId", "imageUrl", lambda p: f"/api/posters/{p['id']}/image"),
+    ("thumbnailFileId", "thumbnailUrl", None)
+]
+BOOK_MEDIA_FIELDS = [
+    ("coverImageFileId", "coverImageUrl", lambda b: f"/api/books/{b['id']}/cover"),
+    ("thumbnailFileId", "thumbnailUrl", None)
+]
+SCENE_MEDIA_FIELDS = [
+    ("coloredImageFileId", "coloredImageUrl", lambda s: f"/api/books/{s['bookId']}/scene/{s['sceneNumber']}/colored-image"),
+    ("lineArtImageFileId", "lineArtImageUrl", lambda s: f"/api/books/{s['bookId']}/scene/{s['sceneNumber']}/lineart-image"),
+    ("thumbnailFileId", "thumbnailUrl", None)
+]
+# Admin lists keep their own image URLs and only gain the thumbnail
+THUMBNAIL_MEDIA_FIELDS = [("thumbnailFileId", "thumbnailUrl", None)]
+CHARACTER_MEDIA_FIELDS = [("imageFileId", "imageUrl", lambda c: f"/api/character-images/{c['trait']}/image")]
+
+async def backfill_media_hashes():
+    """Compute content hashes for files uploaded before /api/media URLs existed"""
+    try:
+        updated = await media_store.backfill_hashes()
+        if updated:
+            logger.info(f"Backfilled content hash for {updated} GridFS files")
+    except Exception as e:
+        logger.error(f"Error backfilling media hashes: {str(e)}")
+
+async def preload_media_disk_cache():
+    """Copy the most requested files to the disk cache: site assets, backgrounds and top downloads"""
+    try:
+        file_ids = []
+        settings = await db.site_settings.find_one({"id": "global"}) or {}
+        file_ids += [settings.get('heroImageFileId'), settings.get('brandLogoFileId')]
+        for collection, field in [
+            (db.character_images, 'imageFileId'),
+            (db.themes, 'backgroundImageFileId'),
+            (db.bundles, 'backgroundImageFileId'),
+            (db.game_level_backgrounds, 'backgroundImageFileId')
+        ]:
+            docs = await collection.find({field: {"$ne": None}}, {field: 1}).to_list(1000)
+            file_ids += [d.get(field) for d in docs]
+        for collection, fields in [
+            (db.illustrations, ['imageFileId', 'pdfFileId']),
+            (db.posters, ['imageFileId', 'pdfFileId'])
+        ]:
+            docs = await collection.find({}, {f: 1 for f in fields}).sort("downloadCount", -1).to_list(MEDIA_DISK_CACHE_PRELOAD)
+            file_ids += [d.get(f) for d in docs for f in fields]
+        
+        oids = list({oid for oid in (to_object_id(fid) for fid in file_ids if fid) if oid})
+        filled = 0
+        async for file_doc in media_store.files.find({"_id": {"$in": oids}, "metadata.sha256": {"$exists": True}}):
+            sha256 = file_doc['metadata']['sha256']
+            if file_doc['length'] > media_disk_cache.max_file_bytes or media_disk_cache.path_for(sha256).exists():
+                continue
+            await media_disk_cache.fill(sha256, media_store.iter_chunks(file_doc))
+            filled += 1
+        logger.info(f"Media disk cache preloaded with {filled} files")
+    except Exception as e:
+        logger.error(f"Error preloading media disk cache: {str(e)}")
+
+async def warm_up_media():
+    """Startup background work for media: hash backfill, then disk cache preload"""
+    await backfill_media_hashes()
+    if media_disk_cache is not None:
+        await preload_media_disk_cache()
+
 # ============== MODELS ==============
 
 class ThemeBase(BaseModel):
@@ -731,7 +1991,7 @@ async def startup_event():
     # Migrate existing illustrations: set isPublished=True if field missing
     migration_result = await db.illustrations.update_many(
         {"isPublished": {"$exists": False}},
-        {"$set": {"isPublished": True, "publishedAt": datetime.now(timezone.utc)}}
+        {"$set": {"isPublished": True, "publishedAt": datetime.now(timezone.utc), "updatedAt": datetime.now(timezone.utc)}}
     )
     if migration_result.modified_count > 0:
         logger.info(f"Migrated {migration_result.modified_count} illustrations to published status")
@@ -739,7 +1999,7 @@ async def startup_event():
     # Migrate existing illustrations: set downloadEnabled=True if field missing
     download_migration = await db.illustrations.update_many(
         {"downloadEnabled": {"$exists": False}},
-        {"$set": {"downloadEnabled": True}}
+        {"$set": {"downloadEnabled": True, "updatedAt": datetime.now(timezone.utc)}}
     )
     if download_migration.modified_count > 0:
         logger.info(f"Migrated {download_migration.modified_count} illustrations with downloadEnabled=True")
@@ -752,8 +2012,239 @@ async def startup_event():
     if poster_migration.modified_count > 0:
         logger.info(f"Migrated {poster_migration.modified_count} posters with downloadEnabled=True")
     
+    # Content hash index for /api/media URLs, then hash legacy files and warm the disk cache in background
+    try:
+        await media_store.ensure_indexes()
+        await db.media_sprites.create_index("key", unique=True)
+        await db.media_sprites.create_index("scope")
+        await db.upload_sessions.create_index("id", unique=True)
+        # Batch status lookups ($in on id) and the catalog version (latest updatedAt)
+        await db.illustrations.create_index("id")
+        await db.illustrations.create_index("updatedAt")
+    except Exception as e:
+        logger.debug(f"Media index creation: {str(e)}")
+    if media_disk_cache is not None:
+        await media_disk_cache.start()
+    # Jobs and finalizes left by a stopped worker can be started again; those of live workers are kept
+    await reclaim_stale_work()
+    await purge_import_uploads()
+    app.state.worker_heartbeat = asyncio.create_task(worker_heartbeat_loop())
+    app.state.media_warmup = asyncio.create_task(warm_up_media())
+    if MEDIA_GC_INTERVAL_HOURS > 0:
+        app.state.media_gc = asyncio.create_task(media_gc_loop())
+    app.state.media_access_flush = asyncio.create_task(media_access_flush_loop())
+    if MEDIA_COLD_AFTER_DAYS > 0 and MEDIA_TIER_INTERVAL_HOURS > 0:
+        app.state.media_tiering_loop = asyncio.create_task(media_tiering_loop())
+    
     logger.info("Database initialized")
 
+# ============== MEDIA ==============
+
+@api_router.get("/media/{content_hash}")
+async def get_media_by_hash(content_hash: str, request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
+    """
+    Serve an image by its sha256 content hash.
+    The URL changes whenever the content changes, so it can be cached forever.
+    Only images are served here: PDFs keep going through the download endpoints.
+    """
+    if not re.fullmatch(r'[0-9a-f]{64}', content_hash):
+        raise HTTPException(status_code=404, detail="File non trovato")
+    
+    file_doc = await media_store.find_by_hash(content_hash)
+    content_type = ((file_doc or {}).get('metadata') or {}).get('content_type') or ''
+    if not content_type.startswith('image/'):
+        raise HTTPException(status_code=404, detail="File non trovato")
+    
+    try:
+        return await stream_gridfs_file(
+            file_doc['_id'],
+            headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL},
+            file_doc=file_doc,
+            request=request,
+            derivative=derivative,
+            cacheable=True
+        )
+    except Exception as e:
+        logger.error(f"Error serving media {content_hash}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Errore nel caricamento file")
+
+@admin_router.get("/media-cache/stats")
+async def admin_get_media_cache_stats(email: str = Depends(verify_token)):
+    """Hit ratio and resident bytes of the media caches (memory and, if enabled, disk)"""
+    return {
+        "memory": media_memory_cache.stats(),
+        "disk": media_disk_cache.stats() if media_disk_cache is not None else None
+    }
+
+@admin_router.post("/media/thumbnails/backfill")
+async def admin_backfill_thumbnails(email: str = Depends(verify_token)):
+    """Start a job creating the missing thumbnails of illustrations, posters, book covers and scenes"""
+    return await start_media_job("thumbnail_backfill", email)
+
+@admin_router.post("/media/placeholders/backfill")
+async def admin_backfill_placeholders(email: str = Depends(verify_token)):
+    """Start a job computing the missing placeholders and dominant colours of catalog images"""
+    return await start_media_job("placeholder_backfill", email)
+
+@admin_router.get("/media/dedup/report")
+async def admin_media_dedup_report(email: str = Depends(verify_token)):
+    """Bytes saved by shared uploads, and duplicates stored before deduplication that can still be merged"""
+    return await media_store.dedup_report()
+
+@admin_router.post("/media/dedup")
+async def admin_media_dedup(email: str = Depends(verify_token)):
+    """Merge files stored more than once (background job, see /media/jobs/{id})"""
+    return await start_media_job("media_dedup", email, run_media_dedup)
+
+@admin_router.post("/media/gc")
+async def admin_media_gc(dryRun: bool = True, email: str = Depends(verify_token)):
+    """
+    Start the orphan sweep (background job, see /media/jobs/{id}).
+    Dry run by default: pass dryRun=false to delete the orphans found.
+    """
+    return await start_media_job("media_gc_dry_run" if dryRun else "media_gc", email, run_media_gc)
+
+@admin_router.post("/media/recompress")
+async def admin_media_recompress(email: str = Depends(verify_token)):
+    """Start the lossless recompression of stored PNGs (background job, see /media/jobs/{id})"""
+    return await start_media_job("media_recompress", email, run_media_recompress)
+
+@admin_router.get("/media/recompress/report")
+async def admin_media_recompress_report(email: str = Depends(verify_token)):
+    """Savings of every recompression run so far, by entity, and PNGs not checked yet"""
+    entities = {}
+    async for group in media_store.files.aggregate([
+        {"$match": {"metadata.recompressed_from": {"$exists": True}}},
+        {"$group": {
+            "_id": "$metadata.recompressed_from.entity",
+            "files": {"$sum": 1},
+            "bytesBefore": {"$sum": "$metadata.recompressed_from.length"},
+            "bytesAfter": {"$sum": "$length"}
+        }}
+    ]):
+        entities[group['_id']] = {
+            "files": group['files'],
+            "bytesBefore": group['bytesBefore'],
+            "bytesAfter": group['bytesAfter'],
+            "savedBytes": group['bytesBefore'] - group['bytesAfter']
+        }
+    pending = await media_store.files.count_documents(MEDIA_RECOMPRESS_QUERY)
+    return {
+        "entities": entities,
+        "savedBytes": sum(totals["savedBytes"] for totals in entities.values()),
+        "pendingFiles": pending
+    }
+
+@admin_router.post("/media/tiering")
+async def admin_media_tiering(coldAfterDays: Optional[int] = None, email: str = Depends(verify_token)):
+    """
+    Move the files not requested for coldAfterDays days (MEDIA_COLD_AFTER_DAYS by default) to the
+    cold tier (background job, see /media/jobs/{id}). They come back on their next request.
+    """
+    days = coldAfterDays if coldAfterDays is not None else MEDIA_COLD_AFTER_DAYS
+    if days <= 0:
+        raise HTTPException(status_code=400, detail="Indicare coldAfterDays (MEDIA_COLD_AFTER_DAYS non impostato)")
+    return await start_media_job("media_tiering", email, run_media_tiering, coldAfterDays=days)
+
+@admin_router.get("/media/access")
+async def admin_media_access(limit: int = 20, email: str = Depends(verify_token)):
+    """Most requested files, files and bytes per tier, and how many would go cold with MEDIA_COLD_AFTER_DAYS"""
+    await media_store.access.flush(media_store.files)
+    tiers = {"hot": {"files": 0, "bytes": 0, "storedBytes": 0}, "cold": {"files": 0, "bytes": 0, "storedBytes": 0}}
+    async for group in media_store.files.aggregate([
+        {"$group": {
+            "_id": {"$eq": ["$backend", COLD_BACKEND]},
+            "files": {"$sum": 1},
+            "bytes": {"$sum": "$length"},
+            "storedBytes": {"$sum": {"$ifNull": ["$coldLength", "$length"]}}
+        }}
+    ]):
+        tiers["cold" if group['_id'] else "hot"] = {k: group[k] for k in ("files", "bytes", "storedBytes")}
+    hottest = await media_store.files.find(
+        {"accessCount": {"$gt": 0}},
+        {"filename": 1, "length": 1, "accessCount": 1, "accessedAt": 1, "backend": 1, "metadata.content_type": 1}
+    ).sort("accessCount", -1).limit(max(1, min(limit, 200))).to_list(200)
+    return {
+        "tiers": tiers,
+        "neverRequested": await media_store.files.count_documents({"accessedAt": None}),
+        "coldCandidates": await media_store.files.count_documents(cold_candidates_query(MEDIA_COLD_AFTER_DAYS)) if MEDIA_COLD_AFTER_DAYS > 0 else None,
+        "hottest": [
+            {
+                "fileId": str(doc['_id']),
+                "filename": doc.get('filename'),
+                "contentType": (doc.get('metadata') or {}).get('content_type'),
+                "length": doc.get('length', 0),
+                "accessCount": doc['accessCount'],
+                "accessedAt": doc.get('accessedAt'),
+                "cold": doc.get('backend') == COLD_BACKEND
+            }
+            for doc in hottest
+        ]
+    }
+
+@admin_router.get("/media/buckets")
+async def admin_media_buckets(email: str = Depends(verify_token)):
+    """Files and bytes stored per storage class (bucket "fs": files not migrated yet)"""
+    totals = {bucket: {"files": 0, "bytes": 0} for bucket in MEDIA_BUCKETS}
+    async for group in media_store.files.aggregate([
+        {"$group": {"_id": {"$ifNull": ["$bucket", DEFAULT_BUCKET]}, "files": {"$sum": 1}, "bytes": {"$sum": "$length"}}}
+    ]):
+        totals[group['_id']] = {"files": group['files'], "bytes": group['bytes']}
+    return {"buckets": totals}
+
+@admin_router.delete("/media/generated-cache")
+async def admin_clear_generated_cache(email: str = Depends(verify_token)):
+    """
+    Drop every regenerable file (bundle PDFs, sprite sheets) in one go: the generated-cache bucket is
+    removed as a whole and what pointed at it reset, so each file is rebuilt on its next request.
+    """
+    await db.bundles.update_many(
+        {"generatedPdfFileId": {"$nin": [None, ""]}},
+        {"$set": {"generatedPdfFileId": None, "generatedPdfHash": None}}
+    )
+    sprites = await db.media_sprites.delete_many({})
+    deleted = await media_store.drop_bucket(GENERATED_CACHE_BUCKET)
+    media_memory_cache.clear()
+    logger.info(f"Generated cache cleared by {email}: {deleted} files, {sprites.deleted_count} sprite sheets")
+    return {"success": True, "deletedFiles": deleted, "deletedSprites": sprites.deleted_count}
+
+@admin_router.get("/media/jobs/{job_id}")
+async def admin_get_media_job(job_id: str, email: str = Depends(verify_token)):
+    """Progress of a media job"""
+    job = await db.media_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return job
+
+# ============== SPRITES ==============
+
+SPRITE_MEMBER_FIELDS = {"_id": 0, "id": 1, "imageFileId": 1, "thumbnailFileId": 1}
+
+@api_router.get("/themes/{theme_id}/sprite")
+async def get_theme_sprite(theme_id: str):
+    """Sprite sheet of the published illustrations of a theme (same order as /api/illustrations)"""
+    members = await db.illustrations.find({"isPublished": True, "themeId": theme_id}, SPRITE_MEMBER_FIELDS).to_list(1000)
+    return await get_sprite_manifest(f"theme:{theme_id}", members)
+
+@api_router.get("/bundles/{bundle_id}/sprite")
+async def get_bundle_sprite(bundle_id: str):
+    """Sprite sheet of the illustrations of a bundle, in bundle order"""
+    bundle = await db.bundles.find_one({"id": bundle_id}, {"_id": 0, "illustrationIds": 1})
+    if not bundle:
+        raise HTTPException(status_code=404, detail="Bundle non trovato")
+    illustration_ids = bundle.get('illustrationIds', [])
+    docs = await db.illustrations.find({"id": {"$in": illustration_ids}, "isPublished": True}, SPRITE_MEMBER_FIELDS).to_list(1000)
+    by_id = {d['id']: d for d in docs}
+    members = [by_id[i] for i in illustration_ids if i in by_id]
+    return await get_sprite_manifest(f"bundle:{bundle_id}", members)
+
+@api_router.get("/search/illustrations/sprite")
+async def get_search_sprite(q: str = "", limit: int = 48):
+    """Sprite sheet of a search results page (same query and limit as /api/search/illustrations)"""
+    results = (await search_illustrations(q=q, limit=limit))['results']
+    query_normalized = re.sub(r'[^\w\s]', '', q.lower().strip())
+    return await get_sprite_manifest(f"search:{query_normalized}:{limit}", results)
+
 # ============== PUBLIC ENDPOINTS ==============
 
 @api_router.get("/")
@@ -770,6 +2261,7 @@ async def get_themes():
         # Ensure backgroundOpacity has default
         if 'backgroundOpacity' not in t:
             t['backgroundOpacity'] = 30
+    await apply_media_urls(themes, BACKGROUND_MEDIA_FIELDS)
     return themes
 
 @api_router.get("/themes/{theme_id}")
@@ -781,27 +2273,24 @@ async def get_theme(theme_id: str):
         theme['backgroundImageUrl'] = f"/api/themes/{theme_id}/background-image"
     if 'backgroundOpacity' not in theme:
         theme['backgroundOpacity'] = 30
+    await apply_media_urls([theme], BACKGROUND_MEDIA_FIELDS)
     return theme
 
 @api_router.get("/themes/{theme_id}/background-image")
-async def get_theme_background_image(theme_id: str):
+async def get_theme_background_image(theme_id: str, request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """Serve theme background image with caching"""
-    from bson import ObjectId
-    
     theme = await db.themes.find_one({"id": theme_id})
     if not theme or not theme.get('backgroundImageFileId'):
         raise HTTPException(status_code=404, detail="Immagine non trovata")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(theme['backgroundImageFileId']))
-        content = await grid_out.read()
-        metadata = grid_out.metadata or {}
-        content_type = metadata.get('content_type', 'image/png')
-        
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type=content_type,
-            headers={"Cache-Control": "public, max-age=3600"}
+        return await stream_gridfs_file(
+            theme['backgroundImageFileId'],
+            default_content_type='image/png',
+            headers={"Cache-Control": "public, max-age=3600"},
+            request=request,
+            derivative=derivative,
+            cacheable=True
         )
     except Exception as e:
         logger.error(f"Error serving theme background: {str(e)}")
@@ -829,6 +2318,7 @@ async def get_illustrations(themeId: Optional[str] = None, isFree: Optional[bool
         i['_id'] = str(i.get('_id', ''))
         i['downloadCount'] = download_counts.get(i['id'], 0)
     
+    await apply_media_urls(illustrations, ILLUSTRATION_MEDIA_FIELDS)
     return illustrations
 
 @api_router.get("/search/illustrations")
@@ -896,6 +2386,10 @@ async def search_illustrations(q: str = "", limit: int = 48):
                 "isFree": illust.get('isFree', True),
                 "price": illust.get('price', 0),
                 "imageFileId": illust.get('imageFileId'),
+                "imageUrl": illust.get('imageUrl'),
+                "thumbnailFileId": illust.get('thumbnailFileId'),
+                "placeholder": illust.get('placeholder'),
+                "dominantColor": illust.get('dominantColor'),
                 "themeName": theme_map.get(illust.get('themeId', ''), ''),
                 "themeId": illust.get('themeId'),
                 "score": score
@@ -906,12 +2400,77 @@ async def search_illustrations(q: str = "", limit: int = 48):
     
     # Apply limit
     results = results[:limit]
+    await apply_media_urls(results, ILLUSTRATION_MEDIA_FIELDS)
     
     return {
         "q": q,
         "results": results
     }
 
+# Ids accepted by one batch status request (a gallery page)
+MAX_STATUS_IDS = 500
+STATUS_FIELDS = {"_id": 0, "id": 1, "imageFileId": 1, "thumbnailFileId": 1, "pdfFileId": 1, "downloadEnabled": 1}
+
+class IllustrationStatusRequest(BaseModel):
+    ids: List[str]
+
+async def catalog_version() -> str:
+    """
+    Version of the illustration catalog: number of illustrations plus the latest updatedAt, so it
+    changes whenever an illustration is added, removed or updated (every write sets updatedAt).
+    """
+    count = await db.illustrations.count_documents({})
+    latest = await db.illustrations.find_one({"updatedAt": {"$type": "date"}}, {"_id": 0, "updatedAt": 1}, sort=[("updatedAt", -1)])
+    stamp = int(latest['updatedAt'].replace(tzinfo=timezone.utc).timestamp() * 1000) if latest else 0
+    return f"{count:x}-{stamp:x}"
+
+async def illustration_statuses(ids: List[str]) -> dict:
+    """Status body of the published illustrations among ids; unknown or unpublished ids are listed in "missing" """
+    docs = await db.illustrations.find({"id": {"$in": ids}, "isPublished": True}, STATUS_FIELDS).to_list(len(ids))
+    await apply_media_urls(docs, ILLUSTRATION_MEDIA_FIELDS)
+    statuses = {}
+    for illust in docs:
+        has_image = bool(illust.get('imageFileId'))
+        has_pdf = bool(illust.get('pdfFileId'))
+        statuses[illust['id']] = {
+            "hasImage": has_image,
+            "imageUrl": illust.get('imageUrl') if has_image else None,
+            "hasThumbnail": bool(illust.get('thumbnailFileId')),
+            "thumbnailUrl": illust.get('thumbnailUrl'),
+            "available": has_pdf,
+            "downloadEnabled": illust.get('downloadEnabled', True),
+            "downloadUrl": f"/api/illustrations/{illust['id']}/download" if has_pdf else None
+        }
+    return {"illustrations": statuses, "missing": [i for i in ids if i not in statuses]}
+
+def status_ids(ids: List[str]) -> List[str]:
+    ids = list(dict.fromkeys(i for i in ids if i))
+    if len(ids) > MAX_STATUS_IDS:
+        raise HTTPException(status_code=400, detail=f"Massimo {MAX_STATUS_IDS} illustrazioni per richiesta")
+    return ids
+
+@api_router.get("/illustrations/status")
+async def get_illustrations_status(request: Request, response: Response, ids: str = ""):
+    """
+    Image, thumbnail and PDF availability of many published illustrations (?ids=a,b,c) with one query, in
+    place of image-status / download-status per card. The ETag depends only on the catalog version and the
+    ids, so browsers and shared caches revalidate it and an unchanged catalog answers 304 before the query.
+    """
+    ids = status_ids(ids.split(","))
+    version = await catalog_version()
+    etag = '"' + hashlib.sha256(f"{version}|{'|'.join(sorted(ids))}".encode()).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "public, no-cache"}
+    if is_not_modified(request.headers, etag, None):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return {"catalogVersion": version, **await illustration_statuses(ids)}
+
+@api_router.post("/illustrations/status")
+async def post_illustrations_status(data: IllustrationStatusRequest):
+    """Same as GET /illustrations/status for id lists too long for a URL (not cacheable: always a 200 body)"""
+    ids = status_ids(data.ids)
+    return {"catalogVersion": await catalog_version(), **await illustration_statuses(ids)}
+
 @api_router.get("/illustrations/{illustration_id}")
 async def get_illustration(illustration_id: str):
     # Only return published illustrations to public
@@ -924,14 +2483,17 @@ async def get_illustration(illustration_id: str):
     real_count = await db.download_events.count_documents({"illustrationId": illustration_id})
     illust['downloadCount'] = real_count
     
+    await apply_media_urls([illust], ILLUSTRATION_MEDIA_FIELDS)
     return illust
 
 @api_router.post("/illustrations/{illustration_id}/download")
-async def download_illustration(illustration_id: str):
+@api_router.get("/illustrations/{illustration_id}/download")
+async def download_illustration(illustration_id: str, request: Request):
     """
     Real file download endpoint using GridFS.
     Returns the PDF file as a downloadable attachment.
     Only for published illustrations with download enabled.
+    GET supports Range requests so interrupted downloads can be resumed.
     """
     # Find the illustration - only if published
     illust = await db.illustrations.find_one({"id": illustration_id, "isPublished": True})
@@ -951,38 +2513,42 @@ async def download_illustration(illustration_id: str):
         )
     
     try:
-        from bson import ObjectId
-        # Get file from GridFS
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(pdf_file_id))
-        
-        # Read file content
-        content = await grid_out.read()
-        
-        # Log download event
-        await db.download_events.insert_one({
-            "id": str(uuid.uuid4()),
-            "illustrationId": illustration_id,
-            "bundleId": None,
-            "downloadedAt": datetime.now(timezone.utc)
-        })
-        
-        # Increment download counter
-        await db.illustrations.update_one(
-            {"id": illustration_id},
-            {"$inc": {"downloadCount": 1}}
-        )
+        # Look up the file in GridFS (the body is streamed below)
+        file_doc = await media_store.find(pdf_file_id)
+        
+        async def count_download(initial: bool):
+            # Count the download once, not for every follow-up range request
+            if not initial:
+                return
+            # Log download event
+            await db.download_events.insert_one({
+                "id": str(uuid.uuid4()),
+                "illustrationId": illustration_id,
+                "bundleId": None,
+                "downloadedAt": datetime.now(timezone.utc)
+            })
+            
+            # Increment download counter
+            await db.illustrations.update_one(
+                {"id": illustration_id},
+                {"$inc": {"downloadCount": 1}}
+            )
         
         # Get filename from GridFS metadata or generate one
-        filename = grid_out.filename or f"pompiconni_{illust.get('title', illustration_id)}.pdf"
+        filename = file_doc.get('filename') or f"pompiconni_{illust.get('title', illustration_id)}.pdf"
         # Sanitize filename
         filename = filename.replace(' ', '_').replace('"', '').replace("'", "")
         
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type="application/pdf",
+        return await stream_gridfs_file(
+            pdf_file_id,
+            content_type="application/pdf",
             headers={
                 "Content-Disposition": f'attachment; filename="{filename}"'
-            }
+            },
+            file_doc=file_doc,
+            request=request,
+            offload=True,
+            on_download=count_download
         )
         
     except Exception as e:
@@ -1008,14 +2574,12 @@ async def get_download_status(illustration_id: str):
     }
 
 @api_router.get("/illustrations/{illustration_id}/image")
-async def get_illustration_image(illustration_id: str):
+async def get_illustration_image(illustration_id: str, request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """
     Serve the illustration image from GridFS.
     Returns the image for preview/display purposes.
     Only for published illustrations.
     """
-    from bson import ObjectId
-    
     # Find the illustration - only if published
     illust = await db.illustrations.find_one({"id": illustration_id, "isPublished": True})
     if not illust:
@@ -1030,22 +2594,15 @@ async def get_illustration_image(illustration_id: str):
         )
     
     try:
-        # Get file from GridFS
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(image_file_id))
-        
-        # Read file content
-        content = await grid_out.read()
-        
-        # Get content type from metadata
-        metadata = grid_out.metadata or {}
-        content_type = metadata.get('content_type', 'image/jpeg')
-        
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type=content_type,
+        # Stream file from GridFS, content type from metadata
+        return await stream_gridfs_file(
+            image_file_id,
+            default_content_type='image/jpeg',
             headers={
-                "Cache-Control": "public, max-age=31536000"  # Cache for 1 year
-            }
+                "Cache-Control": "public, max-age=3600"  # Mutable URL: long-term caching uses /api/media
+            },
+            derivative=derivative,
+            request=request
         )
         
     except Exception as e:
@@ -1079,6 +2636,7 @@ async def get_bundles():
             b['backgroundImageUrl'] = f"/api/bundles/{b['id']}/background-image"
         if b.get('pdfFileId'):
             b['pdfUrl'] = f"/api/bundles/{b['id']}/download"
+    await apply_media_urls(bundles, BACKGROUND_MEDIA_FIELDS)
     return bundles
 
 @api_router.get("/reviews", response_model=List[dict])
@@ -1346,8 +2904,6 @@ async def upload_theme_background(
     email: str = Depends(verify_token)
 ):
     """Upload background image for a theme"""
-    from bson import ObjectId
-    
     theme = await db.themes.find_one({"id": theme_id})
     if not theme:
         raise HTTPException(status_code=404, detail="Tema non trovato")
@@ -1360,20 +2916,17 @@ async def upload_theme_background(
     content_type = content_types.get(ext, "image/png")
     
     try:
-        content = await file.read()
+        content = await read_image_upload(file)
         filename = f"theme_bg_{theme_id}{ext}"
         
         # Delete old image if exists
         if theme.get('backgroundImageFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(theme['backgroundImageFileId']))
-            except Exception:
-                pass
+            await delete_media_file(theme['backgroundImageFileId'])
         
         # Upload new image
-        file_id = await gridfs_bucket.upload_from_stream(
+        file_id, image_meta = await upload_image(
             filename,
-            io.BytesIO(content),
+            content,
             metadata={"theme_id": theme_id, "type": "theme_background", "content_type": content_type}
         )
         
@@ -1381,12 +2934,15 @@ async def upload_theme_background(
             {"id": theme_id},
             {"$set": {
                 "backgroundImageFileId": str(file_id),
+                "backgroundImageMeta": image_meta,
                 "backgroundImageUrl": f"/api/themes/{theme_id}/background-image",
                 "updatedAt": datetime.now(timezone.utc)
             }}
         )
         
         return {"success": True, "backgroundImageUrl": f"/api/themes/{theme_id}/background-image?v={datetime.now(timezone.utc).timestamp()}"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading theme background: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento")
@@ -1435,6 +2991,7 @@ async def get_admin_illustrations(themeId: Optional[str] = None, isPublished: Op
     for i in illustrations:
         i['_id'] = str(i.get('_id', ''))
         i['downloadCount'] = download_counts.get(i['id'], 0)
+    await apply_media_urls(illustrations, THUMBNAIL_MEDIA_FIELDS)
     
     return illustrations
 
@@ -1520,11 +3077,16 @@ async def delete_illustration(illustration_id: str, email: str = Depends(verify_
     # Delete illustration
     await db.illustrations.delete_one({"id": illustration_id})
     
+    # Release its files (kept while other documents share the same content)
+    media_job_id = await release_media_files(
+        [illust.get('imageFileId'), illust.get('pdfFileId')], f"illustration:{illustration_id}", email
+    )
+    
     # Ricalcola conteggi (solo scaricabili)
     await recalculate_theme_count(illust.get('themeId'))
     await recalculate_bundle_counts()
     
-    return {"success": True}
+    return {"success": True, "mediaJobId": media_job_id}
 
 @admin_router.get("/bundles")
 async def admin_get_bundles(email: str = Depends(verify_token)):
@@ -1535,6 +3097,7 @@ async def admin_get_bundles(email: str = Depends(verify_token)):
             b['backgroundImageUrl'] = f"/api/bundles/{b['id']}/background-image"
         if b.get('pdfFileId'):
             b['pdfUrl'] = f"/api/bundles/{b['id']}/download"
+    await apply_media_urls(bundles, BACKGROUND_MEDIA_FIELDS)
     return bundles
 
 @admin_router.post("/bundles")
@@ -1580,26 +3143,18 @@ async def update_bundle(bundle_id: str, bundle: BundleUpdate, email: str = Depen
 
 @admin_router.delete("/bundles/{bundle_id}")
 async def delete_bundle(bundle_id: str, email: str = Depends(verify_token)):
-    from bson import ObjectId
-    
     bundle = await db.bundles.find_one({"id": bundle_id})
     if not bundle:
         raise HTTPException(status_code=404, detail="Bundle non trovato")
     
-    # Delete associated files from GridFS
-    if bundle.get('pdfFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(bundle['pdfFileId']))
-        except Exception:
-            pass
-    if bundle.get('backgroundImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(bundle['backgroundImageFileId']))
-        except Exception:
-            pass
-    
     await db.bundles.delete_one({"id": bundle_id})
-    return {"success": True}
+    
+    # Delete associated files from GridFS in background
+    media_job_id = await release_media_files(
+        [bundle.get('pdfFileId'), bundle.get('backgroundImageFileId'), bundle.get('generatedPdfFileId')],
+        f"bundle:{bundle_id}", email
+    )
+    return {"success": True, "mediaJobId": media_job_id}
 
 @admin_router.post("/bundles/{bundle_id}/upload-background")
 async def upload_bundle_background(
@@ -1608,8 +3163,6 @@ async def upload_bundle_background(
     email: str = Depends(verify_token)
 ):
     """Upload background image for a bundle"""
-    from bson import ObjectId
-    
     bundle = await db.bundles.find_one({"id": bundle_id})
     if not bundle:
         raise HTTPException(status_code=404, detail="Bundle non trovato")
@@ -1622,20 +3175,17 @@ async def upload_bundle_background(
     content_type = content_types.get(ext, "image/png")
     
     try:
-        content = await file.read()
+        content = await read_image_upload(file)
         filename = f"bundle_bg_{bundle_id}{ext}"
         
         # Delete old image if exists
         if bundle.get('backgroundImageFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(bundle['backgroundImageFileId']))
-            except Exception:
-                pass
+            await delete_media_file(bundle['backgroundImageFileId'])
         
         # Upload new image
-        file_id = await gridfs_bucket.upload_from_stream(
+        file_id, image_meta = await upload_image(
             filename,
-            io.BytesIO(content),
+            content,
             metadata={"bundle_id": bundle_id, "type": "bundle_background", "content_type": content_type}
         )
         
@@ -1643,25 +3193,46 @@ async def upload_bundle_background(
             {"id": bundle_id},
             {"$set": {
                 "backgroundImageFileId": str(file_id),
+                "backgroundImageMeta": image_meta,
                 "backgroundImageUrl": f"/api/bundles/{bundle_id}/background-image",
                 "updatedAt": datetime.now(timezone.utc)
             }}
         )
         
         return {"success": True, "backgroundImageUrl": f"/api/bundles/{bundle_id}/background-image"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading bundle background: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento")
 
+def bundle_pdf_file(bundle: dict) -> Tuple[str, dict]:
+    """GridFS filename and metadata of a bundle PDF"""
+    return f"bundle_{bundle['id']}.pdf", {"bundle_id": bundle['id'], "type": "bundle_pdf", "content_type": "application/pdf"}
+
+async def attach_bundle_pdf(bundle: dict, stored: StoredUpload) -> dict:
+    """Link a stored PDF to its bundle, replacing the previous one"""
+    if bundle.get('pdfFileId'):
+        await delete_media_file(bundle['pdfFileId'])
+    
+    await db.bundles.update_one(
+        {"id": bundle['id']},
+        {"$set": {
+            "pdfFileId": str(stored.file_id),
+            "pdfUrl": f"/api/bundles/{bundle['id']}/download",
+            "updatedAt": datetime.now(timezone.utc)
+        }}
+    )
+    
+    return {"success": True, "pdfUrl": f"/api/bundles/{bundle['id']}/download", "sha256": stored.sha256, "size": stored.length}
+
 @admin_router.post("/bundles/{bundle_id}/upload-pdf")
 async def upload_bundle_pdf(
     bundle_id: str,
     file: UploadFile = File(...),
     email: str = Depends(verify_token)
 ):
-    """Upload PDF for a bundle"""
-    from bson import ObjectId
-    
+    """Upload PDF for a bundle"""
     bundle = await db.bundles.find_one({"id": bundle_id})
     if not bundle:
         raise HTTPException(status_code=404, detail="Bundle non trovato")
@@ -1671,66 +3242,38 @@ async def upload_bundle_pdf(
         raise HTTPException(status_code=400, detail="Solo file PDF permessi")
     
     try:
-        content = await file.read()
-        filename = f"bundle_{bundle_id}.pdf"
-        
-        # Delete old PDF if exists
-        if bundle.get('pdfFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(bundle['pdfFileId']))
-            except Exception:
-                pass
-        
-        # Upload new PDF
-        file_id = await gridfs_bucket.upload_from_stream(
-            filename,
-            io.BytesIO(content),
-            metadata={"bundle_id": bundle_id, "type": "bundle_pdf", "content_type": "application/pdf"}
-        )
-        
-        await db.bundles.update_one(
-            {"id": bundle_id},
-            {"$set": {
-                "pdfFileId": str(file_id),
-                "pdfUrl": f"/api/bundles/{bundle_id}/download",
-                "updatedAt": datetime.now(timezone.utc)
-            }}
-        )
-        
-        return {"success": True, "pdfUrl": f"/api/bundles/{bundle_id}/download"}
+        # Upload new PDF (streamed), then drop the old one
+        filename, metadata = bundle_pdf_file(bundle)
+        stored = await store_upload(file, filename, "pdf", metadata=metadata)
+        return await attach_bundle_pdf(bundle, stored)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading bundle PDF: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento")
 
 @api_router.get("/bundles/{bundle_id}/background-image")
-async def get_bundle_background_image(bundle_id: str):
+async def get_bundle_background_image(bundle_id: str, request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """Serve bundle background image"""
-    from bson import ObjectId
-    
     bundle = await db.bundles.find_one({"id": bundle_id})
     if not bundle or not bundle.get('backgroundImageFileId'):
         raise HTTPException(status_code=404, detail="Immagine non trovata")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(bundle['backgroundImageFileId']))
-        content = await grid_out.read()
-        metadata = grid_out.metadata or {}
-        content_type = metadata.get('content_type', 'image/png')
-        
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type=content_type,
-            headers={"Cache-Control": "public, max-age=3600"}
+        return await stream_gridfs_file(
+            bundle['backgroundImageFileId'],
+            default_content_type='image/png',
+            headers={"Cache-Control": "public, max-age=3600"},
+            derivative=derivative,
+            request=request
         )
     except Exception as e:
         logger.error(f"Error serving bundle background: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore nel caricamento immagine")
 
 @api_router.get("/bundles/{bundle_id}/download")
-async def download_bundle_pdf_legacy(bundle_id: str):
+async def download_bundle_pdf_legacy(bundle_id: str, request: Request):
     """Download bundle PDF (legacy - manual upload)"""
-    from bson import ObjectId
-    
     bundle = await db.bundles.find_one({"id": bundle_id})
     if not bundle:
         raise HTTPException(status_code=404, detail="Bundle non trovato")
@@ -1739,16 +3282,15 @@ async def download_bundle_pdf_legacy(bundle_id: str):
         raise HTTPException(status_code=404, detail="PDF non disponibile per questo bundle")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(bundle['pdfFileId']))
-        content = await grid_out.read()
-        
         safe_title = bundle.get('title', 'bundle').replace(' ', '_')
         filename = f"Poppiconni_{safe_title}.pdf"
         
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type="application/pdf",
-            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        return await stream_gridfs_file(
+            bundle['pdfFileId'],
+            content_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+            request=request,
+            offload=True
         )
     except Exception as e:
         logger.error(f"Error downloading bundle PDF: {str(e)}")
@@ -1793,54 +3335,49 @@ def generate_bundle_filename(title: str, page_count: int) -> str:
     return f"Poppiconni_Bundle-{slug}-{page_count}p.pdf"
 
 
-async def check_free_bundle_rate_limit(ip: str, bundle_id: str, pdf_hash: str) -> bool:
+async def check_free_bundle_rate_limit(ip: str, bundle_id: str, pdf_hash: str, initial: bool = True) -> bool:
     """
     Check rate limit for free bundle downloads.
     Returns True if download is allowed, False if limit reached.
     Limit: max 2 downloads per IP + bundleId + hash combination.
+    With initial=False (follow-up range requests) a download already
+    counted for this key is allowed to continue.
+    The download itself is counted by record_free_bundle_download once the file is sent.
     """
     rate_limit_key = f"{ip}_{bundle_id}_{pdf_hash}"
     
     # Find existing record
     record = await db.download_limits.find_one({"key": rate_limit_key})
-    
-    if record:
-        # Check if limit reached (block at count >= 2)
-        if record.get('count', 0) >= 2:
-            logger.warning(f"Rate limit reached for {rate_limit_key}")
-            return False
-        
-        # Increment counter
-        await db.download_limits.update_one(
-            {"key": rate_limit_key},
-            {
-                "$inc": {"count": 1},
-                "$set": {
-                    "lastDownload": datetime.now(timezone.utc),
-                    "expiresAt": datetime.now(timezone.utc) + timedelta(days=30)
-                }
-            }
-        )
-    else:
-        # Create new record with TTL
-        await db.download_limits.insert_one({
-            "key": rate_limit_key,
-            "ip": ip,
-            "bundleId": bundle_id,
-            "pdfHash": pdf_hash,
-            "count": 1,
-            "createdAt": datetime.now(timezone.utc),
-            "lastDownload": datetime.now(timezone.utc),
-            "expiresAt": datetime.now(timezone.utc) + timedelta(days=30)
-        })
-    
+    if not record:
+        return True
+    
+    # Block at count >= 2; a follow-up range of the last allowed download may continue
+    count = record.get('count', 0)
+    if count > 2 or (initial and count >= 2):
+        logger.warning(f"Rate limit reached for {rate_limit_key}")
+        return False
     return True
 
 
+async def record_free_bundle_download(ip: str, bundle_id: str, pdf_hash: str, initial: bool):
+    """
+    Count a free bundle download that is being sent. A resumed range is not counted
+    again, unless no download was counted for this key yet (record with TTL).
+    """
+    now = datetime.now(timezone.utc)
+    update = {
+        "$set": {"lastDownload": now, "expiresAt": now + timedelta(days=30)},
+        "$setOnInsert": {"ip": ip, "bundleId": bundle_id, "pdfHash": pdf_hash, "createdAt": now}
+    }
+    if initial:
+        update["$inc"] = {"count": 1}
+    else:
+        update["$setOnInsert"]["count"] = 1
+    await db.download_limits.update_one({"key": f"{ip}_{bundle_id}_{pdf_hash}"}, update, upsert=True)
+
+
 async def generate_bundle_pdf(bundle: dict) -> bytes:
     """Generate a merged PDF from bundle illustrations"""
-    from bson import ObjectId
-    
     illustration_ids = bundle.get('illustrationIds', [])
     if not illustration_ids:
         raise HTTPException(status_code=400, detail="Bundle senza illustrazioni selezionate")
@@ -1866,48 +3403,16 @@ async def generate_bundle_pdf(bundle: dict) -> bytes:
         try:
             if pdf_file_id:
                 # Use existing PDF
-                grid_out = await gridfs_bucket.open_download_stream(ObjectId(pdf_file_id))
-                pdf_content = await grid_out.read()
+                pdf_content = await media_store.read(await media_store.find(pdf_file_id))
                 merger.append(io.BytesIO(pdf_content))
                 pages_added += 1
                 logger.info(f"Added PDF for illustration {illust.get('id')}")
                 
             elif image_file_id:
-                # Convert image to PDF
-                grid_out = await gridfs_bucket.open_download_stream(ObjectId(image_file_id))
-                image_content = await grid_out.read()
-                
-                # Create PDF from image using reportlab
-                img = PILImage.open(io.BytesIO(image_content))
-                img_width, img_height = img.size
-                
-                # Calculate page size to fit image (A4 or image aspect ratio)
-                page_width, page_height = A4
-                scale = min(page_width / img_width, page_height / img_height)
-                scaled_width = img_width * scale
-                scaled_height = img_height * scale
-                
-                # Create PDF with image
-                pdf_buffer = io.BytesIO()
-                c = canvas.Canvas(pdf_buffer, pagesize=A4)
-                
-                # Center image on page
-                x = (page_width - scaled_width) / 2
-                y = (page_height - scaled_height) / 2
-                
-                # Save image temporarily for reportlab
-                temp_img_buffer = io.BytesIO()
-                img.save(temp_img_buffer, format='PNG')
-                temp_img_buffer.seek(0)
-                
-                from reportlab.lib.utils import ImageReader
-                img_reader = ImageReader(temp_img_buffer)
-                c.drawImage(img_reader, x, y, scaled_width, scaled_height)
-                c.showPage()
-                c.save()
-                
-                pdf_buffer.seek(0)
-                merger.append(pdf_buffer)
+                # Convert image to PDF; size recorded at upload time when available
+                image_content = await media_store.read(await media_store.find(image_file_id))
+                page = image_page_pdf(image_content, known_image_size(illust.get('imageMeta')))
+                merger.append(io.BytesIO(page))
                 pages_added += 1
                 logger.info(f"Converted image to PDF for illustration {illust.get('id')}")
                 
@@ -1934,8 +3439,6 @@ async def generate_bundle_pdf(bundle: dict) -> bytes:
 @api_router.get("/bundles/{bundle_id}/download-pdf")
 async def download_bundle_generated_pdf(bundle_id: str, request: Request):
     """Download auto-generated bundle PDF (merged from illustrations)"""
-    from bson import ObjectId
-    
     bundle = await db.bundles.find_one({"id": bundle_id})
     if not bundle:
         raise HTTPException(status_code=404, detail="Bundle non trovato")
@@ -1968,13 +3471,18 @@ async def download_bundle_generated_pdf(bundle_id: str, request: Request):
         client_ip = forwarded_for.split(",")[0].strip()
     
     # Rate limit check for free bundles (max 2 downloads per IP + bundle + hash)
-    is_allowed = await check_free_bundle_rate_limit(client_ip, bundle_id, current_hash)
+    is_allowed = await check_free_bundle_rate_limit(
+        client_ip, bundle_id, current_hash, initial=is_initial_range_request(get_range_header(request))
+    )
     if not is_allowed:
         raise HTTPException(
             status_code=429, 
             detail="Limite download gratuito raggiunto per questo bundle"
         )
     
+    async def count_download(initial: bool):
+        await record_free_bundle_download(client_ip, bundle_id, current_hash, initial)
+    
     # Generate clean filename
     filename = generate_bundle_filename(bundle.get('title', 'bundle'), page_count)
     
@@ -1983,13 +3491,13 @@ async def download_bundle_generated_pdf(bundle_id: str, request: Request):
         # Serve cached PDF
         try:
             logger.info(f"Serving cached PDF for bundle {bundle_id}")
-            grid_out = await gridfs_bucket.open_download_stream(ObjectId(bundle['generatedPdfFileId']))
-            content = await grid_out.read()
-            
-            return StreamingResponse(
-                io.BytesIO(content),
-                media_type="application/pdf",
-                headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+            return await stream_gridfs_file(
+                bundle['generatedPdfFileId'],
+                content_type="application/pdf",
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+                request=request,
+                offload=True,
+                on_download=count_download
             )
         except Exception as e:
             logger.warning(f"Cache miss, regenerating PDF: {str(e)}")
@@ -2000,16 +3508,14 @@ async def download_bundle_generated_pdf(bundle_id: str, request: Request):
         
         # Delete old cached PDF if exists
         if bundle.get('generatedPdfFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(bundle['generatedPdfFileId']))
-            except:
-                pass
+            await delete_media_file(bundle['generatedPdfFileId'])
         
         # Store new cached PDF in GridFS
-        file_id = await gridfs_bucket.upload_from_stream(
+        file_id = await media_store.upload(
             filename,
-            io.BytesIO(pdf_content),
-            metadata={"bundle_id": bundle_id, "content_type": "application/pdf"}
+            pdf_content,
+            metadata={"bundle_id": bundle_id, "type": "bundle_generated_pdf", "content_type": "application/pdf"},
+            dedup=False
         )
         
         # Update bundle with new cache
@@ -2024,10 +3530,15 @@ async def download_bundle_generated_pdf(bundle_id: str, request: Request):
         
         logger.info(f"Generated and cached new PDF for bundle {bundle_id}")
         
-        return StreamingResponse(
-            io.BytesIO(pdf_content),
-            media_type="application/pdf",
-            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        # Serve the stored copy so the generated bytes can be released right away
+        del pdf_content
+        return await stream_gridfs_file(
+            file_id,
+            content_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+            request=request,
+            offload=True,
+            on_download=count_download
         )
         
     except HTTPException:
@@ -2056,16 +3567,14 @@ async def upload_file(
         raise HTTPException(status_code=400, detail=f"Tipo file non permesso: {ext}")
     
     try:
-        # Read file content
-        content = await file.read()
-        
         # Generate unique filename
         unique_filename = f"{uuid.uuid4()}{ext}"
         
-        # Upload to GridFS
-        file_id = await gridfs_bucket.upload_from_stream(
+        # Upload to GridFS, streamed from the spooled upload
+        stored = await store_upload(
+            file,
             unique_filename,
-            io.BytesIO(content),
+            file_type,
             metadata={
                 "original_filename": file.filename,
                 "file_type": file_type,
@@ -2075,26 +3584,58 @@ async def upload_file(
             }
         )
         
-        # Also save to local uploads folder for image preview (images only)
-        if file_type == "image":
-            file_path = UPLOAD_DIR / unique_filename
-            async with aiofiles.open(file_path, 'wb') as out_file:
-                await out_file.write(content)
-        
-        # Return GridFS file ID and URL
-        file_url = f"/uploads/{unique_filename}" if file_type == "image" else None
+        # Images are previewed from the stored file itself, by content hash
+        file_url = media_url(stored.sha256) if file_type == "image" else None
         
         return {
             "url": file_url,
             "filename": unique_filename,
-            "fileId": str(file_id),
-            "fileType": file_type
+            "fileId": str(stored.file_id),
+            "fileType": file_type,
+            "sha256": stored.sha256,
+            "size": stored.length
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading file: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento del file")
 
+def illustration_pdf_file(illust: dict) -> Tuple[str, dict]:
+    """GridFS filename (from the illustration title) and metadata of an illustration PDF"""
+    safe_title = illust.get('title', illust['id']).replace(' ', '_').replace('"', '').replace("'", "")
+    return f"pompiconni_{safe_title}.pdf", {"illustration_id": illust['id'], "file_type": "pdf", "content_type": "application/pdf"}
+
+async def attach_illustration_pdf(illust: dict, stored: StoredUpload) -> dict:
+    """Link a stored PDF to its illustration, replacing the previous one, and refresh the counts"""
+    old_file_id = illust.get('pdfFileId')
+    if old_file_id:
+        await delete_media_file(old_file_id)
+    
+    await db.illustrations.update_one(
+        {"id": illust['id']},
+        {
+            "$set": {
+                "pdfFileId": str(stored.file_id),
+                "pdfUrl": f"/api/illustrations/{illust['id']}/download",
+                "updatedAt": datetime.now(timezone.utc)
+            }
+        }
+    )
+    
+    # Ricalcola conteggi (ora l'illustrazione è scaricabile)
+    await recalculate_theme_count(illust.get('themeId'))
+    await recalculate_bundle_counts()
+    
+    return {
+        "success": True,
+        "fileId": str(stored.file_id),
+        "sha256": stored.sha256,
+        "size": stored.length,
+        "message": "PDF caricato e collegato all'illustrazione"
+    }
+
 @admin_router.post("/illustrations/{illustration_id}/attach-pdf")
 async def attach_pdf_to_illustration(
     illustration_id: str,
@@ -2102,8 +3643,6 @@ async def attach_pdf_to_illustration(
     email: str = Depends(verify_token)
 ):
     """Upload and attach a PDF file directly to an illustration"""
-    from bson import ObjectId
-    
     # Verify illustration exists
     illust = await db.illustrations.find_one({"id": illustration_id})
     if not illust:
@@ -2115,57 +3654,23 @@ async def attach_pdf_to_illustration(
         raise HTTPException(status_code=400, detail="Solo file PDF sono permessi")
     
     try:
-        # Read file content
-        content = await file.read()
-        
-        # Generate filename based on illustration title
-        safe_title = illust.get('title', illustration_id).replace(' ', '_').replace('"', '').replace("'", "")
-        unique_filename = f"pompiconni_{safe_title}.pdf"
-        
-        # Delete old PDF if exists
-        old_file_id = illust.get('pdfFileId')
-        if old_file_id:
-            try:
-                await gridfs_bucket.delete(ObjectId(old_file_id))
-            except Exception:
-                pass  # Old file might not exist
-        
-        # Upload to GridFS
-        file_id = await gridfs_bucket.upload_from_stream(
+        # Upload to GridFS (streamed), then drop the old PDF
+        unique_filename, metadata = illustration_pdf_file(illust)
+        stored = await store_upload(
+            file,
             unique_filename,
-            io.BytesIO(content),
+            "pdf",
             metadata={
-                "illustration_id": illustration_id,
+                **metadata,
                 "original_filename": file.filename,
-                "file_type": "pdf",
-                "content_type": "application/pdf",
                 "uploaded_by": email,
                 "uploaded_at": datetime.now(timezone.utc).isoformat()
             }
         )
+        return await attach_illustration_pdf(illust, stored)
         
-        # Update illustration with file ID
-        await db.illustrations.update_one(
-            {"id": illustration_id},
-            {
-                "$set": {
-                    "pdfFileId": str(file_id),
-                    "pdfUrl": f"/api/illustrations/{illustration_id}/download",
-                    "updatedAt": datetime.now(timezone.utc)
-                }
-            }
-        )
-        
-        # Ricalcola conteggi (ora l'illustrazione è scaricabile)
-        await recalculate_theme_count(illust.get('themeId'))
-        await recalculate_bundle_counts()
-        
-        return {
-            "success": True,
-            "fileId": str(file_id),
-            "message": "PDF caricato e collegato all'illustrazione"
-        }
-        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error attaching PDF: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento del PDF")
@@ -2177,8 +3682,6 @@ async def attach_image_to_illustration(
     email: str = Depends(verify_token)
 ):
     """Upload and attach an image file (jpg, jpeg, png) to an illustration"""
-    from bson import ObjectId
-    
     # Verify illustration exists
     illust = await db.illustrations.find_one({"id": illustration_id})
     if not illust:
@@ -2200,7 +3703,7 @@ async def attach_image_to_illustration(
     
     try:
         # Read file content
-        content = await file.read()
+        content = await read_image_upload(file)
         
         # Generate filename based on illustration title
         safe_title = illust.get('title', illustration_id).replace(' ', '_').replace('"', '').replace("'", "")
@@ -2209,15 +3712,12 @@ async def attach_image_to_illustration(
         # Delete old image if exists
         old_file_id = illust.get('imageFileId')
         if old_file_id:
-            try:
-                await gridfs_bucket.delete(ObjectId(old_file_id))
-            except Exception:
-                pass  # Old file might not exist
+            await delete_media_file(old_file_id)
         
         # Upload to GridFS
-        file_id = await gridfs_bucket.upload_from_stream(
+        file_id, image_meta = await upload_image(
             unique_filename,
-            io.BytesIO(content),
+            content,
             metadata={
                 "illustration_id": illustration_id,
                 "original_filename": file.filename,
@@ -2227,6 +3727,8 @@ async def attach_image_to_illustration(
                 "uploaded_at": datetime.now(timezone.utc).isoformat()
             }
         )
+        thumbnail_id = await create_thumbnail(file_id, content_type)
+        placeholder = await create_placeholder(content)
         
         # Update illustration with image file ID and URL
         await db.illustrations.update_one(
@@ -2234,6 +3736,9 @@ async def attach_image_to_illustration(
             {
                 "$set": {
                     "imageFileId": str(file_id),
+                    "imageMeta": image_meta,
+                    "thumbnailFileId": thumbnail_id,
+                    **placeholder,
                     "imageUrl": f"/api/illustrations/{illustration_id}/image",
                     "updatedAt": datetime.now(timezone.utc)
                 }
@@ -2251,10 +3756,265 @@ async def attach_image_to_illustration(
             "message": "Immagine caricata e collegata all'illustrazione"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error attaching image: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento dell'immagine")
 
+# Bulk import: directory the server-side packages must live in (empty = upload only),
+# illustrations processed at once and size limits of an uploaded package and of its manifest
+BULK_IMPORT_ROOT = os.environ.get('BULK_IMPORT_ROOT', '')
+BULK_IMPORT_CONCURRENCY = int(os.environ.get('BULK_IMPORT_CONCURRENCY', '4'))
+MAX_IMPORT_UPLOAD_MB = int(os.environ.get('MAX_IMPORT_UPLOAD_MB', '2048'))
+MAX_IMPORT_MANIFEST_BYTES = 5 * 1024 * 1024
+# Rejected rows listed in the job document
+MAX_IMPORT_ERRORS = 200
+# Temp files of uploaded packages
+IMPORT_UPLOAD_PREFIX = "illustration-import-"
+
+async def import_illustration(source: ImportSource, row: ImportRow, email: str) -> dict:
+    """
+    Store the files of one manifest row and return its illustration document (not inserted yet):
+    the image normalized, with thumbnail and placeholder, and the PDF, rendered from the image
+    as a single page when the row has none. Files already stored are released on failure.
+    """
+    now = datetime.now(timezone.utc)
+    illust_id = str(uuid.uuid4())
+    illust = {
+        "id": illust_id,
+        "title": row.title,
+        "description": row.description,
+        "themeId": row.theme_id,
+        "isFree": row.is_free,
+        "price": row.price,
+        "imageUrl": None,
+        "pdfUrl": None,
+        "downloadCount": 0,
+        "pdfFileId": None,
+        "imageFileId": None,
+        "isPublished": False,
+        "publishedAt": None,
+        "createdAt": now,
+        "updatedAt": now
+    }
+    uploaded = {"illustration_id": illust_id, "uploaded_by": email, "uploaded_at": now.isoformat()}
+    stored = []
+    try:
+        if row.image:
+            content = await asyncio.to_thread(source.read, row.image, upload_limit("image"))
+            ext = posixpath.splitext(row.image)[1].lower()
+            safe_title = row.title.replace(' ', '_').replace('"', '').replace("'", "")
+            file_id, image_meta = await upload_image(
+                f"pompiconni_{safe_title}{ext}",
+                content,
+                metadata={
+                    **uploaded,
+                    "original_filename": posixpath.basename(row.image),
+                    "file_type": "image",
+                    "content_type": IMAGE_EXTENSIONS[ext]
+                }
+            )
+            stored.append(file_id)
+            illust.update({
+                "imageFileId": str(file_id),
+                "imageMeta": image_meta,
+                "thumbnailFileId": await create_thumbnail(file_id),
+                **await create_placeholder(content),
+                "imageUrl": f"/api/illustrations/{illust_id}/image"
+            })
+        
+        filename, metadata = illustration_pdf_file(illust)
+        if row.pdf:
+            pdf = await asyncio.to_thread(source.read, row.pdf, upload_limit("pdf"))
+            metadata["original_filename"] = posixpath.basename(row.pdf)
+        else:
+            # Page PDF of the stored (normalized) image
+            image_content = await media_store.read(await media_store.find(illust['imageFileId']))
+            loop = asyncio.get_running_loop()
+            pdf = await loop.run_in_executor(image_executor, image_page_pdf, image_content, known_image_size(illust['imageMeta']))
+        pdf_id = await media_store.upload(filename, pdf, metadata={**metadata, **uploaded})
+        stored.append(pdf_id)
+        illust.update({"pdfFileId": str(pdf_id), "pdfUrl": f"/api/illustrations/{illust_id}/download"})
+    except BaseException:
+        for file_id in stored:
+            await delete_media_file(file_id)
+        raise
+    return illust
+
+async def run_illustration_import(job_id: str, job_type: str):
+    """
+    Import the package of the job (path field): every manifest row is processed concurrently
+    (BULK_IMPORT_CONCURRENCY at a time, images in the image pool), the illustrations inserted
+    with a single insert_many and theme and bundle counts recomputed once at the end.
+    Progress, rejected rows and created ids are recorded in media_jobs.
+    """
+    job = await db.media_jobs.find_one({"id": job_id}, {"path": 1, "temporary": 1, "startedBy": 1})
+    stats = {"processed": 0, "failed": 0, "total": 0, "created": 0}
+    errors = []
+    # (manifest line, document): inserted in manifest order
+    documents = []
+    source = None
+    
+    def reject(line: int, error: str):
+        stats["failed"] += 1
+        if len(errors) < MAX_IMPORT_ERRORS:
+            errors.append({"line": line, "error": error})
+    
+    try:
+        source = await asyncio.to_thread(open_import_source, job['path'])
+        rows, rejected = await asyncio.to_thread(read_manifest, source, MAX_IMPORT_MANIFEST_BYTES)
+        stats["total"] = len(rows) + len(rejected)
+        for item in rejected:
+            reject(item['line'], item['error'])
+        themes = set(await db.themes.distinct("id"))
+        semaphore = asyncio.Semaphore(BULK_IMPORT_CONCURRENCY)
+        
+        async def process(row: ImportRow):
+            async with semaphore:
+                try:
+                    if row.theme_id not in themes:
+                        raise BulkImportError(f"Tema non trovato: {row.theme_id}")
+                    documents.append((row.line, await import_illustration(source, row, job['startedBy'])))
+                except (BulkImportError, HTTPException) as e:
+                    reject(row.line, e.detail if isinstance(e, HTTPException) else str(e))
+                except Exception as e:
+                    logger.warning(f"Import of manifest line {row.line} failed: {str(e)}")
+                    reject(row.line, "Errore durante l'elaborazione")
+                stats["processed"] += 1
+                await db.media_jobs.update_one({"id": job_id}, {"$set": {**stats, "errors": errors}})
+        
+        await asyncio.gather(*(process(row) for row in rows))
+        documents.sort(key=lambda item: item[0])
+        illustrations = [document for _, document in documents]
+        if illustrations:
+            try:
+                await db.illustrations.insert_many(illustrations)
+            except BaseException:
+                await release_import_files(illustrations)
+                raise
+        stats["created"] = len(illustrations)
+        for theme_id in {document['themeId'] for document in illustrations}:
+            await recalculate_theme_count(theme_id)
+        await recalculate_bundle_counts()
+        update = {"status": "completed", "illustrationIds": [document['id'] for document in illustrations]}
+    except BulkImportError as e:
+        update = {"status": "failed", "error": str(e)}
+    except Exception as e:
+        logger.error(f"Illustration import failed: {str(e)}")
+        update = {"status": "failed", "error": "Errore durante l'import"}
+    finally:
+        if source is not None:
+            source.close()
+        if job.get('temporary'):
+            try:
+                os.unlink(job['path'])
+            except OSError:
+                pass
+    await db.media_jobs.update_one(
+        {"id": job_id},
+        {"$set": {**stats, **update, "errors": errors, "finishedAt": datetime.now(timezone.utc)}}
+    )
+    logger.info(f"Illustration import {update['status']}: {stats['created']} created, {stats['failed']} rejected")
+
+async def release_import_files(documents: List[dict]):
+    """
+    Release the files stored for imported illustrations that were not inserted (insert_many failed
+    part way). Thumbnails go with their image: a deduplicated image shares them with other documents.
+    """
+    try:
+        inserted = set(await db.illustrations.distinct("id", {"id": {"$in": [document['id'] for document in documents]}}))
+        for document in documents:
+            if document['id'] not in inserted:
+                for field in ("imageFileId", "pdfFileId"):
+                    if document.get(field):
+                        await delete_media_file(document[field])
+    except Exception as e:
+        # Whatever was left behind is collected by the orphan sweep
+        logger.warning(f"Could not release the files of a failed import: {str(e)}")
+
+async def purge_import_uploads():
+    """
+    Delete uploaded packages left in the temp directory by imports that did not finish (worker stopped):
+    not the package of a running job, and not written to for WORKER_STALE_SECONDS.
+    """
+    in_use = set(await db.media_jobs.distinct("path", {"type": "illustration_import", "status": "running"}))
+    stale = time.time() - WORKER_STALE_SECONDS
+    for path in Path(tempfile.gettempdir()).glob(f"{IMPORT_UPLOAD_PREFIX}*.zip"):
+        try:
+            if str(path) not in in_use and path.stat().st_mtime < stale:
+                path.unlink()
+                logger.info(f"Removed leftover import package {path.name}")
+        except OSError:
+            pass
+
+async def save_import_upload(file: UploadFile) -> str:
+    """Copy an uploaded package to a temporary file (413 past MAX_IMPORT_UPLOAD_MB); returns its path"""
+    max_bytes = MAX_IMPORT_UPLOAD_MB * 1024 * 1024
+    handle = tempfile.NamedTemporaryFile(prefix=IMPORT_UPLOAD_PREFIX, suffix=".zip", delete=False)
+    written = 0
+    try:
+        while True:
+            data = await file.read(UPLOAD_READ_SIZE)
+            if not data:
+                break
+            written += len(data)
+            if written > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Pacchetto troppo grande: massimo {MAX_IMPORT_UPLOAD_MB} MB")
+            await asyncio.to_thread(handle.write, data)
+        handle.close()
+        return handle.name
+    except BaseException:
+        handle.close()
+        os.unlink(handle.name)
+        raise
+
+@admin_router.post("/illustrations/import")
+async def import_illustrations(
+    file: Optional[UploadFile] = File(None),
+    path: Optional[str] = Form(None),
+    email: str = Depends(verify_token)
+):
+    """
+    Create illustrations in bulk from a package: an uploaded ZIP, or the path of a ZIP / directory
+    under BULK_IMPORT_ROOT. The package holds images, PDFs and manifest.json / manifest.csv
+    (title, themeId, description, isFree, price, image, pdf). The manifest is checked right away;
+    the import runs in background (see /media/jobs/{id}) and creates drafts.
+    """
+    if (file is None) == (not path):
+        raise HTTPException(status_code=400, detail="Indicare un file ZIP oppure un percorso")
+    temporary = file is not None
+    try:
+        if temporary:
+            if Path(file.filename or "").suffix.lower() != ".zip":
+                raise HTTPException(status_code=400, detail="Solo archivi ZIP sono permessi")
+            package = await save_import_upload(file)
+        else:
+            package = resolve_import_path(path, BULK_IMPORT_ROOT)
+    except BulkImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        source = await asyncio.to_thread(open_import_source, package)
+        try:
+            rows, rejected = await asyncio.to_thread(read_manifest, source, MAX_IMPORT_MANIFEST_BYTES)
+        finally:
+            source.close()
+    except BulkImportError as e:
+        if temporary:
+            os.unlink(package)
+        raise HTTPException(status_code=400, detail=str(e))
+    if not rows:
+        if temporary:
+            os.unlink(package)
+        details = "; ".join(f"riga {item['line']}: {item['error']}" for item in rejected[:5])
+        raise HTTPException(status_code=400, detail=f"Nessuna illustrazione valida nel manifest ({details})" if details else "Manifest vuoto")
+    
+    return await start_media_job(
+        "illustration_import", email, run_illustration_import, exclusive=False,
+        path=package, temporary=temporary, total=len(rows) + len(rejected)
+    )
+
 @admin_router.post("/generate-illustration")
 async def generate_illustration(request: GenerateRequest, email: str = Depends(verify_token)):
     """Generate AI illustration and save to GridFS"""
@@ -2294,9 +4054,9 @@ async def generate_illustration(request: GenerateRequest, email: str = Depends(v
         unique_filename = f"ai_pompiconni_{safe_prompt}_{illustration_id[:8]}.png"
         
         # Save to GridFS for persistent storage
-        file_id = await gridfs_bucket.upload_from_stream(
+        file_id, image_meta = await upload_image(
             unique_filename,
-            io.BytesIO(images[0]),
+            images[0],
             metadata={
                 "illustration_id": illustration_id,
                 "original_filename": unique_filename,
@@ -2310,6 +4070,9 @@ async def generate_illustration(request: GenerateRequest, email: str = Depends(v
             }
         )
         
+        thumbnail_id = await create_thumbnail(file_id, "image/png")
+        placeholder = await create_placeholder(images[0])
+        
         # Convert to base64 for immediate preview
         image_base64 = base64.b64encode(images[0]).decode('utf-8')
         
@@ -2321,6 +4084,9 @@ async def generate_illustration(request: GenerateRequest, email: str = Depends(v
             'description': request.prompt,
             'imageUrl': f"/api/illustrations/{illustration_id}/image",
             'imageFileId': str(file_id),
+            'imageMeta': image_meta,
+            'thumbnailFileId': thumbnail_id,
+            **placeholder,
             'imageContentType': "image/png",
             'imageOriginalFilename': unique_filename,
             'pdfUrl': None,
@@ -2417,6 +4183,7 @@ async def admin_fix_brand_name(email: str = Depends(verify_token)):
         if old_brand in illust.get('description', ''):
             updates['description'] = illust['description'].replace(old_brand, new_brand)
         if updates:
+            updates['updatedAt'] = datetime.now(timezone.utc)
             await db.illustrations.update_one({"id": illust['id']}, {"$set": updates})
             results["illustrations_fixed"] += 1
     
@@ -2595,23 +4362,20 @@ async def admin_reset_fake_counters(email: str = Depends(verify_token)):
 # ============== HERO IMAGE & SITE SETTINGS ==============
 
 @api_router.get("/site/hero-image")
-async def get_hero_image():
+async def get_hero_image(request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """Serve hero image from GridFS"""
-    from bson import ObjectId
-    
     settings = await db.site_settings.find_one({"id": "global"})
     if not settings or not settings.get('heroImageFileId'):
         raise HTTPException(status_code=404, detail="Hero image non configurata")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(settings['heroImageFileId']))
-        content = await grid_out.read()
-        content_type = settings.get('heroImageContentType', 'image/png')
-        
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type=content_type,
-            headers={"Cache-Control": "public, max-age=3600"}
+        return await stream_gridfs_file(
+            settings['heroImageFileId'],
+            content_type=settings.get('heroImageContentType', 'image/png'),
+            headers={"Cache-Control": "public, max-age=3600"},
+            request=request,
+            derivative=derivative,
+            cacheable=True
         )
     except Exception as e:
         logger.error(f"Error serving hero image: {str(e)}")
@@ -2634,8 +4398,6 @@ async def upload_hero_image(
     email: str = Depends(verify_token)
 ):
     """Upload or replace hero image"""
-    from bson import ObjectId
-    
     # Validate file type
     ext = Path(file.filename).suffix.lower()
     allowed_extensions = [".jpg", ".jpeg", ".png"]
@@ -2646,21 +4408,18 @@ async def upload_hero_image(
     content_type = content_types.get(ext, "image/png")
     
     try:
-        content = await file.read()
+        content = await read_image_upload(file)
         unique_filename = f"hero_pompiconni_{uuid.uuid4()}{ext}"
         
         # Delete old hero image if exists
         settings = await db.site_settings.find_one({"id": "global"})
         if settings and settings.get('heroImageFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(settings['heroImageFileId']))
-            except Exception:
-                pass
+            await delete_media_file(settings['heroImageFileId'])
         
         # Upload to GridFS
-        file_id = await gridfs_bucket.upload_from_stream(
+        file_id, image_meta = await upload_image(
             unique_filename,
-            io.BytesIO(content),
+            content,
             metadata={
                 "type": "hero_image",
                 "original_filename": file.filename,
@@ -2676,6 +4435,7 @@ async def upload_hero_image(
             {
                 "$set": {
                     "heroImageFileId": str(file_id),
+                    "heroImageMeta": image_meta,
                     "heroImageContentType": content_type,
                     "heroImageFileName": file.filename,
                     "heroImageUpdatedAt": datetime.now(timezone.utc).isoformat()
@@ -2690,6 +4450,8 @@ async def upload_hero_image(
             "message": "Hero image aggiornata con successo"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading hero image: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento dell'immagine")
@@ -2697,14 +4459,9 @@ async def upload_hero_image(
 @admin_router.delete("/site/hero-image")
 async def delete_hero_image(email: str = Depends(verify_token)):
     """Delete hero image (restore to default)"""
-    from bson import ObjectId
-    
     settings = await db.site_settings.find_one({"id": "global"})
     if settings and settings.get('heroImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(settings['heroImageFileId']))
-        except Exception:
-            pass
+        await delete_media_file(settings['heroImageFileId'])
         
         await db.site_settings.update_one(
             {"id": "global"},
@@ -2723,23 +4480,20 @@ async def delete_hero_image(email: str = Depends(verify_token)):
 # ============== BRAND LOGO ==============
 
 @api_router.get("/site/brand-logo")
-async def get_brand_logo():
+async def get_brand_logo(request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """Serve brand logo image"""
-    from bson import ObjectId
-    
     settings = await db.site_settings.find_one({"id": "global"})
     if not settings or not settings.get('brandLogoFileId'):
         raise HTTPException(status_code=404, detail="Brand logo non configurato")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(settings['brandLogoFileId']))
-        content = await grid_out.read()
-        content_type = settings.get('brandLogoContentType', 'image/png')
-        
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type=content_type,
-            headers={"Cache-Control": "public, max-age=3600"}
+        return await stream_gridfs_file(
+            settings['brandLogoFileId'],
+            content_type=settings.get('brandLogoContentType', 'image/png'),
+            headers={"Cache-Control": "public, max-age=3600"},
+            request=request,
+            derivative=derivative,
+            cacheable=True
         )
     except Exception as e:
         logger.error(f"Error serving brand logo: {str(e)}")
@@ -2769,30 +4523,26 @@ async def upload_brand_logo(
     content_type = content_types.get(ext, "image/png")
     
     try:
-        content = await file.read()
         filename = f"brand_logo{ext}"
         
         settings = await db.site_settings.find_one({"id": "global"})
         
-        # Delete old logo if exists
-        if settings and settings.get('brandLogoFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(settings['brandLogoFileId']))
-            except Exception:
-                pass
-        
-        # Upload new logo
-        file_id = await gridfs_bucket.upload_from_stream(
+        # Upload new logo, then drop the old one
+        stored = await store_upload(
+            file,
             filename,
-            io.BytesIO(content),
+            "image",
             metadata={"type": "brand_logo", "content_type": content_type}
         )
         
+        if settings and settings.get('brandLogoFileId'):
+            await delete_media_file(settings['brandLogoFileId'])
+        
         await db.site_settings.update_one(
             {"id": "global"},
             {
                 "$set": {
-                    "brandLogoFileId": str(file_id),
+                    "brandLogoFileId": str(stored.file_id),
                     "brandLogoContentType": content_type,
                     "brandLogoUpdatedAt": datetime.now(timezone.utc).isoformat()
                 }
@@ -2801,6 +4551,8 @@ async def upload_brand_logo(
         )
         
         return {"success": True, "brandLogoUrl": f"/api/site/brand-logo?v={datetime.now(timezone.utc).timestamp()}"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading brand logo: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento")
@@ -2811,10 +4563,7 @@ async def delete_brand_logo(email: str = Depends(verify_token)):
     settings = await db.site_settings.find_one({"id": "global"})
     
     if settings and settings.get('brandLogoFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(settings['brandLogoFileId']))
-        except Exception:
-            pass
+        await delete_media_file(settings['brandLogoFileId'])
         
         await db.site_settings.update_one(
             {"id": "global"},
@@ -2931,6 +4680,7 @@ async def get_books():
     books = await db.books.find({"isVisible": True}).to_list(100)
     for b in books:
         b['_id'] = str(b.get('_id', ''))
+    await apply_media_urls(books, BOOK_MEDIA_FIELDS)
     return books
 
 @api_router.get("/books/{book_id}")
@@ -2948,6 +4698,8 @@ async def get_book(book_id: str):
     scenes = await db.book_scenes.find({"bookId": book_id}).sort("sceneNumber", 1).to_list(MAX_SCENES_PER_BOOK)
     for s in scenes:
         s['_id'] = str(s.get('_id', ''))
+    await apply_media_urls([book], BOOK_MEDIA_FIELDS)
+    await apply_media_urls(scenes, SCENE_MEDIA_FIELDS)
     
     # Increment view count
     await db.books.update_one({"id": book_id}, {"$inc": {"viewCount": 1}})
@@ -2955,69 +4707,57 @@ async def get_book(book_id: str):
     return {"book": book, "scenes": scenes}
 
 @api_router.get("/books/{book_id}/scene/{scene_number}/colored-image")
-async def get_scene_colored_image(book_id: str, scene_number: int):
+async def get_scene_colored_image(book_id: str, scene_number: int, request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """Serve colored image for a scene"""
-    from bson import ObjectId
-    
     scene = await db.book_scenes.find_one({"bookId": book_id, "sceneNumber": scene_number})
     if not scene or not scene.get('coloredImageFileId'):
         raise HTTPException(status_code=404, detail="Immagine non disponibile")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(scene['coloredImageFileId']))
-        content = await grid_out.read()
-        content_type = grid_out.metadata.get('content_type', 'image/png') if grid_out.metadata else 'image/png'
-        
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type=content_type,
-            headers={"Cache-Control": "public, max-age=31536000"}
+        return await stream_gridfs_file(
+            scene['coloredImageFileId'],
+            default_content_type='image/png',
+            headers={"Cache-Control": "public, max-age=3600"},
+            derivative=derivative,
+            request=request
         )
     except Exception as e:
         logger.error(f"Error serving colored image: {str(e)}")
         raise HTTPException(status_code=404, detail="Immagine non trovata")
 
 @api_router.get("/books/{book_id}/scene/{scene_number}/lineart-image")
-async def get_scene_lineart_image(book_id: str, scene_number: int):
+async def get_scene_lineart_image(book_id: str, scene_number: int, request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """Serve line art image for a scene"""
-    from bson import ObjectId
-    
     scene = await db.book_scenes.find_one({"bookId": book_id, "sceneNumber": scene_number})
     if not scene or not scene.get('lineArtImageFileId'):
         raise HTTPException(status_code=404, detail="Immagine non disponibile")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(scene['lineArtImageFileId']))
-        content = await grid_out.read()
-        content_type = grid_out.metadata.get('content_type', 'image/png') if grid_out.metadata else 'image/png'
-        
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type=content_type,
-            headers={"Cache-Control": "public, max-age=31536000"}
+        return await stream_gridfs_file(
+            scene['lineArtImageFileId'],
+            default_content_type='image/png',
+            headers={"Cache-Control": "public, max-age=3600"},
+            derivative=derivative,
+            request=request
         )
     except Exception as e:
         logger.error(f"Error serving lineart image: {str(e)}")
         raise HTTPException(status_code=404, detail="Immagine non trovata")
 
 @api_router.get("/books/{book_id}/cover")
-async def get_book_cover(book_id: str):
+async def get_book_cover(book_id: str, request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """Serve book cover image"""
-    from bson import ObjectId
-    
     book = await db.books.find_one({"id": book_id})
     if not book or not book.get('coverImageFileId'):
         raise HTTPException(status_code=404, detail="Copertina non disponibile")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(book['coverImageFileId']))
-        content = await grid_out.read()
-        content_type = grid_out.metadata.get('content_type', 'image/png') if grid_out.metadata else 'image/png'
-        
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type=content_type,
-            headers={"Cache-Control": "public, max-age=3600"}
+        return await stream_gridfs_file(
+            book['coverImageFileId'],
+            default_content_type='image/png',
+            headers={"Cache-Control": "public, max-age=3600"},
+            derivative=derivative,
+            request=request
         )
     except Exception as e:
         logger.error(f"Error serving book cover: {str(e)}")
@@ -3055,11 +4795,9 @@ async def save_reading_progress(book_id: str, visitor_id: str, scene: int):
 # ============== BOOK PDF DOWNLOAD ==============
 
 async def get_gridfs_image(file_id: str) -> bytes:
-    """Helper function to get image bytes from GridFS"""
-    from bson import ObjectId
+    """Helper function to get image bytes from media storage"""
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(file_id))
-        return await grid_out.read()
+        return await media_store.read(await media_store.find(file_id))
     except Exception as e:
         logger.error(f"Error reading GridFS file {file_id}: {e}")
         raise
@@ -3122,6 +4860,7 @@ async def admin_get_books(email: str = Depends(verify_token)):
     books = await db.books.find().sort("createdAt", -1).to_list(100)
     for b in books:
         b['_id'] = str(b.get('_id', ''))
+    await apply_media_urls(books, THUMBNAIL_MEDIA_FIELDS)
     return books
 
 @admin_router.post("/books")
@@ -3157,32 +4896,15 @@ async def admin_update_book(book_id: str, book: BookCreate, email: str = Depends
 @admin_router.delete("/books/{book_id}")
 async def admin_delete_book(book_id: str, email: str = Depends(verify_token)):
     """Delete a book and all its scenes"""
-    from bson import ObjectId
-    
     book = await db.books.find_one({"id": book_id})
     if not book:
         raise HTTPException(status_code=404, detail="Libro non trovato")
     
-    # Delete cover image from GridFS
-    if book.get('coverImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(book['coverImageFileId']))
-        except Exception:
-            pass
-    
-    # Delete all scene images from GridFS
-    scenes = await db.book_scenes.find({"bookId": book_id}).to_list(MAX_SCENES_PER_BOOK)
-    for scene in scenes:
-        if scene.get('coloredImageFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(scene['coloredImageFileId']))
-            except Exception:
-                pass
-        if scene.get('lineArtImageFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(scene['lineArtImageFileId']))
-            except Exception:
-                pass
+    # Cover and scene images, deleted from GridFS in background once the documents are gone
+    file_ids = [book.get('coverImageFileId')]
+    scenes = db.book_scenes.find({"bookId": book_id}, {"coloredImageFileId": 1, "lineArtImageFileId": 1})
+    async for scene in scenes:
+        file_ids += [scene.get('coloredImageFileId'), scene.get('lineArtImageFileId')]
     
     # Delete scenes
     await db.book_scenes.delete_many({"bookId": book_id})
@@ -3193,7 +4915,8 @@ async def admin_delete_book(book_id: str, email: str = Depends(verify_token)):
     # Delete book
     await db.books.delete_one({"id": book_id})
     
-    return {"success": True, "message": "Libro eliminato con tutte le scene"}
+    media_job_id = await release_media_files(file_ids, f"book:{book_id}", email)
+    return {"success": True, "message": "Libro eliminato con tutte le scene", "mediaJobId": media_job_id}
 
 @admin_router.get("/books/{book_id}/pdf")
 async def admin_download_book_pdf(book_id: str, email: str = Depends(verify_token)):
@@ -3237,8 +4960,6 @@ async def admin_upload_book_cover(
     email: str = Depends(verify_token)
 ):
     """Upload book cover image"""
-    from bson import ObjectId
-    
     book = await db.books.find_one({"id": book_id})
     if not book:
         raise HTTPException(status_code=404, detail="Libro non trovato")
@@ -3251,22 +4972,21 @@ async def admin_upload_book_cover(
     content_type = content_types.get(ext, "image/png")
     
     try:
-        content = await file.read()
+        content = await read_image_upload(file)
         filename = f"book_cover_{book_id}{ext}"
         
         # Delete old cover if exists
         if book.get('coverImageFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(book['coverImageFileId']))
-            except Exception:
-                pass
+            await delete_media_file(book['coverImageFileId'])
         
         # Upload to GridFS
-        file_id = await gridfs_bucket.upload_from_stream(
+        file_id, image_meta = await upload_image(
             filename,
-            io.BytesIO(content),
+            content,
             metadata={"book_id": book_id, "type": "cover", "content_type": content_type}
         )
+        thumbnail_id = await create_thumbnail(file_id, content_type)
+        placeholder = await create_placeholder(content)
         
         # Update book
         await db.books.update_one(
@@ -3274,6 +4994,9 @@ async def admin_upload_book_cover(
             {
                 "$set": {
                     "coverImageFileId": str(file_id),
+                    "coverImageMeta": image_meta,
+                    "thumbnailFileId": thumbnail_id,
+                    **placeholder,
                     "coverImageUrl": f"/api/books/{book_id}/cover",
                     "updatedAt": datetime.now(timezone.utc)
                 }
@@ -3281,6 +5004,8 @@ async def admin_upload_book_cover(
         )
         
         return {"success": True, "coverUrl": f"/api/books/{book_id}/cover"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading book cover: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento")
@@ -3363,23 +5088,15 @@ async def admin_update_scene(
 @admin_router.delete("/books/{book_id}/scenes/{scene_id}")
 async def admin_delete_scene(book_id: str, scene_id: str, email: str = Depends(verify_token)):
     """Delete a scene"""
-    from bson import ObjectId
-    
     scene = await db.book_scenes.find_one({"id": scene_id, "bookId": book_id})
     if not scene:
         raise HTTPException(status_code=404, detail="Scena non trovata")
     
     # Delete images from GridFS
     if scene.get('coloredImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(scene['coloredImageFileId']))
-        except Exception:
-            pass
+        await delete_media_file(scene['coloredImageFileId'])
     if scene.get('lineArtImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(scene['lineArtImageFileId']))
-        except Exception:
-            pass
+        await delete_media_file(scene['lineArtImageFileId'])
     
     await db.book_scenes.delete_one({"id": scene_id})
     await db.books.update_one({"id": book_id}, {"$inc": {"sceneCount": -1}})
@@ -3394,8 +5111,6 @@ async def admin_upload_scene_colored_image(
     email: str = Depends(verify_token)
 ):
     """Upload colored image for a scene"""
-    from bson import ObjectId
-    
     scene = await db.book_scenes.find_one({"id": scene_id, "bookId": book_id})
     if not scene:
         raise HTTPException(status_code=404, detail="Scena non trovata")
@@ -3408,27 +5123,30 @@ async def admin_upload_scene_colored_image(
     content_type = content_types.get(ext, "image/png")
     
     try:
-        content = await file.read()
+        content = await read_image_upload(file)
         filename = f"scene_colored_{scene_id}{ext}"
         
         # Delete old image
         if scene.get('coloredImageFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(scene['coloredImageFileId']))
-            except Exception:
-                pass
+            await delete_media_file(scene['coloredImageFileId'])
         
-        file_id = await gridfs_bucket.upload_from_stream(
+        file_id, image_meta = await upload_image(
             filename,
-            io.BytesIO(content),
+            content,
             metadata={"scene_id": scene_id, "type": "colored", "content_type": content_type}
         )
+        # The colored image is the preferred thumbnail source of a scene
+        thumbnail_id = await create_thumbnail(file_id, content_type)
+        placeholder = await create_placeholder(content)
         
         await db.book_scenes.update_one(
             {"id": scene_id},
             {
                 "$set": {
                     "coloredImageFileId": str(file_id),
+                    "coloredImageMeta": image_meta,
+                    "thumbnailFileId": thumbnail_id,
+                    **placeholder,
                     "coloredImageUrl": f"/api/books/{book_id}/scene/{scene['sceneNumber']}/colored-image",
                     "updatedAt": datetime.now(timezone.utc)
                 }
@@ -3436,6 +5154,8 @@ async def admin_upload_scene_colored_image(
         )
         
         return {"success": True, "imageUrl": f"/api/books/{book_id}/scene/{scene['sceneNumber']}/colored-image"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading colored image: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento")
@@ -3448,8 +5168,6 @@ async def admin_upload_scene_lineart_image(
     email: str = Depends(verify_token)
 ):
     """Upload line art image for a scene"""
-    from bson import ObjectId
-    
     scene = await db.book_scenes.find_one({"id": scene_id, "bookId": book_id})
     if not scene:
         raise HTTPException(status_code=404, detail="Scena non trovata")
@@ -3462,34 +5180,34 @@ async def admin_upload_scene_lineart_image(
     content_type = content_types.get(ext, "image/png")
     
     try:
-        content = await file.read()
+        content = await read_image_upload(file)
         filename = f"scene_lineart_{scene_id}{ext}"
         
         # Delete old image
         if scene.get('lineArtImageFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(scene['lineArtImageFileId']))
-            except Exception:
-                pass
+            await delete_media_file(scene['lineArtImageFileId'])
         
-        file_id = await gridfs_bucket.upload_from_stream(
+        file_id, image_meta = await upload_image(
             filename,
-            io.BytesIO(content),
+            content,
             metadata={"scene_id": scene_id, "type": "lineart", "content_type": content_type}
         )
         
-        await db.book_scenes.update_one(
-            {"id": scene_id},
-            {
-                "$set": {
-                    "lineArtImageFileId": str(file_id),
-                    "lineArtImageUrl": f"/api/books/{book_id}/scene/{scene['sceneNumber']}/lineart-image",
-                    "updatedAt": datetime.now(timezone.utc)
-                }
-            }
-        )
+        update = {
+            "lineArtImageFileId": str(file_id),
+            "lineArtImageMeta": image_meta,
+            "lineArtImageUrl": f"/api/books/{book_id}/scene/{scene['sceneNumber']}/lineart-image",
+            "updatedAt": datetime.now(timezone.utc)
+        }
+        # Line art is the thumbnail source only for scenes without a colored image
+        if not scene.get('coloredImageFileId'):
+            update["thumbnailFileId"] = await create_thumbnail(file_id, content_type)
+            update.update(await create_placeholder(content))
+        await db.book_scenes.update_one({"id": scene_id}, {"$set": update})
         
         return {"success": True, "imageUrl": f"/api/books/{book_id}/scene/{scene['sceneNumber']}/lineart-image"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading lineart image: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento")
@@ -3548,18 +5266,13 @@ async def create_generation_style(
 @admin_router.delete("/styles/{style_id}")
 async def delete_generation_style(style_id: str, email: str = Depends(verify_token)):
     """Delete a generation style and its reference image"""
-    from bson import ObjectId
-    
     style = await db.generation_styles.find_one({"id": style_id, "userId": email})
     if not style:
         raise HTTPException(status_code=404, detail="Stile non trovato")
     
     # Delete reference image from GridFS if exists
     if style.get('referenceImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(style['referenceImageFileId']))
-        except Exception:
-            pass
+        await delete_media_file(style['referenceImageFileId'])
     
     await db.generation_styles.delete_one({"id": style_id})
     return {"success": True}
@@ -3571,8 +5284,6 @@ async def upload_style_reference(
     email: str = Depends(verify_token)
 ):
     """Upload reference image for a generation style"""
-    from bson import ObjectId
-    
     style = await db.generation_styles.find_one({"id": style_id, "userId": email})
     if not style:
         raise HTTPException(status_code=404, detail="Stile non trovato")
@@ -3585,19 +5296,12 @@ async def upload_style_reference(
     content_type = content_types.get(ext, "image/png")
     
     try:
-        content = await file.read()
         filename = f"style_reference_{style_id}{ext}"
         
-        # Delete old reference if exists
-        if style.get('referenceImageFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(style['referenceImageFileId']))
-            except Exception:
-                pass
-        
-        file_id = await gridfs_bucket.upload_from_stream(
+        stored = await store_upload(
+            file,
             filename,
-            io.BytesIO(content),
+            "image",
             metadata={
                 "style_id": style_id,
                 "type": "style_reference",
@@ -3606,11 +5310,15 @@ async def upload_style_reference(
             }
         )
         
+        # Delete old reference if exists
+        if style.get('referenceImageFileId'):
+            await delete_media_file(style['referenceImageFileId'])
+        
         await db.generation_styles.update_one(
             {"id": style_id},
             {
                 "$set": {
-                    "referenceImageFileId": str(file_id),
+                    "referenceImageFileId": str(stored.file_id),
                     "referenceImageUrl": f"/api/admin/styles/{style_id}/reference-image",
                     "updatedAt": datetime.now(timezone.utc)
                 }
@@ -3621,6 +5329,8 @@ async def upload_style_reference(
             "success": True,
             "imageUrl": f"/api/admin/styles/{style_id}/reference-image"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading style reference: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento")
@@ -3628,21 +5338,14 @@ async def upload_style_reference(
 @admin_router.get("/styles/{style_id}/reference-image")
 async def get_style_reference_image(style_id: str, email: str = Depends(verify_token)):
     """Serve reference image for a style"""
-    from bson import ObjectId
-    
     style = await db.generation_styles.find_one({"id": style_id, "userId": email})
     if not style or not style.get('referenceImageFileId'):
         raise HTTPException(status_code=404, detail="Immagine di riferimento non trovata")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(style['referenceImageFileId']))
-        content = await grid_out.read()
-        metadata = grid_out.metadata or {}
-        content_type = metadata.get('content_type', 'image/png')
-        
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type=content_type,
+        return await stream_gridfs_file(
+            style['referenceImageFileId'],
+            default_content_type='image/png',
             headers={"Cache-Control": "public, max-age=3600"}
         )
     except Exception as e:
@@ -3667,8 +5370,6 @@ async def generate_poppiconni_illustration(
     Retry automatico: max 5 tentativi sincroni.
     Se fallisce, salva come LOW_CONFIDENCE e avvia retry asincrono.
     """
-    from bson import ObjectId
-    
     # Get reference image - prioritize direct upload, then style library
     reference_image_base64 = None
     
@@ -3681,10 +5382,7 @@ async def generate_poppiconni_illustration(
         style = await db.generation_styles.find_one({"id": request.style_id, "userId": email})
         if style and style.get('referenceImageFileId'):
             try:
-                grid_out = await gridfs_bucket.open_download_stream(
-                    ObjectId(style['referenceImageFileId'])
-                )
-                content = await grid_out.read()
+                content = await media_store.read(await media_store.find(style['referenceImageFileId']))
                 reference_image_base64 = base64.b64encode(content).decode('utf-8')
                 logger.info(f"Using reference image from style library: {style.get('styleName')}")
             except Exception as e:
@@ -3707,9 +5405,9 @@ async def generate_poppiconni_illustration(
             safe_prompt = request.user_request[:30].replace(' ', '_').replace('"', '').replace("'", "")
             
             # Save final PNG to GridFS
-            png_file_id = await gridfs_bucket.upload_from_stream(
+            png_file_id, image_meta = await upload_image(
                 f"poppiconni_{illustration_id}.png",
-                io.BytesIO(result.final_png_bytes),
+                result.final_png_bytes,
                 metadata={
                     "illustration_id": illustration_id,
                     "type": "final_png",
@@ -3719,13 +5417,16 @@ async def generate_poppiconni_illustration(
                     "generation_id": result.generation_id
                 }
             )
+            # Keep the thumbnail rendered by phase 4 instead of only returning it inline
+            thumbnail_id = await create_thumbnail(png_file_id, "image/png", thumbnail_bytes=result.thumbnail_bytes)
+            placeholder = await create_placeholder(result.final_png_bytes)
             
             # Save PDF to GridFS
             pdf_file_id = None
             if result.final_pdf_bytes:
-                pdf_file_id = await gridfs_bucket.upload_from_stream(
+                pdf_file_id = await media_store.upload(
                     f"poppiconni_{illustration_id}.pdf",
-                    io.BytesIO(result.final_pdf_bytes),
+                    result.final_pdf_bytes,
                     metadata={
                         "illustration_id": illustration_id,
                         "type": "final_pdf",
@@ -3741,6 +5442,9 @@ async def generate_poppiconni_illustration(
                 'description': request.user_request,
                 'imageUrl': f"/api/illustrations/{illustration_id}/image",
                 'imageFileId': str(png_file_id),
+                'imageMeta': image_meta,
+                'thumbnailFileId': thumbnail_id,
+                **placeholder,
                 'imageContentType': "image/png",
                 'pdfUrl': f"/api/illustrations/{illustration_id}/download" if pdf_file_id else None,
                 'pdfFileId': str(pdf_file_id) if pdf_file_id else None,
@@ -3778,8 +5482,7 @@ async def generate_poppiconni_illustration(
                 original_prompt=result.optimized_prompt or request.user_request,
                 reference_image_base64=reference_image_base64,
                 style_lock=request.style_lock,
-                db=db,
-                gridfs_bucket=gridfs_bucket
+                db=db
             )
         
         # Prepare response
@@ -3861,6 +5564,7 @@ async def get_public_games():
         if game.get('pageImageFileId'):
             game['pageImageUrl'] = f"/api/games/{game['slug']}/page-image?v={cache_bust}"
     
+    await apply_media_urls(games, GAME_MEDIA_FIELDS)
     return games
 
 
@@ -3881,23 +5585,19 @@ async def get_public_game(slug: str):
     if game.get('pageImageFileId'):
         game['pageImageUrl'] = f"/api/games/{game['slug']}/page-image?v={cache_bust}"
     
+    await apply_media_urls([game], GAME_MEDIA_FIELDS)
     return game
 
 
 @api_router.get("/games/{slug}/thumbnail")
-async def get_game_thumbnail(slug: str):
+async def get_game_thumbnail(slug: str, request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """Get game thumbnail image"""
-    from bson import ObjectId
-    
     game = await db.games.find_one({"slug": slug})
     if not game or not game.get('thumbnailFileId'):
         raise HTTPException(status_code=404, detail="Thumbnail non trovata")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(game['thumbnailFileId']))
-        content = await grid_out.read()
-        content_type = grid_out.metadata.get('content_type', 'image/png') if grid_out.metadata else 'image/png'
-        return StreamingResponse(io.BytesIO(content), media_type=content_type)
+        return await stream_gridfs_file(game['thumbnailFileId'], default_content_type='image/png', request=request, derivative=derivative)
     except Exception as e:
         raise HTTPException(status_code=404, detail="Immagine non trovata")
 
@@ -3997,42 +5697,23 @@ async def update_game(game_id: str, game_data: dict, email: str = Depends(verify
 @api_router.delete("/admin/games/{game_id}")
 async def delete_game(game_id: str, email: str = Depends(verify_token)):
     """Delete a game and all associated images"""
-    from bson import ObjectId
-    
     game = await db.games.find_one({"id": game_id})
     if not game:
         raise HTTPException(status_code=404, detail="Gioco non trovato")
     
-    # Delete thumbnail if exists
-    if game.get('thumbnailFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(game['thumbnailFileId']))
-        except Exception:
-            pass
-    
-    # Delete card image if exists
-    if game.get('cardImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(game['cardImageFileId']))
-        except Exception:
-            pass
-    
-    # Delete page image if exists
-    if game.get('pageImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(game['pageImageFileId']))
-        except Exception:
-            pass
-    
     await db.games.delete_one({"id": game_id})
-    return {"message": "Gioco eliminato"}
+    
+    # Delete thumbnail, card and page images in background
+    media_job_id = await release_media_files(
+        [game.get('thumbnailFileId'), game.get('cardImageFileId'), game.get('pageImageFileId')],
+        f"game:{game_id}", email
+    )
+    return {"message": "Gioco eliminato", "mediaJobId": media_job_id}
 
 
 @api_router.post("/admin/games/{game_id}/thumbnail")
 async def upload_game_thumbnail(game_id: str, file: UploadFile = File(...), email: str = Depends(verify_token)):
     """Upload game thumbnail"""
-    from bson import ObjectId
-    
     game = await db.games.find_one({"id": game_id})
     if not game:
         raise HTTPException(status_code=404, detail="Gioco non trovato")
@@ -4042,29 +5723,27 @@ async def upload_game_thumbnail(game_id: str, file: UploadFile = File(...), emai
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="Tipo file non supportato")
     
-    content = await file.read()
+    content = await read_image_upload(file)
     
     # Delete old thumbnail if exists
     if game.get('thumbnailFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(game['thumbnailFileId']))
-        except:
-            pass
+        await delete_media_file(game['thumbnailFileId'])
     
     # Upload new thumbnail
-    file_id = await gridfs_bucket.upload_from_stream(
+    file_id, _ = await upload_image(
         f"game_thumbnail_{game['slug']}",
-        io.BytesIO(content),
+        content,
         metadata={"content_type": file.content_type, "game_id": game_id}
     )
     
-    await db.games.update_one(
-        {"id": game_id},
-        {"$set": {
-            "thumbnailFileId": str(file_id),
-            "updatedAt": datetime.now(timezone.utc)
-        }}
-    )
+    update = {
+        "thumbnailFileId": str(file_id),
+        "updatedAt": datetime.now(timezone.utc)
+    }
+    # The list card shows the card image when there is one, so it owns the placeholder
+    if not game.get('cardImageFileId'):
+        update.update(await create_placeholder(content))
+    await db.games.update_one({"id": game_id}, {"$set": update})
     
     return {"success": True, "thumbnailUrl": f"/api/games/{game['slug']}/thumbnail"}
 
@@ -4078,30 +5757,28 @@ async def upload_game_card_image(
     email: str = Depends(verify_token)
 ):
     """Upload card image for game (used in /giochi list page)"""
-    from bson import ObjectId
-    
     game = await db.games.find_one({"id": game_id})
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
     
+    content = await read_image_upload(file)
+    
     # Delete old card image if exists
     if game.get('cardImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(game['cardImageFileId']))
-        except Exception:
-            pass
+        await delete_media_file(game['cardImageFileId'])
     
-    content = await file.read()
-    file_id = await gridfs_bucket.upload_from_stream(
+    file_id, _ = await upload_image(
         f"game_card_{game_id}_{file.filename}",
-        io.BytesIO(content),
+        content,
         metadata={"content_type": file.content_type, "game_id": game_id, "type": "card"}
     )
+    placeholder = await create_placeholder(content)
     
     await db.games.update_one(
         {"id": game_id},
         {"$set": {
             "cardImageFileId": str(file_id),
+            **placeholder,
             "updatedAt": datetime.now(timezone.utc)
         }}
     )
@@ -4109,9 +5786,8 @@ async def upload_game_card_image(
     return {"success": True, "cardImageUrl": f"/api/games/{game['slug']}/card-image"}
 
 @api_router.get("/games/{slug}/card-image")
-async def get_game_card_image(slug: str):
+async def get_game_card_image(slug: str, request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """Get card image for a game. Returns 204 No Content if no image exists."""
-    from bson import ObjectId
     game = await db.games.find_one({"slug": slug})
     
     # Return 204 No Content instead of 404 when image doesn't exist
@@ -4119,16 +5795,11 @@ async def get_game_card_image(slug: str):
         return Response(status_code=204)
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(game['cardImageFileId']))
-        content = await grid_out.read()
-        content_type = grid_out.metadata.get('content_type', 'image/jpeg') if grid_out.metadata else 'image/jpeg'
-        
-        # Cache control: allow caching but revalidate
+        # Cache control: allow caching but revalidate (ETag / Last-Modified set by the helper)
         headers = {
-            "Cache-Control": "public, max-age=3600, must-revalidate",
-            "ETag": f'"{game.get("cardImageFileId")}"'
+            "Cache-Control": "public, max-age=3600, must-revalidate"
         }
-        return StreamingResponse(io.BytesIO(content), media_type=content_type, headers=headers)
+        return await stream_gridfs_file(game['cardImageFileId'], default_content_type='image/jpeg', headers=headers, request=request, derivative=derivative)
     except Exception:
         return Response(status_code=204)  # File missing from GridFS
 
@@ -4138,18 +5809,13 @@ async def delete_game_card_image(
     email: str = Depends(verify_token)
 ):
     """Delete card image for game"""
-    from bson import ObjectId
-    
     game = await db.games.find_one({"id": game_id})
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
     
     # Delete from GridFS
     if game.get('cardImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(game['cardImageFileId']))
-        except Exception:
-            pass
+        await delete_media_file(game['cardImageFileId'])
     
     # Clear DB fields (set to null)
     await db.games.update_one(
@@ -4173,30 +5839,25 @@ async def upload_game_page_image(
     email: str = Depends(verify_token)
 ):
     """Upload page background image for game (used in /giochi/:slug page)"""
-    from bson import ObjectId
-    
     game = await db.games.find_one({"id": game_id})
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
     
-    # Delete old page image if exists
-    if game.get('pageImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(game['pageImageFileId']))
-        except Exception:
-            pass
-    
-    content = await file.read()
-    file_id = await gridfs_bucket.upload_from_stream(
+    stored = await store_upload(
+        file,
         f"game_page_{game_id}_{file.filename}",
-        io.BytesIO(content),
+        "image",
         metadata={"content_type": file.content_type, "game_id": game_id, "type": "page"}
     )
     
+    # Delete old page image if exists
+    if game.get('pageImageFileId'):
+        await delete_media_file(game['pageImageFileId'])
+    
     await db.games.update_one(
         {"id": game_id},
         {"$set": {
-            "pageImageFileId": str(file_id),
+            "pageImageFileId": str(stored.file_id),
             "updatedAt": datetime.now(timezone.utc)
         }}
     )
@@ -4204,9 +5865,8 @@ async def upload_game_page_image(
     return {"success": True, "pageImageUrl": f"/api/games/{game['slug']}/page-image"}
 
 @api_router.get("/games/{slug}/page-image")
-async def get_game_page_image(slug: str):
+async def get_game_page_image(slug: str, request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """Get page background image for a game. Returns 204 No Content if no image exists."""
-    from bson import ObjectId
     game = await db.games.find_one({"slug": slug})
     
     # Return 204 No Content instead of 404 when image doesn't exist
@@ -4214,16 +5874,11 @@ async def get_game_page_image(slug: str):
         return Response(status_code=204)
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(game['pageImageFileId']))
-        content = await grid_out.read()
-        content_type = grid_out.metadata.get('content_type', 'image/jpeg') if grid_out.metadata else 'image/jpeg'
-        
-        # Cache control: allow caching but revalidate
+        # Cache control: allow caching but revalidate (ETag / Last-Modified set by the helper)
         headers = {
-            "Cache-Control": "public, max-age=3600, must-revalidate",
-            "ETag": f'"{game.get("pageImageFileId")}"'
+            "Cache-Control": "public, max-age=3600, must-revalidate"
         }
-        return StreamingResponse(io.BytesIO(content), media_type=content_type, headers=headers)
+        return await stream_gridfs_file(game['pageImageFileId'], default_content_type='image/jpeg', headers=headers, request=request, derivative=derivative)
     except Exception:
         return Response(status_code=204)  # File missing from GridFS
 
@@ -4233,7 +5888,6 @@ async def delete_game_page_image(
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
     """Delete page background image for game"""
-    from bson import ObjectId
     verify_token(credentials.credentials)
     
     game = await db.games.find_one({"id": game_id})
@@ -4242,10 +5896,7 @@ async def delete_game_page_image(
     
     # Delete from GridFS
     if game.get('pageImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(game['pageImageFileId']))
-        except Exception:
-            pass
+        await delete_media_file(game['pageImageFileId'])
     
     # Clear DB fields (set to null)
     await db.games.update_one(
@@ -4275,27 +5926,24 @@ async def get_level_backgrounds():
         if bg.get('backgroundImageFileId'):
             bg['backgroundImageUrl'] = f"/api/games/bolle-magiche/level-backgrounds/{bg['id']}/image"
     
+    await apply_media_urls(backgrounds, BACKGROUND_MEDIA_FIELDS)
     return backgrounds
 
 @api_router.get("/games/bolle-magiche/level-backgrounds/{bg_id}/image")
-async def get_level_background_image(bg_id: str):
+async def get_level_background_image(bg_id: str, request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """Serve level background image from GridFS"""
-    from bson import ObjectId
-    
     bg = await db.game_level_backgrounds.find_one({"id": bg_id})
     if not bg or not bg.get('backgroundImageFileId'):
         raise HTTPException(status_code=404, detail="Immagine non trovata")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(bg['backgroundImageFileId']))
-        content = await grid_out.read()
-        metadata = grid_out.metadata or {}
-        content_type = metadata.get('content_type', 'image/jpeg')
-        
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type=content_type,
-            headers={"Cache-Control": "public, max-age=3600"}
+        return await stream_gridfs_file(
+            bg['backgroundImageFileId'],
+            default_content_type='image/jpeg',
+            headers={"Cache-Control": "public, max-age=3600"},
+            request=request,
+            derivative=derivative,
+            cacheable=True
         )
     except Exception as e:
         logger.error(f"Error serving level background image: {e}")
@@ -4359,13 +6007,13 @@ async def admin_create_level_background(
     
     # Upload image if provided
     if backgroundImage:
-        content = await backgroundImage.read()
-        file_id = await gridfs_bucket.upload_from_stream(
+        stored = await store_upload(
+            backgroundImage,
             f"level_bg_{levelRangeStart}_{levelRangeEnd}",
-            io.BytesIO(content),
+            "image",
             metadata={"content_type": backgroundImage.content_type, "bg_id": new_bg["id"]}
         )
-        new_bg["backgroundImageFileId"] = str(file_id)
+        new_bg["backgroundImageFileId"] = str(stored.file_id)
     
     await db.game_level_backgrounds.insert_one(new_bg)
     
@@ -4413,24 +6061,19 @@ async def admin_upload_level_background_image(
     user_id: str = Depends(verify_token)
 ):
     """Admin: Upload/replace level background image"""
-    from bson import ObjectId
-    
     bg = await db.game_level_backgrounds.find_one({"id": bg_id})
     if not bg:
         raise HTTPException(status_code=404, detail="Sfondo non trovato")
     
     # Delete old image if exists
     if bg.get('backgroundImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(bg['backgroundImageFileId']))
-        except Exception:
-            pass
+        await delete_media_file(bg['backgroundImageFileId'])
     
     # Upload new image
-    content = await file.read()
-    file_id = await gridfs_bucket.upload_from_stream(
+    content = await read_image_upload(file)
+    file_id, image_meta = await upload_image(
         f"level_bg_{bg['levelRangeStart']}_{bg['levelRangeEnd']}",
-        io.BytesIO(content),
+        content,
         metadata={"content_type": file.content_type, "bg_id": bg_id}
     )
     
@@ -4438,6 +6081,7 @@ async def admin_upload_level_background_image(
         {"id": bg_id},
         {"$set": {
             "backgroundImageFileId": str(file_id),
+            "backgroundImageMeta": image_meta,
             "updatedAt": datetime.now(timezone.utc)
         }}
     )
@@ -4450,18 +6094,13 @@ async def admin_delete_level_background(
     user_id: str = Depends(verify_token)
 ):
     """Admin: Delete a level background"""
-    from bson import ObjectId
-    
     bg = await db.game_level_backgrounds.find_one({"id": bg_id})
     if not bg:
         raise HTTPException(status_code=404, detail="Sfondo non trovato")
     
     # Delete image from GridFS
     if bg.get('backgroundImageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(bg['backgroundImageFileId']))
-        except Exception:
-            pass
+        await delete_media_file(bg['backgroundImageFileId'])
     
     await db.game_level_backgrounds.delete_one({"id": bg_id})
     
@@ -4479,6 +6118,7 @@ async def get_public_posters():
         {"status": "published"},
         {"_id": 0}
     ).sort("createdAt", -1).to_list(100)
+    await apply_media_urls(posters, POSTER_MEDIA_FIELDS)
     return posters
 
 @api_router.get("/posters/{poster_id}")
@@ -4490,38 +6130,32 @@ async def get_public_poster(poster_id: str):
     )
     if not poster:
         raise HTTPException(status_code=404, detail="Poster non trovato")
+    await apply_media_urls([poster], POSTER_MEDIA_FIELDS)
     return poster
 
 @api_router.get("/posters/{poster_id}/image")
-async def get_poster_image(poster_id: str):
+async def get_poster_image(poster_id: str, request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """Serve poster preview image from GridFS"""
-    from bson import ObjectId
-    
     # Fix: Only serve image for published posters
     poster = await db.posters.find_one({"id": poster_id, "status": "published"})
     if not poster or not poster.get('imageFileId'):
         raise HTTPException(status_code=404, detail="Immagine non trovata")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(poster['imageFileId']))
-        content = await grid_out.read()
-        metadata = grid_out.metadata or {}
-        content_type = metadata.get('content_type', 'image/png')
-        
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type=content_type,
-            headers={"Cache-Control": "public, max-age=3600"}
+        return await stream_gridfs_file(
+            poster['imageFileId'],
+            default_content_type='image/png',
+            headers={"Cache-Control": "public, max-age=3600"},
+            derivative=derivative,
+            request=request
         )
     except Exception as e:
         logger.error(f"Error serving poster image: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore nel caricamento immagine")
 
 @api_router.get("/posters/{poster_id}/download")
-async def download_poster_pdf(poster_id: str):
+async def download_poster_pdf(poster_id: str, request: Request):
     """Download poster PDF (only if published, download enabled, and free or purchased)"""
-    from bson import ObjectId
-    
     poster = await db.posters.find_one({"id": poster_id, "status": "published"})
     if not poster:
         raise HTTPException(status_code=404, detail="Poster non trovato")
@@ -4540,25 +6174,30 @@ async def download_poster_pdf(poster_id: str):
         raise HTTPException(status_code=403, detail="Poster a pagamento - acquista per scaricare")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(poster['pdfFileId']))
-        content = await grid_out.read()
-        
-        # Increment download count
-        await db.posters.update_one(
-            {"id": poster_id},
-            {"$inc": {"downloadCount": 1}}
-        )
+        file_doc = await media_store.find(poster['pdfFileId'])
+        
+        async def count_download(initial: bool):
+            # Increment download count once per download, not per range request
+            if initial:
+                await db.posters.update_one(
+                    {"id": poster_id},
+                    {"$inc": {"downloadCount": 1}}
+                )
         
         safe_title = re.sub(r'[^\w\s-]', '', poster.get('title', 'poster')).strip().replace(' ', '_')
         filename = f"Poppiconni_Poster_{safe_title}.pdf"
         
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type="application/pdf",
+        return await stream_gridfs_file(
+            poster['pdfFileId'],
+            content_type="application/pdf",
             headers={
                 "Content-Disposition": f'attachment; filename="{filename}"',
                 "Cache-Control": "no-cache"
-            }
+            },
+            file_doc=file_doc,
+            request=request,
+            offload=True,
+            on_download=count_download
         )
     except Exception as e:
         logger.error(f"Error downloading poster PDF: {str(e)}")
@@ -4570,6 +6209,7 @@ async def download_poster_pdf(poster_id: str):
 async def admin_get_posters(email: str = Depends(verify_token)):
     """Get all posters for admin panel"""
     posters = await db.posters.find({}, {"_id": 0}).sort("createdAt", -1).to_list(100)
+    await apply_media_urls(posters, THUMBNAIL_MEDIA_FIELDS)
     return posters
 
 @admin_router.post("/posters")
@@ -4638,28 +6278,17 @@ async def toggle_poster_download(poster_id: str, email: str = Depends(verify_tok
 @admin_router.delete("/posters/{poster_id}")
 async def admin_delete_poster(poster_id: str, email: str = Depends(verify_token)):
     """Delete a poster and its files"""
-    from bson import ObjectId
-    
     poster = await db.posters.find_one({"id": poster_id})
     if not poster:
         raise HTTPException(status_code=404, detail="Poster non trovato")
     
-    # Delete image from GridFS
-    if poster.get('imageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(poster['imageFileId']))
-        except Exception:
-            pass
-    
-    # Delete PDF from GridFS
-    if poster.get('pdfFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(poster['pdfFileId']))
-        except Exception:
-            pass
-    
     await db.posters.delete_one({"id": poster_id})
-    return {"success": True}
+    
+    # Delete image and PDF from GridFS in background
+    media_job_id = await release_media_files(
+        [poster.get('imageFileId'), poster.get('pdfFileId')], f"poster:{poster_id}", email
+    )
+    return {"success": True, "mediaJobId": media_job_id}
 
 @admin_router.post("/posters/{poster_id}/upload-image")
 async def admin_upload_poster_image(
@@ -4668,8 +6297,6 @@ async def admin_upload_poster_image(
     email: str = Depends(verify_token)
 ):
     """Upload preview image for a poster"""
-    from bson import ObjectId
-    
     poster = await db.posters.find_one({"id": poster_id})
     if not poster:
         raise HTTPException(status_code=404, detail="Poster non trovato")
@@ -4682,31 +6309,33 @@ async def admin_upload_poster_image(
     content_type = content_types.get(ext, "image/png")
     
     try:
-        content = await file.read()
+        content = await read_image_upload(file)
         filename = f"poster_{poster_id}{ext}"
         
         # Delete old image if exists
         if poster.get('imageFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(poster['imageFileId']))
-            except Exception:
-                pass
+            await delete_media_file(poster['imageFileId'])
         
-        file_id = await gridfs_bucket.upload_from_stream(
+        file_id, image_meta = await upload_image(
             filename,
-            io.BytesIO(content),
+            content,
             metadata={
                 "poster_id": poster_id,
                 "type": "poster_image",
                 "content_type": content_type
             }
         )
+        thumbnail_id = await create_thumbnail(file_id, content_type)
+        placeholder = await create_placeholder(content)
         
         await db.posters.update_one(
             {"id": poster_id},
             {
                 "$set": {
                     "imageFileId": str(file_id),
+                    "imageMeta": image_meta,
+                    "thumbnailFileId": thumbnail_id,
+                    **placeholder,
                     "imageUrl": f"/api/posters/{poster_id}/image",
                     "updatedAt": datetime.now(timezone.utc)
                 }
@@ -4717,10 +6346,39 @@ async def admin_upload_poster_image(
             "success": True,
             "imageUrl": f"/api/posters/{poster_id}/image"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading poster image: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento")
 
+def poster_pdf_file(poster: dict) -> Tuple[str, dict]:
+    """GridFS filename and metadata of a poster print PDF"""
+    return f"poster_{poster['id']}.pdf", {"poster_id": poster['id'], "type": "poster_pdf", "content_type": "application/pdf"}
+
+async def attach_poster_pdf(poster: dict, stored: StoredUpload) -> dict:
+    """Link a stored print PDF to its poster, replacing the previous one"""
+    if poster.get('pdfFileId'):
+        await delete_media_file(poster['pdfFileId'])
+    
+    await db.posters.update_one(
+        {"id": poster['id']},
+        {
+            "$set": {
+                "pdfFileId": str(stored.file_id),
+                "pdfUrl": f"/api/posters/{poster['id']}/download",
+                "updatedAt": datetime.now(timezone.utc)
+            }
+        }
+    )
+    
+    return {
+        "success": True,
+        "pdfUrl": f"/api/posters/{poster['id']}/download",
+        "sha256": stored.sha256,
+        "size": stored.length
+    }
+
 @admin_router.post("/posters/{poster_id}/upload-pdf")
 async def admin_upload_poster_pdf(
     poster_id: str,
@@ -4728,8 +6386,6 @@ async def admin_upload_poster_pdf(
     email: str = Depends(verify_token)
 ):
     """Upload print-ready PDF for a poster"""
-    from bson import ObjectId
-    
     poster = await db.posters.find_one({"id": poster_id})
     if not poster:
         raise HTTPException(status_code=404, detail="Poster non trovato")
@@ -4739,41 +6395,12 @@ async def admin_upload_poster_pdf(
         raise HTTPException(status_code=400, detail="Solo file PDF permessi")
     
     try:
-        content = await file.read()
-        filename = f"poster_{poster_id}.pdf"
-        
-        # Delete old PDF if exists
-        if poster.get('pdfFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(poster['pdfFileId']))
-            except Exception:
-                pass
-        
-        file_id = await gridfs_bucket.upload_from_stream(
-            filename,
-            io.BytesIO(content),
-            metadata={
-                "poster_id": poster_id,
-                "type": "poster_pdf",
-                "content_type": "application/pdf"
-            }
-        )
-        
-        await db.posters.update_one(
-            {"id": poster_id},
-            {
-                "$set": {
-                    "pdfFileId": str(file_id),
-                    "pdfUrl": f"/api/posters/{poster_id}/download",
-                    "updatedAt": datetime.now(timezone.utc)
-                }
-            }
-        )
-        
-        return {
-            "success": True,
-            "pdfUrl": f"/api/posters/{poster_id}/download"
-        }
+        # Delete old PDF once the new one is stored
+        filename, metadata = poster_pdf_file(poster)
+        stored = await store_upload(file, filename, "pdf", metadata=metadata)
+        return await attach_poster_pdf(poster, stored)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading poster PDF: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento")
@@ -4800,6 +6427,252 @@ async def admin_poster_stats(email: str = Depends(verify_token)):
         "totalDownloads": total_downloads
     }
 
+# ============== RESUMABLE UPLOADS ==============
+
+# Large PDFs can be sent as numbered chunks over several requests (in parallel, retried one by one)
+# instead of a single multipart POST. Chunks are written straight to fs.chunks under a file id
+# reserved by the session; finalize only writes the fs.files document over them.
+# target -> (collection, not-found message, filename/metadata builder, attach coroutine)
+RESUMABLE_UPLOAD_TARGETS = {
+    "illustration_pdf": ("illustrations", "Illustrazione non trovata", illustration_pdf_file, attach_illustration_pdf),
+    "bundle_pdf": ("bundles", "Bundle non trovato", bundle_pdf_file, attach_bundle_pdf),
+    "poster_pdf": ("posters", "Poster non trovato", poster_pdf_file, attach_poster_pdf),
+}
+
+class UploadSessionCreate(BaseModel):
+    target: str  # illustration_pdf, bundle_pdf or poster_pdf
+    targetId: str
+    filename: str
+    size: int  # total bytes
+    sha256: Optional[str] = None  # checked on finalize when given
+
+def upload_session_response(session: dict) -> dict:
+    received = set(session.get('receivedChunks', []))
+    return {
+        "sessionId": session['id'],
+        "status": session['status'],
+        "size": session['size'],
+        "chunkSize": session['chunkSize'],
+        "chunkCount": session['chunkCount'],
+        "receivedChunks": sorted(received),
+        "missingChunks": [n for n in range(session['chunkCount']) if n not in received],
+        "expiresAt": session['expiresAt']
+    }
+
+async def purge_upload_sessions():
+    """Drop unfinished upload sessions past their expiry, with the chunks they received"""
+    cursor = db.upload_sessions.find(
+        {"status": {"$in": ["open", "failed"]}, "expiresAt": {"$lt": datetime.now(timezone.utc)}},
+        {"id": 1, "fileId": 1, "bucket": 1, "storedFile": 1}
+    )
+    async for session in cursor:
+        await discard_upload_session(session)
+        await db.upload_sessions.delete_one({"id": session['id']})
+        logger.info(f"Removed expired upload session {session['id']}")
+
+async def discard_upload_session(session: dict):
+    """Drop the received chunks, or release the file they were already stored as by a failed finalize"""
+    if session.get('storedFile'):
+        await delete_media_file(session['storedFile']['fileId'])
+    else:
+        await media_store.delete_chunks(session['fileId'], session.get('bucket', DEFAULT_BUCKET))
+
+async def get_upload_session(session_id: str) -> dict:
+    session = await db.upload_sessions.find_one({"id": session_id}, {"_id": 0})
+    if not session:
+        raise HTTPException(status_code=404, detail="Sessione di upload non trovata")
+    return session
+
+@admin_router.post("/uploads")
+async def create_upload_session(data: UploadSessionCreate, email: str = Depends(verify_token)):
+    """Start a resumable upload: returns the chunk size and the number of chunks to send"""
+    if data.target not in RESUMABLE_UPLOAD_TARGETS:
+        raise HTTPException(status_code=400, detail=f"Destinazione non valida: usare una tra {', '.join(RESUMABLE_UPLOAD_TARGETS)}")
+    if Path(data.filename).suffix.lower() != ".pdf":
+        raise HTTPException(status_code=400, detail="Solo file PDF permessi")
+    if data.size <= 0:
+        raise HTTPException(status_code=400, detail="Dimensione del file non valida")
+    if data.size > upload_limit("pdf"):
+        raise HTTPException(status_code=413, detail=str(UploadTooLarge(upload_limit("pdf"))))
+    
+    collection, not_found, _, _ = RESUMABLE_UPLOAD_TARGETS[data.target]
+    if not await db[collection].find_one({"id": data.targetId}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail=not_found)
+    
+    await purge_upload_sessions()
+    
+    now = datetime.now(timezone.utc)
+    session = {
+        "id": str(uuid.uuid4()),
+        "target": data.target,
+        "targetId": data.targetId,
+        "filename": data.filename,
+        "size": data.size,
+        "sha256": data.sha256.lower() if data.sha256 else None,
+        "chunkSize": UPLOAD_SESSION_CHUNK_SIZE,
+        "chunkCount": -(-data.size // UPLOAD_SESSION_CHUNK_SIZE),
+        "fileId": ObjectId(),
+        # Every target is a PDF: chunks are staged in the bucket the file ends up in
+        "bucket": PDFS_BUCKET,
+        "receivedChunks": [],
+        "status": "open",
+        "createdBy": email,
+        "createdAt": now,
+        "expiresAt": now + timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+    }
+    await db.upload_sessions.insert_one(session)
+    return upload_session_response(session)
+
+@admin_router.get("/uploads/{session_id}")
+async def get_upload_session_status(session_id: str, email: str = Depends(verify_token)):
+    """Chunks received so far, to resume an interrupted upload"""
+    return upload_session_response(await get_upload_session(session_id))
+
+# A chunk write older than this is taken as abandoned (worker stopped) and no longer holds finalize back
+UPLOAD_CHUNK_WRITE_LEASE_SECONDS = 300
+
+@admin_router.put("/uploads/{session_id}/chunks/{n}")
+async def put_upload_chunk(session_id: str, n: int, request: Request, email: str = Depends(verify_token)):
+    """
+    Store chunk n (raw request body). Every chunk is chunkSize bytes except the last one.
+    Chunks can be sent in any order and in parallel; sending one again replaces it.
+    An optional X-Chunk-Sha256 header is checked against the body.
+    """
+    session = await get_upload_session(session_id)
+    if session['status'] != "open" or session.get('storedFile'):
+        raise HTTPException(status_code=409, detail="Sessione di upload già chiusa")
+    if not 0 <= n < session['chunkCount']:
+        raise HTTPException(status_code=400, detail=f"Numero di blocco non valido: 0-{session['chunkCount'] - 1}")
+    
+    expected = min(session['chunkSize'], session['size'] - n * session['chunkSize'])
+    data = bytearray()
+    async for part in request.stream():
+        data += part
+        if len(data) > expected:
+            raise HTTPException(status_code=413, detail=f"Blocco troppo grande: attesi {expected} byte")
+    if len(data) != expected:
+        raise HTTPException(status_code=400, detail=f"Dimensione del blocco errata: attesi {expected} byte, ricevuti {len(data)}")
+    checksum = request.headers.get("x-chunk-sha256")
+    if checksum and hashlib.sha256(data).hexdigest() != checksum.lower():
+        raise HTTPException(status_code=400, detail="Checksum del blocco non corrispondente")
+    
+    # Claim the write first: finalize waits for claimed writes, so it never hashes a chunk that is being replaced
+    write = {"id": str(uuid.uuid4()), "chunk": n, "startedAt": datetime.now(timezone.utc)}
+    claimed = await db.upload_sessions.update_one(
+        {"id": session_id, "status": "open", "storedFile": {"$exists": False}},
+        {"$push": {"chunkWrites": write}}
+    )
+    if claimed.matched_count == 0:
+        raise HTTPException(status_code=409, detail="Sessione di upload già chiusa")
+    try:
+        await media_store.write_chunk(session['fileId'], n, bytes(data), session.get('bucket', DEFAULT_BUCKET))
+    except BaseException:
+        await db.upload_sessions.update_one({"id": session_id}, {"$pull": {"chunkWrites": {"id": write['id']}}})
+        raise
+    result = await db.upload_sessions.update_one(
+        {"id": session_id, "status": "open"},
+        {"$addToSet": {"receivedChunks": n}, "$pull": {"chunkWrites": {"id": write['id']}}}
+    )
+    if result.matched_count == 0:
+        await db.upload_sessions.update_one({"id": session_id}, {"$pull": {"chunkWrites": {"id": write['id']}}})
+        raise HTTPException(status_code=409, detail="Sessione di upload già chiusa")
+    return {"success": True, "chunk": n}
+
+@admin_router.post("/uploads/{session_id}/finalize")
+async def finalize_upload_session(session_id: str, email: str = Depends(verify_token)):
+    """Turn the received chunks into the GridFS file and attach it to the target document"""
+    # Chunk writes claimed within the lease are still running: their chunks must land before the file is hashed
+    lease_start = datetime.now(timezone.utc) - timedelta(seconds=UPLOAD_CHUNK_WRITE_LEASE_SECONDS)
+    session = await db.upload_sessions.find_one_and_update(
+        {"id": session_id, "status": "open", "chunkWrites": {"$not": {"$elemMatch": {"startedAt": {"$gt": lease_start}}}}},
+        {"$set": {"status": "finalizing", **worker_fields()}, "$unset": {"chunkWrites": ""}},
+        projection={"_id": 0}
+    )
+    if not session:
+        if (await get_upload_session(session_id))['status'] == "open":
+            raise HTTPException(status_code=409, detail="Blocchi ancora in scrittura: riprovare tra poco")
+        raise HTTPException(status_code=409, detail="Sessione di upload già chiusa")
+    
+    async def reopen():
+        await db.upload_sessions.update_one(
+            {"id": session_id},
+            {"$set": {"status": "open"}, "$unset": {"worker": "", "heartbeatAt": ""}}
+        )
+    
+    missing = upload_session_response(session)['missingChunks']
+    if missing:
+        await reopen()
+        raise HTTPException(status_code=409, detail=f"Blocchi mancanti: {', '.join(map(str, missing[:20]))}")
+    
+    collection, not_found, file_info, attach = RESUMABLE_UPLOAD_TARGETS[session['target']]
+    target_doc = await db[collection].find_one({"id": session['targetId']})
+    if not target_doc:
+        await reopen()
+        raise HTTPException(status_code=404, detail=not_found)
+    
+    filename, metadata = file_info(target_doc)
+    stored_file = session.get('storedFile')
+    try:
+        if stored_file:
+            # Finalize run again after the file was stored (attach failed or the worker stopped)
+            stored = StoredUpload(file_id=stored_file['fileId'], sha256=stored_file['sha256'], length=stored_file['length'])
+        else:
+            # Idempotent: a finalize interrupted after storing the file gets the same file back
+            stored = await media_store.assemble(
+                session['fileId'],
+                filename,
+                session['size'],
+                session['chunkSize'],
+                metadata={
+                    **metadata,
+                    "original_filename": session['filename'],
+                    "uploaded_by": session['createdBy'],
+                    "uploaded_at": datetime.now(timezone.utc).isoformat()
+                },
+                bucket=session.get('bucket', DEFAULT_BUCKET)
+            )
+            await db.upload_sessions.update_one(
+                {"id": session_id},
+                {"$set": {"storedFile": {"fileId": stored.file_id, "sha256": stored.sha256, "length": stored.length}}}
+            )
+    except CorruptGridFile as e:
+        logger.warning(f"Upload session {session_id} not assembled: {str(e)}")
+        await reopen()
+        raise HTTPException(status_code=409, detail="Blocchi incompleti: inviarli di nuovo")
+    except BaseException:
+        await reopen()
+        raise
+    
+    if session.get('sha256') and stored.sha256 != session['sha256']:
+        await delete_media_file(stored.file_id)
+        await db.upload_sessions.update_one({"id": session_id}, {"$set": {"status": "failed"}, "$unset": {"storedFile": ""}})
+        raise HTTPException(status_code=422, detail="Checksum del file non corrispondente")
+    
+    if stored_file and target_doc.get('pdfFileId') == str(stored.file_id):
+        # Already linked by the earlier run: link again without releasing it as the previous file
+        target_doc = {**target_doc, "pdfFileId": None}
+    try:
+        result = await attach(target_doc, stored)
+    except BaseException:
+        await reopen()
+        raise
+    await db.upload_sessions.update_one(
+        {"id": session_id},
+        {"$set": {"status": "completed", "completedAt": datetime.now(timezone.utc)}}
+    )
+    logger.info(f"Upload session {session_id} stored as {stored.file_id} ({stored.length} bytes)")
+    return result
+
+@admin_router.delete("/uploads/{session_id}")
+async def abort_upload_session(session_id: str, email: str = Depends(verify_token)):
+    """Abandon an unfinished upload and drop its chunks"""
+    session = await get_upload_session(session_id)
+    if session['status'] in ("completed", "finalizing"):
+        raise HTTPException(status_code=409, detail="Sessione di upload già chiusa")
+    await discard_upload_session(session)
+    await db.upload_sessions.delete_one({"id": session_id})
+    return {"success": True}
+
 # ============== POPPICONNI CHARACTER IMAGES ==============
 
 # Character traits with their images (for "Chi è Poppiconni?" section)
@@ -4809,6 +6682,7 @@ CHARACTER_TRAITS = ["dolce", "simpatico", "impacciato"]
 async def get_character_images():
     """Get all character trait images for public display"""
     images = await db.character_images.find({}, {"_id": 0}).to_list(10)
+    await apply_media_urls(images, CHARACTER_MEDIA_FIELDS)
     # Return as dict for easy access
     result = {}
     for img in images:
@@ -4837,8 +6711,6 @@ async def admin_upload_character_image(
     email: str = Depends(verify_token)
 ):
     """Upload image for a character trait (dolce, simpatico, impacciato)"""
-    from bson import ObjectId
-    
     if trait not in CHARACTER_TRAITS:
         raise HTTPException(status_code=400, detail=f"Trait must be one of: {CHARACTER_TRAITS}")
     
@@ -4850,21 +6722,13 @@ async def admin_upload_character_image(
     content_type = content_types.get(ext, "image/png")
     
     try:
-        content = await file.read()
         filename = f"character_{trait}{ext}"
         
-        # Check if image already exists for this trait
-        existing = await db.character_images.find_one({"trait": trait})
-        if existing and existing.get('imageFileId'):
-            try:
-                await gridfs_bucket.delete(ObjectId(existing['imageFileId']))
-            except Exception:
-                pass
-        
         # Upload new image
-        file_id = await gridfs_bucket.upload_from_stream(
+        stored = await store_upload(
+            file,
             filename,
-            io.BytesIO(content),
+            "image",
             metadata={
                 "trait": trait,
                 "type": "character_image",
@@ -4872,13 +6736,18 @@ async def admin_upload_character_image(
             }
         )
         
+        # Drop the previous image for this trait, if any
+        existing = await db.character_images.find_one({"trait": trait})
+        if existing and existing.get('imageFileId'):
+            await delete_media_file(existing['imageFileId'])
+        
         # Upsert character image record
         await db.character_images.update_one(
             {"trait": trait},
             {
                 "$set": {
                     "trait": trait,
-                    "imageFileId": str(file_id),
+                    "imageFileId": str(stored.file_id),
                     "imageUrl": f"/api/character-images/{trait}/image",
                     "updatedAt": datetime.now(timezone.utc)
                 }
@@ -4891,15 +6760,15 @@ async def admin_upload_character_image(
             "trait": trait,
             "imageUrl": f"/api/character-images/{trait}/image"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading character image: {str(e)}")
         raise HTTPException(status_code=500, detail="Errore durante il caricamento")
 
 @api_router.get("/character-images/{trait}/image")
-async def get_character_image(trait: str):
+async def get_character_image(trait: str, request: Request, derivative: Optional[DerivativeRequest] = Depends(image_derivative_params)):
     """Serve character trait image"""
-    from bson import ObjectId
-    
     if trait not in CHARACTER_TRAITS:
         raise HTTPException(status_code=400, detail="Invalid trait")
     
@@ -4908,15 +6777,13 @@ async def get_character_image(trait: str):
         raise HTTPException(status_code=404, detail="Immagine non trovata")
     
     try:
-        grid_out = await gridfs_bucket.open_download_stream(ObjectId(record['imageFileId']))
-        content = await grid_out.read()
-        metadata = grid_out.metadata or {}
-        content_type = metadata.get('content_type', 'image/png')
-        
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type=content_type,
-            headers={"Cache-Control": "public, max-age=3600"}
+        return await stream_gridfs_file(
+            record['imageFileId'],
+            default_content_type='image/png',
+            headers={"Cache-Control": "public, max-age=3600"},
+            request=request,
+            derivative=derivative,
+            cacheable=True
         )
     except Exception as e:
         logger.error(f"Error serving character image: {str(e)}")
@@ -4925,17 +6792,12 @@ async def get_character_image(trait: str):
 @admin_router.delete("/character-images/{trait}")
 async def admin_delete_character_image(trait: str, email: str = Depends(verify_token)):
     """Delete character trait image"""
-    from bson import ObjectId
-    
     if trait not in CHARACTER_TRAITS:
         raise HTTPException(status_code=400, detail="Invalid trait")
     
     record = await db.character_images.find_one({"trait": trait})
     if record and record.get('imageFileId'):
-        try:
-            await gridfs_bucket.delete(ObjectId(record['imageFileId']))
-        except Exception:
-            pass
+        await delete_media_file(record['imageFileId'])
     
     await db.character_images.delete_one({"trait": trait})
     return {"success": True}
@@ -4993,8 +6855,13 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    try:
+        await media_store.access.flush(media_store.files)
+    except Exception as e:
+        logger.warning(f"Could not flush media access counts: {str(e)}")
     client.close()
@@ -4,3 +4,27 @@ import { twMerge } from "tailwind-merge"
 export function cn(...inputs) {
   return twMerge(clsx(inputs));
 }
+
+// Inline placeholder and dominant colour from the API, painted until the real image loads
+export function placeholderStyle(item) {
+  if (!item?.placeholder && !item?.dominantColor) return undefined;
+  return {
+    backgroundColor: item.dominantColor,
+    backgroundImage: item.placeholder ? `url(${item.placeholder})` : undefined,
+    backgroundSize: "cover",
+    backgroundPosition: "center",
+  };
+}
+
+// Background style showing one tile of a sprite sheet (manifest from /api/.../sprite) in a square box
+export function spriteTileStyle(sprite, id, backendUrl = "") {
+  const tile = sprite?.ready ? sprite.tiles[id] : null;
+  if (!tile) return undefined;
+  const { width, height, tileSize } = sprite;
+  const percent = (offset, size) => (size > tileSize ? (offset / (size - tileSize)) * 100 : 0);
+  return {
+    backgroundImage: `url(${backendUrl}${sprite.spriteUrl})`,
+    backgroundSize: `${(width / tileSize) * 100}% ${(height / tileSize) * 100}%`,
+    backgroundPosition: `${percent(tile.x, width)}% ${percent(tile.y, height)}%`,
+  };
+}
@@ -5,6 +5,7 @@ import { Button } from '../components/ui/button';
 import { Card, CardContent } from '../components/ui/card';
 import { Badge } from '../components/ui/badge';
 import Navbar from '../components/layout/Navbar';
+import { placeholderStyle } from '../lib/utils';
 import Footer from '../components/layout/Footer';
 import SEO from '../components/SEO';
 import { getBooks, getSiteSettings } from '../services/api';
@@ -105,9 +106,11 @@ const BooksPage = () => {
                   <div className="relative h-64 bg-gradient-to-br from-pink-100 to-blue-100 flex items-center justify-center overflow-hidden">
                     {book.coverImageFileId ? (
                       <img 
-                        src={`${BACKEND_URL}/api/books/${book.id}/cover`}
+                        src={`${BACKEND_URL}${book.thumbnailUrl || `/api/books/${book.id}/cover`}`}
                         alt={`Libro illustrato per bambini ${book.title} – Poppiconni`}
                         className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-300"
+                        style={placeholderStyle(book)}
+                        loading="lazy"
                       />
                     ) : (
                       <div className="text-center">
@@ -7,7 +7,7 @@ import { Badge } from '../components/ui/badge';
 import Navbar from '../components/layout/Navbar';
 import Footer from '../components/layout/Footer';
 import SEO from '../components/SEO';
-import { getBundles, getIllustrations, downloadIllustration, checkDownloadStatus, getSiteSettings } from '../services/api';
+import { getBundles, getIllustrations, downloadIllustration, checkDownloadStatus, getIllustrationStatuses, getSiteSettings } from '../services/api';
 import { toast } from 'sonner';
 
 const DownloadPage = () => {
@@ -16,6 +16,7 @@ const DownloadPage = () => {
   const [loading, setLoading] = useState(true);
   const [downloading, setDownloading] = useState({});
   const [siteSettings, setSiteSettings] = useState({ stripe_enabled: false });
+  const [statuses, setStatuses] = useState({});
 
   useEffect(() => {
     const fetchData = async () => {
@@ -28,6 +29,9 @@ const DownloadPage = () => {
         setBundles(bundlesData);
         setFreeIllustrations(illustrationsData);
         setSiteSettings(settingsData);
+        getIllustrationStatuses(illustrationsData.map(i => i.id))
+          .then(data => setStatuses(data.illustrations))
+          .catch(() => setStatuses({}));
       } catch (error) {
         console.error('Error fetching data:', error);
       } finally {
@@ -38,9 +42,9 @@ const DownloadPage = () => {
   }, []);
 
   const handleDownloadIllustration = async (illustration) => {
-    // Check if file is available
+    // Check if file is available (batch status of the page, checked again when it said no)
     try {
-      const status = await checkDownloadStatus(illustration.id);
+      const status = statuses[illustration.id]?.available ? statuses[illustration.id] : await checkDownloadStatus(illustration.id);
       if (!status.available) {
         toast.error('File non ancora disponibile. Il PDF deve essere caricato dall\'amministratore.');
         return;
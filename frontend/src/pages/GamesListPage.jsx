@@ -5,6 +5,7 @@ import { Card, CardContent } from '../components/ui/card';
 import { Button } from '../components/ui/button';
 import { Badge } from '../components/ui/badge';
 import Navbar from '../components/layout/Navbar';
+import { placeholderStyle } from '../lib/utils';
 import Footer from '../components/layout/Footer';
 import SEO from '../components/SEO';
 import { getGames } from '../services/api';
@@ -128,7 +129,10 @@ const GamesListPage = () => {
                       <div 
                         className="absolute inset-0 bg-cover bg-center"
                         style={{ 
-                          backgroundImage: `url(${BACKEND_URL}${game.cardImageUrl})`,
+                          ...placeholderStyle(game),
+                          backgroundImage: game.placeholder
+                            ? `url(${BACKEND_URL}${game.cardImageUrl}), url(${game.placeholder})`
+                            : `url(${BACKEND_URL}${game.cardImageUrl})`,
                           opacity: (game.cardImageOpacity || 35) / 100
                         }}
                       />
@@ -139,6 +143,7 @@ const GamesListPage = () => {
                       <img 
                         src={`${BACKEND_URL}${game.thumbnailUrl}`}
                         alt={game.title}
+                        style={placeholderStyle(game)}
                         className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-500"
                       />
                     ) : !game.cardImageUrl && (
@@ -5,6 +5,7 @@ import { Button } from '../components/ui/button';
 import { Badge } from '../components/ui/badge';
 import { Card, CardContent } from '../components/ui/card';
 import Navbar from '../components/layout/Navbar';
+import { placeholderStyle } from '../lib/utils';
 import Footer from '../components/layout/Footer';
 import { searchIllustrations } from '../services/api';
 import { toast } from 'sonner';
@@ -123,9 +124,13 @@ const SearchPage = () => {
                 <div className="aspect-square bg-gradient-to-br from-pink-50 to-blue-50 relative overflow-hidden">
                   {illustration.imageFileId ? (
                     <img
-                      src={`${BACKEND_URL}/api/illustrations/${illustration.id}/image`}
+                      src={illustration.thumbnailUrl
+                        ? `${BACKEND_URL}${illustration.thumbnailUrl}`
+                        : `${BACKEND_URL}${illustration.imageUrl || `/api/illustrations/${illustration.id}/image`}?w=480`}
+                      srcSet={`${BACKEND_URL}${illustration.imageUrl || `/api/illustrations/${illustration.id}/image`}?w=960 2x`}
                       alt={illustration.title}
                       className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-300"
+                      style={placeholderStyle(illustration)}
                       loading="lazy"
                     />
                   ) : (
@@ -7,8 +7,9 @@ import { Badge } from '../components/ui/badge';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '../components/ui/dialog';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '../components/ui/select';
 import Navbar from '../components/layout/Navbar';
+import { placeholderStyle, spriteTileStyle } from '../lib/utils';
 import Footer from '../components/layout/Footer';
-import { getTheme, getIllustrations, downloadIllustration, checkDownloadStatus, getSiteSettings } from '../services/api';
+import { getTheme, getIllustrations, getThemeSprite, downloadIllustration, checkDownloadStatus, getIllustrationStatuses, getSiteSettings } from '../services/api';
 import { toast } from 'sonner';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -22,6 +23,8 @@ const ThemePage = () => {
   const [loading, setLoading] = useState(true);
   const [downloading, setDownloading] = useState({});
   const [siteSettings, setSiteSettings] = useState({ stripe_enabled: false });
+  const [sprite, setSprite] = useState(null);
+  const [statuses, setStatuses] = useState({});
 
   useEffect(() => {
     const fetchData = async () => {
@@ -34,6 +37,9 @@ const ThemePage = () => {
         setTheme(themeData);
         setIllustrations(illustrationsData);
         setSiteSettings(settingsData);
+        getIllustrationStatuses(illustrationsData.map(i => i.id))
+          .then(data => setStatuses(data.illustrations))
+          .catch(() => setStatuses({}));
       } catch (error) {
         console.error('Error fetching data:', error);
       } finally {
@@ -41,6 +47,8 @@ const ThemePage = () => {
       }
     };
     fetchData();
+    // One sprite sheet for all cards; cards without a tile load their own image
+    getThemeSprite(themeId).then(setSprite).catch(() => setSprite(null));
     
     // Load favorites from localStorage
     const savedFavorites = JSON.parse(localStorage.getItem('pompiconni_favorites') || '[]');
@@ -74,9 +82,9 @@ const ThemePage = () => {
       return;
     }
     
-    // Check if file is available
+    // Check if file is available (batch status of the page, checked again when it said no)
     try {
-      const status = await checkDownloadStatus(illustration.id);
+      const status = statuses[illustration.id]?.available ? statuses[illustration.id] : await checkDownloadStatus(illustration.id);
       if (!status.available) {
         toast.error('File non ancora disponibile. Il PDF deve essere caricato dall\'amministratore.');
         return;
@@ -208,21 +216,33 @@ const ThemePage = () => {
         <div className="max-w-7xl mx-auto px-4 sm:px-6 lg:px-8">
           <div className="grid sm:grid-cols-2 lg:grid-cols-3 xl:grid-cols-4 gap-6">
             {filteredIllustrations.map((illustration) => {
-              // Use GridFS image if available, otherwise fall back to local uploads
-              const imageUrl = illustration.imageFileId 
-                ? `${BACKEND_URL}/api/illustrations/${illustration.id}/image`
-                : illustration.imageUrl 
-                  ? `${BACKEND_URL}${illustration.imageUrl}`
+              // API returns a content-addressed URL for GridFS images, or the local upload path
+              const imageUrl = illustration.imageUrl 
+                ? `${BACKEND_URL}${illustration.imageUrl}`
+                : illustration.imageFileId 
+                  ? `${BACKEND_URL}/api/illustrations/${illustration.id}/image`
                   : null;
+              // GridFS images are resized server-side (?w= from the size whitelist)
+              const sizedUrl = (width) => (imageUrl && illustration.imageFileId ? `${imageUrl}?w=${width}` : imageUrl);
               
               return (
               <Card key={illustration.id} className="border-0 shadow-lg hover-lift overflow-hidden group">
                 <div className="relative h-48 bg-gray-50 flex items-center justify-center">
-                  {imageUrl ? (
+                  {spriteTileStyle(sprite, illustration.id) ? (
+                    <div
+                      role="img"
+                      aria-label={illustration.title}
+                      className="h-full aspect-square"
+                      style={spriteTileStyle(sprite, illustration.id, BACKEND_URL)}
+                    />
+                  ) : imageUrl ? (
                     <img 
-                      src={imageUrl} 
+                      src={illustration.thumbnailUrl ? `${BACKEND_URL}${illustration.thumbnailUrl}` : sizedUrl(480)} 
+                      srcSet={illustration.imageFileId ? `${sizedUrl(480)} 1x, ${sizedUrl(960)} 2x` : undefined}
                       alt={illustration.title}
                       className="w-full h-full object-cover"
+                      style={placeholderStyle(illustration)}
+                      loading="lazy"
                     />
                   ) : (
                     <div className="text-6xl opacity-30">🦄</div>
@@ -244,7 +264,7 @@ const ThemePage = () => {
                           <div className="h-64 bg-gray-100 rounded-lg flex items-center justify-center mb-4">
                             {imageUrl ? (
                               <img 
-                                src={imageUrl} 
+                                src={sizedUrl(640)} 
                                 alt={illustration.title}
                                 className="max-h-full max-w-full object-contain"
                               />
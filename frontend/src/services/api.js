@@ -32,6 +32,11 @@ export const getTheme = async (themeId) => {
   return response.data;
 };
 
+export const getThemeSprite = async (themeId) => {
+  const response = await api.get(`/themes/${themeId}/sprite`);
+  return response.data;
+};
+
 export const getIllustrations = async (themeId = null, isFree = null) => {
   const params = {};
   if (themeId) params.themeId = themeId;
@@ -58,6 +63,20 @@ export const checkDownloadStatus = async (illustrationId) => {
   return response.data;
 };
 
+// Availability of a whole gallery page in one request. Sent as a GET so the browser cache revalidates
+// it (ETag, 304 while the catalog is unchanged); id lists too long for a URL go through POST
+const STATUS_QUERY_MAX_LENGTH = 4000;
+
+export const getIllustrationStatuses = async (ids) => {
+  const query = [...ids].sort().join(',');
+  if (query.length > STATUS_QUERY_MAX_LENGTH) {
+    const response = await api.post('/illustrations/status', { ids });
+    return response.data;
+  }
+  const response = await api.get('/illustrations/status', { params: { ids: query } });
+  return response.data;
+};
+
 export const searchIllustrations = async (q, limit = 48) => {
   const response = await api.get(`/search/illustrations`, { params: { q, limit } });
   return response.data;
@@ -0,0 +1,24 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Backend modules are imported by name, as the server does
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+# The Motor client connects lazily: importing server needs no MongoDB
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:1")
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """Media store of the server, with server.db, on an in-memory mongomock-motor database"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import server
+    from media_storage import MediaStore
+
+    db = mongomock_motor.AsyncMongoMockClient()["test"]
+    media_store = MediaStore(db, backend="gridfs")
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "media_store", media_store)
+    return media_store
@@ -0,0 +1,96 @@
+import json
+import zipfile
+
+import pytest
+
+from bulk_import import BulkImportError, DirectorySource, ZipSource, read_manifest
+
+MAX_BYTES = 1024 * 1024
+
+
+def write_package(root, files):
+    for name, content in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content.encode("utf-8") if isinstance(content, str) else content)
+    return DirectorySource(str(root))
+
+
+def test_read_manifest_json(tmp_path):
+    manifest = [
+        {"title": "Uno", "themeId": "t1", "image": "img/uno.png", "pdf": "uno.pdf", "isFree": "no", "price": "1,50"},
+        {"title": "Due", "themeId": "t1", "pdf": "due.pdf"},
+        {"title": "", "themeId": "t1", "pdf": "tre.pdf"},
+        {"title": "Quattro", "themeId": "t1", "image": "quattro.gif"},
+        "not a row"
+    ]
+    source = write_package(tmp_path, {"manifest.json": json.dumps(manifest)})
+    rows, rejected = read_manifest(source, MAX_BYTES)
+
+    assert [row.title for row in rows] == ["Uno", "Due"]
+    first = rows[0]
+    assert (first.line, first.image, first.pdf, first.is_free, first.price) == (1, "img/uno.png", "uno.pdf", False, 1.5)
+    assert rows[1].is_free and rows[1].image is None
+    assert [entry["line"] for entry in rejected] == [3, 4, 5]
+
+
+def test_read_manifest_json_object_with_illustrations(tmp_path):
+    source = write_package(tmp_path, {"manifest.json": json.dumps({"illustrations": [{"title": "A", "themeId": "t", "pdf": "a.pdf"}]})})
+    rows, rejected = read_manifest(source, MAX_BYTES)
+    assert [row.title for row in rows] == ["A"] and not rejected
+
+
+def test_read_manifest_csv_with_semicolons_in_a_folder(tmp_path):
+    manifest = "\ufefftitle;themeId;image;price\nUno;t1;uno.jpg;2\nDue;;due.jpg;\nTre;t1;tre.jpg;abc\n"
+    archive = tmp_path / "package.zip"
+    with zipfile.ZipFile(archive, "w") as package:
+        package.writestr("pack/manifest.csv", manifest)
+    source = ZipSource(str(archive))
+    try:
+        rows, rejected = read_manifest(source, MAX_BYTES)
+    finally:
+        source.close()
+
+    assert len(rows) == 1
+    assert (rows[0].line, rows[0].image, rows[0].price) == (2, "pack/uno.jpg", 2.0)
+    assert [entry["line"] for entry in rejected] == [3, 4]
+
+
+@pytest.mark.parametrize("files", [
+    {},
+    {"a/b/manifest.json": "[]"},
+    {"manifest.json": "{not json"},
+    {"manifest.json": json.dumps({"rows": []})},
+    {"manifest.csv": b"title\n\xff\xfe"},
+])
+def test_read_manifest_rejects_unusable_manifest(tmp_path, files):
+    with pytest.raises(BulkImportError):
+        read_manifest(write_package(tmp_path, files), MAX_BYTES)
+
+
+def test_directory_source_reads_entries(tmp_path):
+    source = write_package(tmp_path / "package", {"img/uno.png": b"png", "manifest.json": "[]"})
+    assert sorted(source.names()) == ["img/uno.png", "manifest.json"]
+    assert source.read("img/uno.png", MAX_BYTES) == b"png"
+    with pytest.raises(BulkImportError):
+        source.read("img/uno.png", 2)
+    with pytest.raises(BulkImportError):
+        source.read("missing.png", MAX_BYTES)
+
+
+@pytest.mark.parametrize("name", ["../secret.txt", "img/../../secret.txt", "/etc/passwd", "."])
+def test_directory_source_rejects_paths_outside_the_package(tmp_path, name):
+    (tmp_path / "secret.txt").write_text("secret")
+    source = write_package(tmp_path / "package", {"manifest.json": "[]"})
+    with pytest.raises(BulkImportError):
+        source._path(name)
+    with pytest.raises(BulkImportError):
+        source.read(name, MAX_BYTES)
+
+
+def test_directory_source_rejects_symlinks_out_of_the_package(tmp_path):
+    (tmp_path / "secret.txt").write_text("secret")
+    source = write_package(tmp_path / "package", {"manifest.json": "[]"})
+    (tmp_path / "package" / "link.txt").symlink_to(tmp_path / "secret.txt")
+    with pytest.raises(BulkImportError):
+        source.read("link.txt", MAX_BYTES)
@@ -0,0 +1,41 @@
+import asyncio
+import os
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+pytest.importorskip("mongomock_motor")
+
+import server  # noqa: E402
+
+
+async def stored_with_derivative(store):
+    file_id = await store.upload("a.png", os.urandom(1500), metadata={"content_type": "image/png"})
+    await store.upload("a_400.webp", b"derivative", metadata={
+        "content_type": "image/webp", "derivative_key": f"{file_id}:400x0:contain:image/webp", "source_file_id": str(file_id)
+    }, dedup=False)
+    return file_id
+
+
+def test_delete_media_file_removes_file_and_derivatives(store):
+    async def run():
+        file_id = await stored_with_derivative(store)
+        assert await server.delete_media_file(str(file_id))
+        assert await store.files.count_documents({}) == 0
+        assert not await server.delete_media_file(str(file_id))
+
+    asyncio.run(run())
+
+
+def test_failed_release_leaves_file_and_derivatives(store, monkeypatch):
+    async def run():
+        file_id = await stored_with_derivative(store)
+
+        async def unavailable(file_id):
+            raise AutoReconnect("primary stepped down")
+
+        monkeypatch.setattr(store, "delete", unavailable)
+        assert not await server.delete_media_file(str(file_id))
+        assert await store.files.count_documents({}) == 2
+
+    asyncio.run(run())
@@ -0,0 +1,88 @@
+import io
+import random
+
+import pytest
+from PIL import Image, ImageChops, ImageCms
+
+from image_processing import _lossless_modes, recompress_png
+
+SIZE = (64, 48)
+
+
+def png(img, **options):
+    out = io.BytesIO()
+    img.save(out, format="PNG", compress_level=0, **options)
+    return out.getvalue()
+
+
+def pixels(rng, mode, pick):
+    img = Image.new(mode, SIZE)
+    img.putdata([pick(rng) for _ in range(SIZE[0] * SIZE[1])])
+    return img
+
+
+def same_pixels(first, second):
+    return ImageChops.difference(first.convert("RGBA"), second.convert("RGBA")).getbbox() is None
+
+
+PALETTE = [(200, 30, 30), (30, 200, 30), (30, 30, 200), (250, 250, 0)]
+
+SOURCES = {
+    # expected mode: source image (stored in a wider mode than needed)
+    "RGB": lambda rng: pixels(rng, "RGBA", lambda r: (r.randrange(256), r.randrange(256), r.randrange(256), 255)),
+    "RGBA": lambda rng: pixels(rng, "RGBA", lambda r: (r.randrange(256), r.randrange(256), r.randrange(256), r.choice([0, 128, 255]))),
+    "L": lambda rng: pixels(rng, "RGB", lambda r: (lambda v: (v, v, v))(r.randrange(256))),
+    "LA": lambda rng: pixels(rng, "RGBA", lambda r: (lambda v: (v, v, v, r.choice([0, 255])))(r.randrange(0, 256, 2))),
+    "1": lambda rng: pixels(rng, "RGB", lambda r: r.choice([(0, 0, 0), (255, 255, 255)])),
+    "P": lambda rng: pixels(rng, "RGB", lambda r: r.choice(PALETTE)),
+}
+
+
+@pytest.mark.parametrize("mode", SOURCES)
+def test_recompress_png_keeps_every_pixel(mode):
+    source = SOURCES[mode](random.Random(mode))
+    content = png(source)
+    output, info = recompress_png(content)
+
+    assert len(output) < len(content)
+    with Image.open(io.BytesIO(output)) as result:
+        assert result.mode == mode
+        assert same_pixels(result, source)
+    assert (info["width"], info["height"], info["mode"], info["byte_size"]) == (*SIZE, mode, len(output))
+
+
+@pytest.mark.parametrize("mode", SOURCES)
+def test_lossless_modes_are_pixel_identical(mode):
+    source = SOURCES[mode](random.Random(mode))
+    for candidate in _lossless_modes(source):
+        assert same_pixels(candidate, source)
+
+
+def test_lossless_modes_keep_partial_alpha():
+    source = SOURCES["RGBA"](random.Random(1))
+    assert all(candidate.mode not in ("RGB", "L", "1", "P") for candidate in _lossless_modes(source))
+
+
+def test_recompress_png_keeps_rgb_profile_out_of_grey_modes():
+    profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    source = SOURCES["L"](random.Random(2))
+    output, _ = recompress_png(png(source, icc_profile=profile))
+
+    with Image.open(io.BytesIO(output)) as result:
+        assert result.mode in ("RGB", "P")
+        assert result.info.get("icc_profile") == profile
+        assert same_pixels(result, source)
+
+
+def test_recompress_png_keeps_profile_in_matching_modes():
+    profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    source = SOURCES["P"](random.Random(3))
+    output, _ = recompress_png(png(source, icc_profile=profile))
+
+    with Image.open(io.BytesIO(output)) as result:
+        assert result.mode == "P"
+        assert result.info.get("icc_profile") == profile
+
+
+def test_recompress_png_without_saving_returns_none():
+    assert recompress_png(png(Image.new("1", (8, 8)), optimize=True)) is None
@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from media_access import AccessTracker
+
+
+class FailingFiles:
+    """files collection whose bulk_write raises error(batch) for the batch it receives"""
+
+    def __init__(self, error):
+        self.error = error
+        self.batches = []
+
+    async def bulk_write(self, requests, ordered=True):
+        self.batches.append(requests)
+        raise self.error(requests)
+
+
+def test_record_counts_every_request():
+    tracker = AccessTracker()
+    first, second = ObjectId(), ObjectId()
+    for file_id in (first, first, str(first), second):
+        tracker.record(file_id)
+    assert tracker.counts == {str(first): 3, str(second): 1}
+    assert set(tracker.last_access) == {str(first), str(second)}
+    assert not tracker.full.is_set()
+
+
+def test_full_is_set_at_max_files():
+    tracker = AccessTracker(max_files=3)
+    for _ in range(2):
+        tracker.record(ObjectId())
+    assert not tracker.full.is_set()
+    tracker.record(ObjectId())
+    assert tracker.full.is_set()
+
+
+def test_flush_writes_counts_and_resets():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def run():
+        files = mongomock_motor.AsyncMongoMockClient()["test"]["fs.files"]
+        file_id = ObjectId()
+        await files.insert_one({"_id": file_id, "accessCount": 2})
+        tracker = AccessTracker(max_files=1)
+        tracker.record(file_id)
+        tracker.record(file_id)
+        tracker.record("not-an-id")
+        assert await tracker.flush(files) == 1
+        assert not tracker.counts and not tracker.last_access and not tracker.full.is_set()
+        doc = await files.find_one({"_id": file_id})
+        assert doc["accessCount"] == 4
+        assert doc["accessedAt"].replace(tzinfo=timezone.utc) <= datetime.now(timezone.utc)
+
+    asyncio.run(run())
+
+
+def test_flush_failure_keeps_counts_for_next_flush():
+    tracker = AccessTracker()
+    file_id = ObjectId()
+    tracker.record(file_id)
+    files = FailingFiles(lambda requests: ConnectionError("down"))
+    with pytest.raises(ConnectionError):
+        asyncio.run(tracker.flush(files))
+    # Requests recorded while the flush ran are added, not overwritten
+    tracker.record(file_id)
+    assert tracker.counts[str(file_id)] == 2
+
+
+def test_flush_bulk_error_keeps_only_unwritten_counts():
+    tracker = AccessTracker()
+    written, failed = ObjectId(), ObjectId()
+    tracker.record(written)
+    tracker.record(failed)
+    tracker.record(failed)
+
+    def error(requests):
+        index = [request._filter["_id"] for request in requests].index(failed)
+        return BulkWriteError({"writeErrors": [{"index": index, "code": 1, "errmsg": "failed"}]})
+
+    with pytest.raises(BulkWriteError):
+        asyncio.run(tracker.flush(FailingFiles(error)))
+    assert tracker.counts == {str(failed): 2}
@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import struct
+import time
+
+import media_cache
+from media_cache import DISK_EVICT_MIN_AGE_SECONDS, MediaDiskCache, SharedMediaCache
+
+
+async def chunks_of(data, size=1000):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def test_materialize_ignores_max_file_bytes(tmp_path):
+    data = os.urandom(5000)
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    async def run():
+        cache = MediaDiskCache(str(tmp_path), max_bytes=1 << 20, max_file_bytes=1000)
+        await cache.start()
+        cache.schedule_fill(sha256, len(data), lambda: chunks_of(data))
+        assert not cache._fills
+        path = await cache.materialize(sha256, lambda: chunks_of(data))
+        assert path.read_bytes() == data
+
+    asyncio.run(run())
+
+
+def test_eviction_spares_recently_used_files(tmp_path):
+    old, new = os.urandom(3000), os.urandom(3000)
+
+    async def run():
+        cache = MediaDiskCache(str(tmp_path), max_bytes=4000, max_file_bytes=1 << 20)
+        await cache.start()
+        old_path = await cache.materialize(hashlib.sha256(old).hexdigest(), lambda: chunks_of(old))
+        stale = time.time() - DISK_EVICT_MIN_AGE_SECONDS - 10
+        os.utime(old_path, (stale, stale))
+        # Over budget: the stale file goes, the one just written stays (even alone above the budget)
+        new_path = await cache.materialize(hashlib.sha256(new).hexdigest(), lambda: chunks_of(new))
+        assert not old_path.exists() and new_path.exists()
+        cache.max_bytes = 1000
+        cache._evict()
+        assert new_path.exists()
+
+    asyncio.run(run())
+
+
+def doc_of(content):
+    return {"length": len(content), "metadata": {"content_type": "image/png"}}
+
+
+def shared_cache(tmp_path, max_bytes=1000, slot_count=64):
+    return SharedMediaCache(str(tmp_path / "media"), max_bytes=max_bytes, max_entry_bytes=max_bytes, slot_count=slot_count)
+
+
+def put_from_worker(tmp_path, file_id, content):
+    shared_cache(tmp_path).put(file_id, doc_of(content), content)
+
+
+def test_shared_cache_entry_written_by_another_process(tmp_path):
+    reader = shared_cache(tmp_path)
+    assert reader.get("a") is None
+    content = os.urandom(300)
+    worker = multiprocessing.get_context("fork").Process(target=put_from_worker, args=(tmp_path, "a", content))
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+
+    cached = reader.get("a")
+    assert cached.content == content
+    assert cached.file_doc == doc_of(content) and cached.content_type == "image/png"
+    reader.invalidate("a")
+    assert shared_cache(tmp_path).get("a") is None
+
+
+def test_shared_cache_evicts_oldest_entries_on_wrap(tmp_path):
+    writer, reader = shared_cache(tmp_path), shared_cache(tmp_path)
+    contents = {f"f{i}": bytes([i]) * 250 for i in range(6)}
+    for file_id, content in contents.items():
+        writer.put(file_id, doc_of(content), content)
+        assert reader.get(file_id).content == content
+
+    # About three entries fit in 1000 bytes: the oldest were overwritten, never served with new data
+    served = {file_id: reader.get(file_id) for file_id in contents}
+    assert served["f0"] is None and served["f1"] is None
+    assert served["f5"].content == contents["f5"]
+    for file_id, cached in served.items():
+        assert cached is None or cached.content == contents[file_id]
+    assert reader.stats()["entries"] == sum(cached is not None for cached in served.values())
+
+
+def test_shared_cache_full_eviction_log_drops_oldest_entry(tmp_path):
+    writer, reader = shared_cache(tmp_path, max_bytes=4000, slot_count=4), shared_cache(tmp_path, max_bytes=4000, slot_count=4)
+    for i in range(10):
+        writer.put(f"f{i}", doc_of(b"x"), bytes([i]) * 10)
+    # One log record per entry: with the log full every new entry evicts the oldest one
+    assert reader.stats()["entries"] <= 4
+    assert reader.get("f9").content == bytes([9]) * 10
+    assert reader.get("f0") is None
+
+
+def test_shared_cache_rejects_entry_changed_while_read(tmp_path, monkeypatch):
+    writer, reader = shared_cache(tmp_path), shared_cache(tmp_path)
+    writer.put("a", doc_of(b"old"), b"old" * 50)
+    unpack_from = struct.unpack_from
+    changes = [lambda: writer.invalidate("a")]
+
+    def write_during_copy(fmt, buffer, offset=0):
+        # Runs between the copy of the data and the check of the sequence counter
+        if changes:
+            changes.pop()()
+        return unpack_from(fmt, buffer, offset)
+
+    monkeypatch.setattr(media_cache.struct, "unpack_from", write_during_copy)
+    assert reader.get("a") is None
+
+    writer.put("a", doc_of(b"old"), b"old" * 50)
+    changes.append(lambda: writer.put("a", doc_of(b"new"), b"new" * 50))
+    assert reader.get("a").content == b"new" * 50
+    assert reader.get("a").file_doc == doc_of(b"new")
+
+
+def test_shared_cache_skips_slot_being_written(tmp_path):
+    writer, reader = shared_cache(tmp_path), shared_cache(tmp_path)
+    writer.put("a", doc_of(b"data"), b"data")
+    index = next(i for i in writer._probe(writer._digest("a"))
+                 if writer.SLOT.unpack_from(writer._mm, writer._slot_offset(i))[1] == writer._digest("a"))
+    position = writer._slot_offset(index)
+    seq = struct.unpack_from("<Q", writer._mm, position)[0]
+    struct.pack_into("<Q", writer._mm, position, seq + 1)
+    assert reader.get("a") is None
+    struct.pack_into("<Q", writer._mm, position, seq + 2)
+    assert reader.get("a").content == b"data"
@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+
+from media_http import (
+    MAX_RANGES_PER_REQUEST, RangeNotSatisfiable, parse_range_header, is_initial_range_request, starts_download,
+    file_etag, file_last_modified, http_date, is_not_modified
+)
+
+
+@pytest.mark.parametrize("header", [None, "", "items=0-1", "bytes=", "bytes=a-1", "bytes=5-2", "bytes=-", "bytes=1"])
+def test_parse_range_header_ignores_missing_or_malformed(header):
+    assert parse_range_header(header, 100) is None
+
+
+@pytest.mark.parametrize("header, ranges", [
+    ("bytes=0-9", [(0, 9)]),
+    ("bytes=90-", [(90, 99)]),
+    ("bytes=-10", [(90, 99)]),
+    ("bytes=-500", [(0, 99)]),
+    ("bytes=50-500", [(50, 99)]),
+    ("bytes=0-9,200-300", [(0, 9)]),
+])
+def test_parse_range_header_resolves_against_length(header, ranges):
+    assert parse_range_header(header, 100) == ranges
+
+
+def test_parse_range_header_coalesces_overlapping_and_adjacent_ranges():
+    assert parse_range_header("bytes=20-29,0-9,25-40,10-12", 100) == [(0, 12), (20, 40)]
+    assert parse_range_header("bytes=0-0,1-1,2-2", 100) == [(0, 2)]
+
+
+@pytest.mark.parametrize("header, length", [("bytes=100-", 100), ("bytes=-0", 100), ("bytes=-5", 0)])
+def test_parse_range_header_unsatisfiable(header, length):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, length)
+
+
+def test_parse_range_header_too_many_ranges_sends_full_body():
+    header = "bytes=" + ",".join(f"{n * 10}-{n * 10 + 1}" for n in range(MAX_RANGES_PER_REQUEST + 1))
+    assert parse_range_header(header, 1000) is None
+
+
+@pytest.mark.parametrize("header, initial", [
+    (None, True),
+    ("garbage", True),
+    ("bytes=0-99", True),
+    ("bytes=500-,0-9", True),
+    ("bytes=100-", False),
+    ("bytes=-100", False),
+])
+def test_is_initial_range_request(header, initial):
+    assert is_initial_range_request(header) is initial
+
+
+def test_starts_download():
+    assert starts_download(None)
+    assert starts_download([(0, 9), (20, 29)])
+    assert not starts_download([(10, 99)])
+
+
+def test_file_etag_uses_md5_when_stored():
+    assert file_etag({"_id": ObjectId(), "md5": "abc"}) == '"abc"'
+
+
+def test_file_etag_from_id_and_upload_date():
+    file_id = ObjectId()
+    uploaded = datetime(2024, 1, 1, 12, 0, 0, 500000)
+    etag = file_etag({"_id": file_id, "uploadDate": uploaded})
+    assert etag.startswith(f'"{file_id}-') and etag.endswith('"')
+    assert etag == file_etag({"_id": file_id, "uploadDate": uploaded})
+    assert etag != file_etag({"_id": file_id, "uploadDate": datetime(2024, 1, 2)})
+
+
+def test_file_last_modified_is_utc_seconds():
+    modified = file_last_modified({"uploadDate": datetime(2024, 1, 1, 12, 0, 0, 500000)})
+    assert modified == datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+    assert file_last_modified({}) is None
+
+
+def test_is_not_modified_if_none_match():
+    etag = '"abc"'
+    assert is_not_modified({"if-none-match": '"abc"'}, etag, None)
+    assert is_not_modified({"if-none-match": 'W/"abc"'}, etag, None)
+    assert is_not_modified({"if-none-match": '"x", "abc"'}, etag, None)
+    assert is_not_modified({"if-none-match": "*"}, etag, None)
+    assert not is_not_modified({"if-none-match": '"other"'}, etag, None)
+    assert not is_not_modified({}, etag, None)
+
+
+def test_is_not_modified_if_modified_since():
+    modified = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+    assert is_not_modified({"if-modified-since": http_date(modified)}, '"abc"', modified)
+    assert not is_not_modified({"if-modified-since": "Mon, 01 Jan 2024 11:00:00 GMT"}, '"abc"', modified)
+    assert not is_not_modified({"if-modified-since": "not a date"}, '"abc"', modified)
+
+
+def test_is_not_modified_if_none_match_takes_precedence():
+    modified = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+    headers = {"if-none-match": '"other"', "if-modified-since": http_date(modified)}
+    assert not is_not_modified(headers, '"abc"', modified)
@@ -0,0 +1,127 @@
+import asyncio
+import io
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from PIL import Image
+
+pytest.importorskip("mongomock_motor")
+
+import server  # noqa: E402
+
+
+def grey_png() -> bytes:
+    """RGB PNG holding only grey pixels, stored uncompressed: recompressed to a much smaller L PNG"""
+    rng = random.Random(0)
+    img = Image.new("RGB", (64, 64))
+    img.putdata([(v, v, v) for v in (rng.randrange(0, 256, 16) for _ in range(64 * 64))])
+    out = io.BytesIO()
+    img.save(out, format="PNG", compress_level=0)
+    return out.getvalue()
+
+
+async def stored_png(store):
+    """A PNG shared by two illustrations (one with imageMeta), with a thumbnail derivative"""
+    content = grey_png()
+    metadata = {"content_type": "image/png"}
+    old_id = await store.upload("a.png", content, metadata=metadata)
+    assert await store.upload("a.png", content, metadata=metadata) == old_id
+    # Both illustrations linked it long ago
+    await store.blobs.update_many({}, {"$set": {"claimedAt": datetime.now(timezone.utc) - timedelta(days=2)}})
+    thumbnail_id = await store.upload("a_400.png", b"thumbnail", metadata={
+        "content_type": "image/png", "derivative_key": f"{old_id}:400x400:contain:image/png", "source_file_id": str(old_id)
+    }, dedup=False)
+    await server.db.illustrations.insert_many([
+        {"id": "1", "imageFileId": str(old_id), "imageMeta": {"mode": "RGB"}, "thumbnailFileId": str(thumbnail_id)},
+        {"id": "2", "imageFileId": str(old_id)}
+    ])
+    return old_id, thumbnail_id, content
+
+
+async def check_swapped(store, old_id, thumbnail_id, content):
+    first = await server.db.illustrations.find_one({"id": "1"})
+    second = await server.db.illustrations.find_one({"id": "2"})
+    new_id = first["imageFileId"]
+    assert new_id != str(old_id) and second["imageFileId"] == new_id
+    assert first["imageMeta"]["mode"] == "L" and "imageMeta" not in second
+    assert first["thumbnailFileId"] == str(thumbnail_id)
+
+    new_doc = await store.find(new_id)
+    old_sha256 = new_doc["metadata"]["recompressed_from"]["sha256"]
+    assert new_doc["metadata"]["recompressed_from"]["fileId"] == str(old_id)
+    assert await store.files.find_one({"_id": old_id}) is None
+    assert await store.blobs.find_one({"_id": old_sha256}) is None
+    assert (await store.blobs.find_one({"_id": new_doc["metadata"]["sha256"]}))["refs"] == 2
+    assert (await store.find_by_hash(old_sha256))["_id"] == new_doc["_id"]
+
+    thumbnail = await store.find(thumbnail_id)
+    assert thumbnail["metadata"]["source_file_id"] == new_id
+    assert thumbnail["metadata"]["derivative_key"].startswith(new_id + ":")
+
+    with Image.open(io.BytesIO(await store.read(new_doc))) as new, Image.open(io.BytesIO(content)) as old:
+        assert new.mode == "L" and list(new.convert("RGB").getdata()) == list(old.getdata())
+    return new_doc
+
+
+def test_recompress_swaps_references_blob_and_derivatives(store):
+    async def run():
+        old_id, thumbnail_id, content = await stored_png(store)
+        saved = await server.recompress_media_file(await store.find(old_id), "illustrations")
+        new_doc = await check_swapped(store, old_id, thumbnail_id, content)
+        assert saved == len(content) - new_doc["length"]
+
+    asyncio.run(run())
+
+
+def test_recently_claimed_file_is_postponed(store):
+    async def run():
+        old_id, _, _ = await stored_png(store)
+        # An upload just claimed it and may not have linked it yet
+        await store.blobs.update_many({}, {"$set": {"claimedAt": datetime.now(timezone.utc)}})
+        assert await server.recompress_media_file(await store.find(old_id), "illustrations") is None
+        old_doc = await store.find(old_id)
+        assert "recompressed" not in old_doc["metadata"] and "recompressed_to" not in old_doc["metadata"]
+        assert await store.files.count_documents({}) == 2
+
+    asyncio.run(run())
+
+
+def test_interrupted_swap_is_finished_by_the_next_run(store, monkeypatch):
+    async def run():
+        old_id, thumbnail_id, content = await stored_png(store)
+        swap = server.swap_recompressed_file
+
+        async def crash(*args):
+            raise RuntimeError("worker stopped")
+
+        monkeypatch.setattr(server, "swap_recompressed_file", crash)
+        with pytest.raises(RuntimeError):
+            await server.recompress_media_file(await store.find(old_id), "illustrations")
+        old_doc = await store.find(old_id)
+        assert old_doc["metadata"]["recompressed_to"]["fileId"]
+        # Fenced: the old content is no longer handed out to uploads
+        assert await store._claim_blob(old_doc["metadata"]["sha256"]) is None
+
+        monkeypatch.setattr(server, "swap_recompressed_file", swap)
+        await server.recompress_media_file(old_doc, "illustrations")
+        new_doc = await check_swapped(store, old_id, thumbnail_id, content)
+        assert str(new_doc["_id"]) == old_doc["metadata"]["recompressed_to"]["fileId"]
+        assert await store.files.count_documents({"metadata.recompressed_from.fileId": str(old_id)}) == 1
+
+    asyncio.run(run())
+
+
+def test_old_file_still_referenced_is_kept_until_the_next_run(store):
+    async def run():
+        old_id, thumbnail_id, content = await stored_png(store)
+        # Linked by a pending upload the reference pass does not cover
+        await server.db.upload_sessions.insert_one({"status": "open", "fileId": "x", "storedFile": {"fileId": str(old_id)}})
+        assert await server.recompress_media_file(await store.find(old_id), "illustrations") is None
+        assert await store.files.find_one({"_id": old_id})
+
+        await server.db.upload_sessions.delete_many({})
+        await server.recompress_media_file(await store.find(old_id), "illustrations")
+        await check_swapped(store, old_id, thumbnail_id, content)
+
+    asyncio.run(run())
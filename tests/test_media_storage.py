@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from bson import ObjectId
+from gridfs.errors import CorruptGridFile
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from media_storage import MediaStore  # noqa: E402
+
+CHUNK_SIZE = 1000
+
+
+def run_with_store(test):
+    async def run():
+        store = MediaStore(mongomock_motor.AsyncMongoMockClient()["test"], backend="gridfs")
+        await test(store)
+    asyncio.run(run())
+
+
+async def write_upload(store, content):
+    file_id = ObjectId()
+    for n in range(0, len(content), CHUNK_SIZE):
+        await store.write_chunk(file_id, n // CHUNK_SIZE, content[n:n + CHUNK_SIZE])
+    return file_id
+
+
+def test_assemble_is_idempotent():
+    content = os.urandom(2500)
+
+    async def test(store):
+        file_id = await write_upload(store, content)
+        first = await store.assemble(file_id, "a.png", len(content), CHUNK_SIZE, {"content_type": "image/png"})
+        again = await store.assemble(file_id, "a.png", len(content), CHUNK_SIZE, {"content_type": "image/png"})
+
+        assert first == again
+        assert first.file_id == file_id and first.sha256 == hashlib.sha256(content).hexdigest()
+        assert await store.files.count_documents({}) == 1
+        blob = await store.blobs.find_one({"_id": first.sha256})
+        assert blob["fileId"] == file_id and blob["refs"] == 1
+        assert await store.read(await store.find(file_id)) == content
+
+    run_with_store(test)
+
+
+def test_assemble_of_stored_content_returns_the_existing_file():
+    content = os.urandom(1500)
+
+    async def test(store):
+        stored = await store.assemble(await write_upload(store, content), "a.png", len(content), CHUNK_SIZE)
+        duplicate_id = await write_upload(store, content)
+        duplicate = await store.assemble(duplicate_id, "b.png", len(content), CHUNK_SIZE)
+
+        assert duplicate.file_id == stored.file_id
+        assert (await store.blobs.find_one({"_id": stored.sha256}))["refs"] == 2
+        assert await store.chunks.count_documents({"files_id": duplicate_id}) == 0
+
+    run_with_store(test)
+
+
+def test_assemble_rejects_missing_chunks():
+    content = os.urandom(2500)
+
+    async def test(store):
+        file_id = await write_upload(store, content)
+        await store.chunks.delete_one({"files_id": file_id, "n": 2})
+        with pytest.raises(CorruptGridFile):
+            await store.assemble(file_id, "a.png", len(content), CHUNK_SIZE)
+        assert await store.files.count_documents({}) == 0
+
+    run_with_store(test)
+
+
+async def stored_with_derivative(store, content):
+    file_id = await store.upload("a.png", content, metadata={"content_type": "image/png"})
+    derivative_id = await store.upload("a_400.webp", b"derivative", metadata={
+        "content_type": "image/webp", "derivative_key": f"{file_id}:400x0:contain:image/webp", "source_file_id": str(file_id)
+    }, dedup=False)
+    return file_id, derivative_id
+
+
+@pytest.mark.parametrize("release", ["delete", "delete_many"])
+def test_last_release_removes_derivatives(release):
+    content = os.urandom(1500)
+
+    async def test(store):
+        file_id, derivative_id = await stored_with_derivative(store, content)
+        assert await store.upload("b.png", content, metadata={"content_type": "image/png"}) == file_id
+
+        async def run_release():
+            if release == "delete":
+                return await store.delete(file_id)
+            return bool(await store.delete_many([file_id]))
+
+        # Shared: the first release keeps the file and its derivatives
+        assert not await run_release()
+        assert await store.files.count_documents({}) == 2
+        assert await run_release()
+        assert await store.files.count_documents({}) == 0
+        assert await store.chunks.count_documents({"files_id": derivative_id}) == 0
+
+    run_with_store(test)
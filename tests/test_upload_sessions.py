@@ -0,0 +1,88 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+pytest.importorskip("mongomock_motor")
+
+import server  # noqa: E402
+
+
+class ChunkRequest:
+    def __init__(self, body: bytes):
+        self.body = body
+        self.headers = {}
+
+    async def stream(self):
+        yield self.body
+
+
+async def open_session(db, size=10):
+    session = {
+        "id": str(uuid.uuid4()), "target": "poster_pdf", "targetId": "missing", "filename": "a.pdf", "size": size,
+        "sha256": None, "chunkSize": size, "chunkCount": 1, "fileId": ObjectId(), "bucket": server.PDFS_BUCKET,
+        "receivedChunks": [], "status": "open", "createdBy": "admin",
+        "createdAt": datetime.now(timezone.utc), "expiresAt": datetime.now(timezone.utc) + timedelta(hours=1)
+    }
+    await db.upload_sessions.insert_one(session)
+    return session
+
+
+def test_finalize_waits_for_a_chunk_being_written(store, monkeypatch):
+    async def run():
+        session = await open_session(server.db)
+        started, release = asyncio.Event(), asyncio.Event()
+        write_chunk = store.write_chunk
+
+        async def slow_write(*args):
+            started.set()
+            await release.wait()
+            await write_chunk(*args)
+
+        monkeypatch.setattr(store, "write_chunk", slow_write)
+        put = asyncio.create_task(server.put_upload_chunk(session['id'], 0, ChunkRequest(b"0123456789"), "admin"))
+        await started.wait()
+        with pytest.raises(HTTPException) as refused:
+            await server.finalize_upload_session(session['id'], "admin")
+        assert refused.value.status_code == 409
+        assert (await server.get_upload_session(session['id']))['status'] == "open"
+
+        release.set()
+        assert (await put)['chunk'] == 0
+        stored = await server.get_upload_session(session['id'])
+        assert stored['receivedChunks'] == [0] and stored['chunkWrites'] == []
+        # Past the claim: the missing target is reported, so the chunk write no longer holds finalize back
+        with pytest.raises(HTTPException) as missing:
+            await server.finalize_upload_session(session['id'], "admin")
+        assert missing.value.status_code == 404
+
+    asyncio.run(run())
+
+
+def test_abandoned_chunk_write_does_not_block_finalize(store):
+    async def run():
+        session = await open_session(server.db)
+        started = datetime.now(timezone.utc) - timedelta(seconds=server.UPLOAD_CHUNK_WRITE_LEASE_SECONDS + 1)
+        await server.db.upload_sessions.update_one(
+            {"id": session['id']}, {"$push": {"chunkWrites": {"id": "lost", "chunk": 0, "startedAt": started}}}
+        )
+        with pytest.raises(HTTPException) as missing:
+            await server.finalize_upload_session(session['id'], "admin")
+        assert missing.value.detail.startswith("Blocchi mancanti")
+
+    asyncio.run(run())
+
+
+def test_chunk_is_not_written_once_finalize_started(store):
+    async def run():
+        session = await open_session(server.db)
+        await server.db.upload_sessions.update_one({"id": session['id']}, {"$set": {"status": "finalizing"}})
+        with pytest.raises(HTTPException) as closed:
+            await server.put_upload_chunk(session['id'], 0, ChunkRequest(b"0123456789"), "admin")
+        assert closed.value.status_code == 409
+        assert await store.chunks_of(server.PDFS_BUCKET).count_documents({}) == 0
+
+    asyncio.run(run())